@@ -3,6 +3,10 @@ PORT = 1234
 
 LOG_LEVEL = "INFO"
 LOG_TO_FILE = True
+LOG_FLUSH_INTERVAL_MS = 200
+LOG_FLUSH_BYTES = 65536
+LOG_DURABILITY = "periodic"
+LOG_FSYNC_INTERVAL_SECONDS = 2.0
 
 API_URL = "http://127.0.0.1:1235/v1/chat/completions"
 MODEL = "huihui-qwen3-vl-2b-instruct-abliterated"
@@ -10,6 +14,26 @@ TEMPERATURE = 0.7
 TOP_P = 0.9
 MAX_TOKENS = 1000
 VLM_HTTP_TIMEOUT_SECONDS = 0.0
+VLM_KEEPALIVE = True
+VLM_POOL_SIZE = 2
+VLM_GZIP_REQUESTS = False
+VLM_GZIP_LEVEL = 6
+VLM_STREAM = False
+VLM_EARLY_ACTIONS = False
+VLM_MAX_IN_FLIGHT = 4
+VLM_PRIORITY = 0
+VLM_RETRY_MAX = 4
+VLM_RETRY_BASE_SECONDS = 0.5
+VLM_RETRY_MAX_SECONDS = 8.0
+VLM_ERROR_COOLDOWN_SECONDS = 10.0
+VLM_BATCH_WINDOW_MS = 50
+VLM_BATCH_MAX = 8
+VLM_CACHE_SIZE = 256
+VLM_CACHE_TTL_SECONDS = 600
+VLM_IMAGE_MAX_PIXELS = 0
+VLM_IMAGE_PATCH = 0
+VLM_IMAGE_FORMAT = "png"
+VLM_IMAGE_LOSSY_BITS = 5
 
 SYSTEM_PROMPT = (
     "You are controlling a Windows desktop via a vision loop.\n"
@@ -40,9 +64,37 @@ CAPTURE_WIDTH = 512
 CAPTURE_HEIGHT = 288
 CAPTURE_SCALE_PERCENT = 100
 CAPTURE_DELAY = 0.0
+ROI_ZOOM_ENABLED = False
+ROI_MAX_CROPS = 2
+ROI_MAX_PIXELS = 262144
+ROI_PADDING = 10
+
+FRAME_SOURCE = "gdi"
+SYNTHETIC_WIDTH = 1920
+SYNTHETIC_HEIGHT = 1080
+REPLAY_RUN_DIR = ""
+INPUT_SINK = "auto"
+ANNOTATION_MODE = "browser"
+STAMP_CACHE_SIZE = 64
+
+DIFF_ENABLED = True
+DIFF_TILE = 32
+DIFF_MAX_REGIONS = 16
+DIFF_REUSE_UNCHANGED = False
+STATE_HASH_ENABLED = True
+STATE_HASH_MAX_DISTANCE = 10
+
+BACKGROUND_WRITES = True
+
+PNG_FILTER = "none"
+PNG_COMPRESS_LEVEL = 6
+PNG_COMPRESS_STRATEGY = "default"
 
 RUNS_DIR = "runs"
 LOG_LAYOUT = "flat"
+FRAME_DEDUP = False
+
+SESSIONS = []
 
 BOOT_ENABLED = True
 BOOT_VLM_OUTPUT = """\
@@ -65,6 +117,14 @@ PHYSICAL_EXECUTION = True
 ACTION_DELAY_SECONDS = 0.05
 DRAG_DURATION_STEPS = 20
 DRAG_STEP_DELAY = 0.01
+INPUT_PROFILE = "normal"
+INPUT_PROFILES = {
+    "fast": {"settle": 0.0, "press": 0.01, "double_gap": 0.03, "drag_steps": 6, "drag_step": 0.004, "action_gap": 0.02,
+             "min_wait": 0.02},
+    "normal": {"settle": 0.03, "press": 0.03, "double_gap": 0.06, "min_wait": 0.05},
+    "human": {"settle": 0.08, "press": 0.07, "double_gap": 0.11, "drag_steps": 30, "drag_step": 0.012,
+              "action_gap": 0.25, "jitter": 0.3, "ease": True},
+}
 
 UI_CONFIG = {
     "executed_heat": {
@@ -1,22 +1,40 @@
 from __future__ import annotations
 
+import abc
 import asyncio
 import base64
+import bisect
+import collections
+import concurrent.futures
+import contextvars
 import ctypes
 import ctypes.wintypes as W
+import functools
+import gzip
+import hashlib
+import heapq
 import http.client
+import itertools
 import json
 import logging
+import math
+import operator
 import os
+import queue
+import random
+import re
 import signal
 import struct
+import sys
+import threading
 import time
+import tracemalloc
 import urllib.parse
 import webbrowser
 import zlib
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Final, cast
+from typing import Any, Callable, Final, Iterator, cast
 
 HERE: Final[Path] = Path(__file__).resolve().parent
 CONFIG_PATH: Final[Path] = HERE / "config.py"
@@ -38,15 +56,156 @@ PORT: Final[int] = int(getattr(CFG, "PORT", 1234))
 
 log = logging.getLogger("franz")
 
+_SESSION: contextvars.ContextVar[Session] = contextvars.ContextVar("session")
+
 
 def _cfg(name: str, default: Any = None) -> Any:
+    if (sess := _SESSION.get(None)) is not None and name in sess.overrides:
+        return sess.overrides[name]
     return getattr(CFG, name, default)
 
 
+class _SessionLogFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        sess = _SESSION.get(None)
+        record.session = f"[{sess.name}]" if sess is not None and len(SESSIONS) > 1 else ""
+        return True
+
+
+class LogWriter:
+    """Single background thread that appends main.log and JSONL lines in batches."""
+
+    def __init__(self) -> None:
+        self._q: queue.Queue[tuple[Path, bytes] | tuple[threading.Event, bool] | None] = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._files: dict[Path, Any] = {}
+        self._last_fsync = time.monotonic()
+        self.batches = 0
+        self.bytes = 0
+        self.fsyncs = 0
+        self.max_batch = 0
+
+    def _ensure(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="logwriter", daemon=True)
+                    self._thread.start()
+
+    def write(self, path: Path, data: bytes) -> None:
+        self._ensure()
+        self._q.put((path, data))
+
+    def sync(self, wait: bool = False) -> None:
+        """Writes everything queued so far and fsyncs it."""
+        self._ensure()
+        ev = threading.Event()
+        self._q.put((ev, True))
+        if wait:
+            ev.wait()
+
+    def flush(self) -> None:
+        """Blocks until everything queued so far is written (fsynced unless LOG_DURABILITY is "none")."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        ev = threading.Event()
+        self._q.put((ev, str(_cfg("LOG_DURABILITY", "periodic")).lower() != "none"))
+        ev.wait()
+
+    def close(self) -> None:
+        self.flush()
+        if self._thread is not None and self._thread.is_alive():
+            self._q.put(None)
+            self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        pending: dict[Path, list[bytes]] = {}
+        size, deadline = 0, 0.0
+        while True:
+            try:
+                item = self._q.get(timeout=max(0.0, deadline - time.monotonic()) if pending else None)
+            except queue.Empty:
+                item = ()
+            if item and isinstance(path := item[0], Path):
+                data = cast(bytes, item[1])
+                if not pending:
+                    deadline = time.monotonic() + float(_cfg("LOG_FLUSH_INTERVAL_MS", 200)) / 1000
+                pending.setdefault(path, []).append(data)
+                size += len(data)
+                if size < int(_cfg("LOG_FLUSH_BYTES", 65536)):
+                    continue
+            self._write(pending)
+            pending, size = {}, 0
+            durability = str(_cfg("LOG_DURABILITY", "periodic")).lower()
+            if item and isinstance(ev := item[0], threading.Event):
+                if item[1]:
+                    self._fsync()
+                ev.set()
+            elif durability == "periodic" and time.monotonic() - self._last_fsync >= float(_cfg("LOG_FSYNC_INTERVAL_SECONDS", 2.0)):
+                self._fsync()
+            if item is None:
+                for f in self._files.values():
+                    f.close()
+                self._files.clear()
+                return
+
+    def _write(self, pending: dict[Path, list[bytes]]) -> None:
+        if not pending:
+            return
+        n = 0
+        for path, chunks in pending.items():
+            data = b"".join(chunks)
+            try:
+                if (f := self._files.get(path)) is None:
+                    f = self._files[path] = path.open("ab")
+                f.write(data)
+                f.flush()
+                n += len(data)
+            except OSError as e:
+                print(f"log writer: append {path} failed: {e}", file=sys.stderr)
+                self._files.pop(path, None)
+        self.batches += 1
+        self.bytes += n
+        self.max_batch = max(self.max_batch, n)
+
+    def _fsync(self) -> None:
+        for path, f in list(self._files.items()):
+            try:
+                os.fsync(f.fileno())
+            except OSError as e:
+                print(f"log writer: fsync {path} failed: {e}", file=sys.stderr)
+        self.fsyncs += 1
+        self._last_fsync = time.monotonic()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "queued": self._q.qsize(), "batches": self.batches, "bytes": self.bytes, "fsyncs": self.fsyncs,
+            "max_batch_bytes": self.max_batch, "open_files": len(self._files),
+            "durability": str(_cfg("LOG_DURABILITY", "periodic")).lower(),
+        }
+
+
+LOGW: Final[LogWriter] = LogWriter()
+
+
+class _BufferedFileHandler(logging.Handler):
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+        self.path = path
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            LOGW.write(self.path, (self.format(record) + "\n").encode("utf-8"))
+        except Exception:
+            self.handleError(record)
+
+
 def setup_logging(run_dir: Path) -> None:
     level = getattr(logging, str(_cfg("LOG_LEVEL", "INFO")).upper(), logging.INFO)
     fmt = logging.Formatter(
-        "[%(name)s][%(asctime)s.%(msecs)03d][%(levelname)s] %(message)s",
+        "[%(name)s]%(session)s[%(asctime)s.%(msecs)03d][%(levelname)s] %(message)s",
         datefmt="%H:%M:%S",
     )
     root = logging.getLogger()
@@ -54,10 +213,12 @@ def setup_logging(run_dir: Path) -> None:
     root.handlers.clear()
     sh = logging.StreamHandler()
     sh.setFormatter(fmt)
+    sh.addFilter(_SessionLogFilter())
     root.addHandler(sh)
     if bool(_cfg("LOG_TO_FILE", True)):
-        fh = logging.FileHandler(run_dir / "main.log", encoding="utf-8")
+        fh = _BufferedFileHandler(run_dir / "main.log")
         fh.setFormatter(fmt)
+        fh.addFilter(_SessionLogFilter())
         root.addHandler(fh)
     log.info("logging ready level=%s run_dir=%s", logging.getLevelName(level), run_dir)
 
@@ -80,30 +241,188 @@ class EngineState:
     error: str | None = None
     turn: int = 0
     run_dir: Path | None = None
-    annotated_b64: str = ""
-    raw_b64: str = ""
+    annotated_png: bytes = b""
+    raw_png: bytes = b""
+    frame_seq: int = 0
+    frame_etag: str = ""
     vlm_json: str = ""
     observation: str = ""
     actions_text: str = ""
     bboxes: list[dict[str, Any]] = field(default_factory=list)
     actions: list[dict[str, Any]] = field(default_factory=list)
+    diff: dict[str, Any] = field(default_factory=dict)
+    state_hash: str = ""
+    similar: dict[str, int] | None = None
+    repairs: list[str] = field(default_factory=list)
+    vlm_attempts: int = 0
+    vlm_failures: int = 0
+    vlm_resume_at: float = 0.0
     msg_id: int = 0
     pending_seq: int = 0
     annotated_seq: int = -1
     annotated_event: asyncio.Event = field(default_factory=asyncio.Event)
     next_vlm_json: str | None = None
+    next_dispatched: int = 0
+    next_box: list[int] | None = None
     next_event: asyncio.Event = field(default_factory=asyncio.Event)
     lock: asyncio.Lock = field(default_factory=asyncio.Lock)
 
 
-S: EngineState
 STOP: asyncio.Event
 
 
-def set_phase(phase: str, error: str | None = None) -> None:
-    S.phase = phase
-    S.error = error
-    log.info("phase=%s error=%s", phase, error)
+class Session:
+    """One agent: engine state, event hub, tile diff and overlay trail, plus config overrides and its run dir."""
+
+    def __init__(self, name: str, run_dir: Path, overrides: dict[str, Any] | None = None) -> None:
+        self.name = name
+        self.run_dir = run_dir
+        self.overrides = overrides or {}
+        self.state = EngineState(run_dir=run_dir)
+        self.hub = EventHub(self.snapshot)
+        self.diff = TileDiff()
+        self.states = StateIndex()
+        self.renderer = AnnotationRenderer()
+
+    def snapshot(self) -> dict[str, Any]:
+        st = self.state
+        return {
+            "session": self.name,
+            "phase": st.phase,
+            "error": st.error,
+            "turn": st.turn,
+            "msg_id": st.msg_id,
+            "pending_seq": st.pending_seq,
+            "annotated_seq": st.annotated_seq,
+            "frame_seq": st.frame_seq,
+            "frame_etag": st.frame_etag,
+            "frame_bytes": len(st.raw_png),
+            "bboxes": st.bboxes,
+            "actions": st.actions,
+            "observation": st.observation,
+            "vlm_json": st.vlm_json,
+            "diff": st.diff,
+            "state_hash": st.state_hash,
+            "similar": st.similar,
+            "repairs": st.repairs,
+            "vlm_retry": {
+                "attempts": st.vlm_attempts, "consecutive_failures": st.vlm_failures,
+                "resume_in_s": round(max(0.0, st.vlm_resume_at - time.time()), 1) if st.vlm_resume_at else None,
+            },
+        }
+
+    def set_phase(self, phase: str, error: str | None = None) -> None:
+        self.state.phase = phase
+        self.state.error = error
+        log.info("phase=%s error=%s", phase, error)
+        self.hub.publish("phase")
+
+
+SESSIONS: Final[dict[str, Session]] = {}
+_SESSION_NAME_OK: Final[frozenset[str]] = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-")
+
+
+def make_sessions(run_dir: Path) -> dict[str, Session]:
+    specs = [dict(sp) for sp in (_cfg("SESSIONS", []) or []) if isinstance(sp, dict)] or [{"name": "main"}]
+    out: dict[str, Session] = {}
+    for i, spec in enumerate(specs, 1):
+        name = str(spec.pop("name", f"s{i}"))
+        if not name or not set(name) <= _SESSION_NAME_OK or name in out:
+            raise SystemExit(f"invalid or duplicate session name: {name!r}")
+        sd = run_dir if len(specs) == 1 else run_dir / name
+        sd.mkdir(exist_ok=True)
+        out[name] = Session(name, sd, spec)
+    return out
+
+
+class EventHub:
+    def __init__(self, snapshot: Callable[[], dict[str, Any]]) -> None:
+        self._snapshot = snapshot
+        self._subs: set[asyncio.Queue[tuple[str, dict[str, Any]]]] = set()
+
+    def subscribe(self) -> asyncio.Queue[tuple[str, dict[str, Any]]]:
+        q: asyncio.Queue[tuple[str, dict[str, Any]]] = asyncio.Queue(maxsize=64)
+        self._subs.add(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue[tuple[str, dict[str, Any]]]) -> None:
+        self._subs.discard(q)
+
+    def publish(self, kind: str, data: dict[str, Any] | None = None) -> None:
+        if not self._subs:
+            return
+        data = self._snapshot() if data is None else data
+        for q in self._subs:
+            if q.full():
+                q.get_nowait()
+            q.put_nowait((kind, data))
+
+    def close(self) -> None:
+        self.publish("close", {})
+
+
+class StageHistograms:
+    """Per-stage latency histograms (fixed ms buckets) shared by the engine and the background writer."""
+
+    BOUNDS_MS: Final[tuple[float, ...]] = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stages: dict[str, tuple[list[int], list[float]]] = {}
+
+    def observe(self, stage: str, ms: float) -> None:
+        i = bisect.bisect_left(self.BOUNDS_MS, ms)
+        with self._lock:
+            counts, agg = self._stages.setdefault(stage, ([0] * (len(self.BOUNDS_MS) + 1), [0.0, 0.0]))
+            counts[i] += 1
+            agg[0] += ms
+            agg[1] = max(agg[1], ms)
+
+    def _quantile(self, counts: list[int], q: float) -> float:
+        rank, seen = q * sum(counts), 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= rank and c:
+                return self.BOUNDS_MS[i] if i < len(self.BOUNDS_MS) else float("inf")
+        return 0.0
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            items = [(k, list(c), list(a)) for k, (c, a) in self._stages.items()]
+        out: dict[str, dict[str, Any]] = {}
+        for stage, counts, (total, peak) in items:
+            n = sum(counts)
+            out[stage] = {
+                "count": n,
+                "mean_ms": round(total / n, 2),
+                "max_ms": round(peak, 2),
+                "p50_le_ms": self._quantile(counts, 0.5),
+                "p95_le_ms": self._quantile(counts, 0.95),
+                "buckets": {("+inf" if i == len(self.BOUNDS_MS) else f"{self.BOUNDS_MS[i]:g}"): c
+                            for i, c in enumerate(counts) if c},
+            }
+        return out
+
+    def prometheus(self, name: str) -> list[str]:
+        with self._lock:
+            items = sorted((k, list(c), a[0]) for k, (c, a) in self._stages.items())
+        out = [f"# TYPE {name} histogram"]
+        for stage, counts, total in items:
+            for bound, seen in zip((*(f"{b:g}" for b in self.BOUNDS_MS), "+Inf"), itertools.accumulate(counts)):
+                out.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {seen}')
+            out.append(f'{name}_sum{{stage="{stage}"}} {total:.3f}')
+            out.append(f'{name}_count{{stage="{stage}"}} {sum(counts)}')
+        return out
+
+    def format(self) -> list[str]:
+        return [
+            f"{k:<15} n={v['count']:<6} mean_ms={v['mean_ms']:9.2f} p50<={v['p50_le_ms']:<7g} "
+            f"p95<={v['p95_le_ms']:<7g} max_ms={v['max_ms']:9.2f}"
+            for k, v in sorted(self.snapshot().items(), key=lambda kv: -kv[1]["mean_ms"])
+        ]
+
+
+HIST: Final[StageHistograms] = StageHistograms()
 
 
 SRCCOPY: Final[int] = 0x00CC0020
@@ -117,11 +436,13 @@ try:
 except Exception:
     pass
 
-_user32 = ctypes.WinDLL("user32", use_last_error=True)
-_gdi32 = ctypes.WinDLL("gdi32", use_last_error=True)
+_user32: Any = ctypes.WinDLL("user32", use_last_error=True) if os.name == "nt" else None
+_gdi32: Any = ctypes.WinDLL("gdi32", use_last_error=True) if os.name == "nt" else None
 
 
 def _sig(dll: Any, name: str, argtypes: list[Any], restype: Any) -> None:
+    if dll is None:
+        return
     fn = getattr(dll, name)
     fn.argtypes = argtypes
     fn.restype = restype
@@ -152,6 +473,27 @@ MOUSEEVENTF_LEFTDOWN: Final[int] = 0x0002
 MOUSEEVENTF_LEFTUP: Final[int] = 0x0004
 MOUSEEVENTF_RIGHTDOWN: Final[int] = 0x0008
 MOUSEEVENTF_RIGHTUP: Final[int] = 0x0010
+MOUSEEVENTF_MOVE: Final[int] = 0x0001
+MOUSEEVENTF_VIRTUALDESK: Final[int] = 0x4000
+MOUSEEVENTF_ABSOLUTE: Final[int] = 0x8000
+INPUT_MOUSE: Final[int] = 0
+SM_XVIRTUALSCREEN: Final[int] = 76
+SM_CXVIRTUALSCREEN: Final[int] = 78
+
+
+class _MOUSEINPUT(ctypes.Structure):
+    _fields_ = [
+        ("dx", W.LONG), ("dy", W.LONG), ("mouseData", W.DWORD),
+        ("dwFlags", W.DWORD), ("time", W.DWORD), ("dwExtraInfo", ctypes.c_size_t),
+    ]
+
+
+class _INPUT(ctypes.Structure):
+    # MOUSEINPUT is the largest member of the INPUT union on both 32- and 64-bit Windows.
+    _fields_ = [("type", W.DWORD), ("mi", _MOUSEINPUT)]
+
+
+_sig(_user32, "SendInput", [W.UINT, ctypes.POINTER(_INPUT), ctypes.c_int], W.UINT)
 
 
 class _BIH(ctypes.Structure):
@@ -193,6 +535,10 @@ def _clampi(v: int, lo: int, hi: int) -> int:
     return lo if v < lo else hi if v > hi else v
 
 
+def _clampf(v: float, lo: float, hi: float) -> float:
+    return lo if v < lo else hi if v > hi else v
+
+
 def _nedge(v: int, span: int) -> int:
     v = _clampi(v, 0, NORM_MAX)
     return (v * span + NORM_MAX // 2) // NORM_MAX
@@ -229,13 +575,13 @@ def _crop_px(base_w: int, base_h: int) -> tuple[int, int, int, int]:
 
 
 def _norm_to_screen_xy(nx: int, ny: int) -> tuple[int, int]:
-    sw, sh = _screen_size()
+    sw, sh = SOURCE.size()
     x1, y1, x2, y2 = _crop_px(sw, sh)
     return x1 + _npt(nx, x2 - x1), y1 + _npt(ny, y2 - y1)
 
 
 def _screen_to_norm_xy(px: int, py: int) -> tuple[int, int]:
-    sw, sh = _screen_size()
+    sw, sh = SOURCE.size()
     x1, y1, x2, y2 = _crop_px(sw, sh)
     w = max(1, x2 - x1)
     h = max(1, y2 - y1)
@@ -253,117 +599,596 @@ def _create_dib(dc: Any, w: int, h: int) -> tuple[Any, int]:
     return (hbmp, int(bits.value)) if hbmp and bits.value else (None, 0)
 
 
-def _capture_bgra_full() -> tuple[bytes, int, int] | None:
-    sw, sh = _screen_size()
-    sdc = _user32.GetDC(0)
-    if not sdc:
-        return None
-    memdc = _gdi32.CreateCompatibleDC(sdc)
-    if not memdc:
-        _user32.ReleaseDC(0, sdc)
-        return None
-    hbmp, bits = _create_dib(sdc, sw, sh)
-    if not hbmp:
-        _gdi32.DeleteDC(memdc)
-        _user32.ReleaseDC(0, sdc)
-        return None
-    old = _gdi32.SelectObject(memdc, hbmp)
-    _gdi32.BitBlt(memdc, 0, 0, sw, sh, sdc, 0, 0, SRCCOPY | CAPTUREBLT)
-    raw = bytes((ctypes.c_ubyte * (sw * sh * 4)).from_address(bits))
-    _gdi32.SelectObject(memdc, old)
-    _gdi32.DeleteObject(hbmp)
-    _gdi32.DeleteDC(memdc)
-    _user32.ReleaseDC(0, sdc)
-    return raw, sw, sh
-
-
-def _crop_bgra(bgra: bytes, sw: int, sh: int, crop: dict[str, int]) -> tuple[bytes, int, int]:
-    x1, y1 = max(0, min(crop["x1"], sw)), max(0, min(crop["y1"], sh))
-    x2, y2 = max(x1, min(crop["x2"], sw)), max(y1, min(crop["y2"], sh))
-    cw, ch = x2 - x1, y2 - y1
-    if cw <= 0 or ch <= 0:
-        return bgra, sw, sh
-    out = bytearray(cw * ch * 4)
-    ss, ds = sw * 4, cw * 4
-    for y in range(ch):
-        so, do = (y1 + y) * ss + x1 * 4, y * ds
-        out[do:do + ds] = bgra[so:so + ds]
-    return bytes(out), cw, ch
-
-
-def _stretch_bgra(bgra: bytes, sw: int, sh: int, dw: int, dh: int) -> bytes | None:
-    sdc = _user32.GetDC(0)
-    if not sdc:
-        return None
-    src_dc = _gdi32.CreateCompatibleDC(sdc)
-    dst_dc = _gdi32.CreateCompatibleDC(sdc)
-    if not src_dc or not dst_dc:
-        if src_dc:
-            _gdi32.DeleteDC(src_dc)
-        if dst_dc:
-            _gdi32.DeleteDC(dst_dc)
-        _user32.ReleaseDC(0, sdc)
-        return None
-    src_bmp, src_bits = _create_dib(sdc, sw, sh)
-    if not src_bmp:
-        _gdi32.DeleteDC(src_dc)
-        _gdi32.DeleteDC(dst_dc)
-        _user32.ReleaseDC(0, sdc)
-        return None
-    ctypes.memmove(src_bits, bgra, sw * sh * 4)
-    old_src = _gdi32.SelectObject(src_dc, src_bmp)
-    dst_bmp, dst_bits = _create_dib(sdc, dw, dh)
-    if not dst_bmp:
-        _gdi32.SelectObject(src_dc, old_src)
-        _gdi32.DeleteObject(src_bmp)
-        _gdi32.DeleteDC(src_dc)
-        _gdi32.DeleteDC(dst_dc)
-        _user32.ReleaseDC(0, sdc)
-        return None
-    old_dst = _gdi32.SelectObject(dst_dc, dst_bmp)
-    _gdi32.SetStretchBltMode(dst_dc, HALFTONE)
-    _gdi32.SetBrushOrgEx(dst_dc, 0, 0, None)
-    _gdi32.StretchBlt(dst_dc, 0, 0, dw, dh, src_dc, 0, 0, sw, sh, SRCCOPY)
-    result = bytes((ctypes.c_ubyte * (dw * dh * 4)).from_address(dst_bits))
-    _gdi32.SelectObject(dst_dc, old_dst)
-    _gdi32.SelectObject(src_dc, old_src)
-    _gdi32.DeleteObject(dst_bmp)
-    _gdi32.DeleteObject(src_bmp)
-    _gdi32.DeleteDC(dst_dc)
-    _gdi32.DeleteDC(src_dc)
-    _user32.ReleaseDC(0, sdc)
-    return result
-
-
-def _bgra_to_png(bgra: bytes, w: int, h: int) -> bytes:
-    stride = w * 4
-    raw = bytearray()
+@dataclass
+class Frame:
+    buf: memoryview
+    width: int
+    height: int
+    stride: int
+    offset: int = 0
+
+    @property
+    def contiguous(self) -> bool:
+        return self.stride == self.width * 4
+
+    def row(self, y: int) -> memoryview:
+        o = self.offset + y * self.stride
+        return self.buf[o:o + self.width * 4]
+
+    def rows(self, y0: int, n: int) -> memoryview | bytes:
+        if self.contiguous:
+            o = self.offset + y0 * self.stride
+            return self.buf[o:o + n * self.stride]
+        return b"".join(self.row(y) for y in range(y0, y0 + n))
+
+    def crop(self, x1: int, y1: int, x2: int, y2: int) -> Frame:
+        x1, y1 = max(0, min(x1, self.width)), max(0, min(y1, self.height))
+        x2, y2 = max(x1, min(x2, self.width)), max(y1, min(y2, self.height))
+        if x2 <= x1 or y2 <= y1:
+            return self
+        return Frame(self.buf, x2 - x1, y2 - y1, self.stride, self.offset + y1 * self.stride + x1 * 4)
+
+    def tobytes(self) -> bytes:
+        return bytes(self.rows(0, self.height))
+
+
+class FrameBuffer:
+    def __init__(self) -> None:
+        self._buf = bytearray()
+
+    def frame(self, w: int, h: int) -> Frame:
+        if len(self._buf) < w * h * 4:
+            self._buf = bytearray(w * h * 4)
+        return Frame(memoryview(self._buf), w, h, w * 4)
+
+
+class _DibSurface:
+    def __init__(self) -> None:
+        self.dc: Any = None
+        self.bmp: Any = None
+        self.old: Any = None
+        self.frame: Frame | None = None
+
+    def ensure(self, sdc: Any, w: int, h: int) -> Frame | None:
+        if self.frame is not None and (self.frame.width, self.frame.height) == (w, h):
+            return self.frame
+        self.close()
+        if not (dc := _gdi32.CreateCompatibleDC(sdc)):
+            return None
+        bmp, bits = _create_dib(sdc, w, h)
+        if not bmp:
+            _gdi32.DeleteDC(dc)
+            return None
+        self.dc, self.bmp, self.old = dc, bmp, _gdi32.SelectObject(dc, bmp)
+        self.frame = Frame(memoryview((ctypes.c_ubyte * (w * h * 4)).from_address(bits)).cast("B"), w, h, w * 4)
+        log.info("dib surface allocated %dx%d", w, h)
+        return self.frame
+
+    def close(self) -> None:
+        if self.dc:
+            _gdi32.SelectObject(self.dc, self.old)
+            _gdi32.DeleteObject(self.bmp)
+            _gdi32.DeleteDC(self.dc)
+        self.dc = self.bmp = self.old = self.frame = None
+
+
+def _stretch_nearest(src: Frame, out: Frame) -> Frame:
+    dw, dh = out.width, out.height
+    cols = [(x * src.width // dw) * 4 + c for x in range(dw) for c in range(4)]
+    pick = operator.itemgetter(*cols)
+    for y in range(dh):
+        o = out.offset + y * out.stride
+        out.buf[o:o + dw * 4] = bytes(pick(src.row(y * src.height // dh)))
+    return out
+
+
+def _avg8(x: bytes, y: bytes) -> bytes:
+    n = len(x)
+    a, b = int.from_bytes(x, "big"), int.from_bytes(y, "big")
+    return ((a & b) + (((a ^ b) & _lanes(n, b"\xfe")) >> 1)).to_bytes(n, "big")
+
+
+def _downscale_half(src: Frame) -> Frame:
+    w, h = src.width // 2, src.height // 2
+    out = Frame(memoryview(bytearray(w * h * 4)), w, h, w * 4)
     for y in range(h):
-        raw.append(0)
-        row = bgra[y * stride:(y + 1) * stride]
-        for i in range(0, len(row), 4):
-            raw.extend((row[i + 2], row[i + 1], row[i], 255))
+        px = memoryview(_avg8(src.row(2 * y), src.row(2 * y + 1))).cast("I")
+        out.buf[y * out.stride:(y + 1) * out.stride] = _avg8(px[0:2 * w:2].tobytes(), px[1:2 * w:2].tobytes())
+    return out
+
+
+class FrameSource(abc.ABC):
+    name = "base"
+
+    def __init__(self) -> None:
+        self._scaled = FrameBuffer()
+
+    @abc.abstractmethod
+    def size(self) -> tuple[int, int]: ...
+
+    @abc.abstractmethod
+    def grab(self) -> Frame | None: ...
+
+    def stretch(self, frame: Frame, rect: tuple[int, int, int, int], dw: int, dh: int) -> Frame | None:
+        return _stretch_nearest(frame.crop(*rect), self._scaled.frame(dw, dh))
+
+    def close(self) -> None:
+        pass
+
+
+class GdiFrameSource(FrameSource):
+    name = "gdi"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._screen = _DibSurface()
+        self._dib_scaled = _DibSurface()
+
+    def size(self) -> tuple[int, int]:
+        return _screen_size()
+
+    def grab(self) -> Frame | None:
+        sw, sh = _screen_size()
+        if not (sdc := _user32.GetDC(0)):
+            return None
+        try:
+            if (frame := self._screen.ensure(sdc, sw, sh)) is not None:
+                _gdi32.BitBlt(self._screen.dc, 0, 0, sw, sh, sdc, 0, 0, SRCCOPY | CAPTUREBLT)
+            return frame
+        finally:
+            _user32.ReleaseDC(0, sdc)
+
+    def stretch(self, frame: Frame, rect: tuple[int, int, int, int], dw: int, dh: int) -> Frame | None:
+        x1, y1, x2, y2 = rect
+        if not self._screen.dc or not (sdc := _user32.GetDC(0)):
+            return None
+        try:
+            if (out := self._dib_scaled.ensure(sdc, dw, dh)) is not None:
+                _gdi32.SetStretchBltMode(self._dib_scaled.dc, HALFTONE)
+                _gdi32.SetBrushOrgEx(self._dib_scaled.dc, 0, 0, None)
+                _gdi32.StretchBlt(self._dib_scaled.dc, 0, 0, dw, dh, self._screen.dc, x1, y1, x2 - x1, y2 - y1, SRCCOPY)
+            return out
+        finally:
+            _user32.ReleaseDC(0, sdc)
+
+    def close(self) -> None:
+        self._dib_scaled.close()
+        self._screen.close()
+
+
+PNG_SIG: Final[bytes] = b"\x89PNG\r\n\x1a\n"
+PNG_FILTERS: Final[dict[str, int]] = {"none": 0, "sub": 1, "up": 2, "paeth": 4}
+ZLIB_STRATEGIES: Final[dict[str, int]] = {
+    "default": zlib.Z_DEFAULT_STRATEGY, "filtered": zlib.Z_FILTERED,
+    "huffman": zlib.Z_HUFFMAN_ONLY, "rle": zlib.Z_RLE, "fixed": zlib.Z_FIXED,
+}
+PNG_BAND_ROWS: Final[int] = 64
+
+
+@functools.lru_cache(maxsize=16)
+def _lanes(n: int, pattern: bytes) -> int:
+    return int.from_bytes(pattern * n, "big")
+
+
+def _sub8(x: bytes, y: bytes) -> bytes:
+    n = len(x)
+    hi, lo = _lanes(n, b"\x80"), _lanes(n, b"\x7f")
+    a, b = int.from_bytes(x, "big"), int.from_bytes(y, "big")
+    return (((a | hi) - (b & lo)) ^ ((a ^ b ^ hi) & hi)).to_bytes(n, "big")
+
+
+def _add8(x: bytes, y: bytes) -> bytes:
+    n = len(x)
+    hi, lo = _lanes(n, b"\x80"), _lanes(n, b"\x7f")
+    a, b = int.from_bytes(x, "big"), int.from_bytes(y, "big")
+    return (((a & lo) + (b & lo)) ^ ((a ^ b) & hi)).to_bytes(n, "big")
+
+
+def _widen16(x: bytes) -> int:
+    buf = bytearray(len(x) * 2)
+    buf[1::2] = x
+    return int.from_bytes(buf, "big")
+
 
-    def chunk(tag: bytes, body: bytes) -> bytes:
-        return struct.pack(">I", len(body)) + tag + body + struct.pack(">I", zlib.crc32(tag + body) & 0xFFFFFFFF)
+def _paeth_pred(a: bytes, b: bytes, c: bytes) -> bytes:
+    n = len(a)
+    one, full, low = _lanes(n, b"\x00\x01"), _lanes(n, b"\xff\xff"), _lanes(n, b"\x03\xff")
+    bias = one * 0x400
+    ia, ib, ic = _widen16(a), _widen16(b), _widen16(c)
 
+    def le(u: int, v: int) -> int:
+        return (((v + bias - u) >> 10) & one) * 0xFFFF
+
+    def absd(u: int, v: int) -> int:
+        m = le(v, u)
+        return ((u + bias - v) & low & m) | ((v + bias - u) & low & (full ^ m))
+
+    pa, pb, pc = absd(ib, ic), absd(ia, ic), absd(ia + ib, ic + ic)
+    ma = le(pa, pb) & le(pa, pc)
+    mb = (full ^ ma) & le(pb, pc)
+    mc = full ^ ma ^ mb
+    return ((ia & ma) | (ib & mb) | (ic & mc)).to_bytes(n * 2, "big")[1::2]
+
+
+def _shift_left_px(band: bytes, stride: int, bpp: int) -> bytes:
+    out = bytearray(bpp) + band[:-bpp]
+    for k in range(bpp):
+        out[k::stride] = bytes(len(range(k, len(out), stride)))
+    return bytes(out)
+
+
+def _png_filter_band(band: bytes, prior: bytes, stride: int, ftype: int, bpp: int = 3) -> bytes:
+    match ftype:
+        case 1:
+            return _sub8(band, _shift_left_px(band, stride, bpp))
+        case 2:
+            return _sub8(band, prior)
+        case 4:
+            return _sub8(band, _paeth_pred(
+                _shift_left_px(band, stride, bpp), prior, _shift_left_px(prior, stride, bpp)))
+        case _:
+            return band
+
+
+def _bgra_rows_to_rgb(bgra: bytes | memoryview, w: int, rows: int) -> bytes:
+    n = w * rows
+    rgb = bytearray(n * 3)
+    rgb[0::3] = bgra[2:n * 4:4]
+    rgb[1::3] = bgra[1:n * 4:4]
+    rgb[2::3] = bgra[0:n * 4:4]
+    return bytes(rgb)
+
+
+def _png_chunk(tag: bytes, body: bytes) -> bytes:
+    return struct.pack(">I", len(body)) + tag + body + struct.pack(">I", zlib.crc32(tag + body) & 0xFFFFFFFF)
+
+
+def _png_settings() -> tuple[int, int, int]:
+    ftype = PNG_FILTERS.get(str(_cfg("PNG_FILTER", "none")).lower(), 0)
+    level = _clampi(int(_cfg("PNG_COMPRESS_LEVEL", 6)), 0, 9)
+    strategy = ZLIB_STRATEGIES.get(str(_cfg("PNG_COMPRESS_STRATEGY", "default")).lower(), zlib.Z_DEFAULT_STRATEGY)
+    return ftype, level, strategy
+
+
+def _bgra_to_png(
+    frame: Frame,
+    ftype: int | None = None, level: int | None = None, strategy: int | None = None,
+) -> bytes:
+    cf, cl, cs = _png_settings()
+    ftype = cf if ftype is None else ftype
+    z = zlib.compressobj(cl if level is None else level, zlib.DEFLATED, 15, 9, cs if strategy is None else strategy)
+    w, h = frame.width, frame.height
+    stride = w * 3
+    prior = bytes(stride)
+    fb = bytes((ftype,))
+    idat: list[bytes] = []
+    for y0 in range(0, h, PNG_BAND_ROWS):
+        rows = min(PNG_BAND_ROWS, h - y0)
+        band = _bgra_rows_to_rgb(frame.rows(y0, rows), w, rows)
+        filt = _png_filter_band(band, prior + band[:-stride], stride, ftype)
+        prior = band[-stride:]
+        idat.append(z.compress(b"".join(p for y in range(rows) for p in (fb, filt[y * stride:(y + 1) * stride]))))
+    idat.append(z.flush())
     return (
-        b"\x89PNG\r\n\x1a\n"
-        + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
-        + chunk(b"IDAT", zlib.compress(bytes(raw), 6))
-        + chunk(b"IEND", b"")
+        PNG_SIG
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+        + _png_chunk(b"IDAT", b"".join(idat))
+        + _png_chunk(b"IEND", b"")
     )
 
 
-def capture_screenshot() -> tuple[str, int, int]:
+def _png_unfilter_row(ftype: int, row: bytearray, prior: bytes, bpp: int) -> bytes:
+    match ftype:
+        case 0:
+            return bytes(row)
+        case 1:
+            n, k, acc = len(row), bpp, int.from_bytes(row, "big")
+            hi, lo = _lanes(n, b"\x80"), _lanes(n, b"\x7f")
+            while k < n:
+                sh = acc >> (8 * k)
+                acc = ((acc & lo) + (sh & lo)) ^ ((acc ^ sh) & hi)
+                k *= 2
+            return acc.to_bytes(n, "big")
+        case 2:
+            return _add8(bytes(row), prior)
+    for i in range(len(row)):
+        a = row[i - bpp] if i >= bpp else 0
+        b = prior[i]
+        if ftype == 3:
+            row[i] = (row[i] + ((a + b) >> 1)) & 0xFF
+            continue
+        c = prior[i - bpp] if i >= bpp else 0
+        pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+        row[i] = (row[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 0xFF
+    return bytes(row)
+
+
+def _png_decode(data: bytes) -> tuple[bytes, int, int, int]:
+    if data[:8] != PNG_SIG:
+        raise ValueError("not a png")
+    pos, idat, w, h, bpp = 8, bytearray(), 0, 0, 0
+    while pos + 8 <= len(data):
+        n, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + n]
+        pos += 12 + n
+        match tag:
+            case b"IHDR":
+                w, h, depth, color, _, _, interlace = struct.unpack(">IIBBBBB", body)
+                if depth != 8 or color not in (2, 6) or interlace:
+                    raise ValueError(f"unsupported png depth={depth} color={color} interlace={interlace}")
+                bpp = 3 if color == 2 else 4
+            case b"IDAT":
+                idat += body
+            case b"IEND":
+                break
+    raw = zlib.decompress(bytes(idat))
+    stride = w * bpp
+    prior, out = bytes(stride), []
+    for y in range(h):
+        o = y * (stride + 1)
+        prior = _png_unfilter_row(raw[o], bytearray(raw[o + 1:o + 1 + stride]), prior, bpp)
+        out.append(prior)
+    return b"".join(out), w, h, bpp
+
+
+def _synth_fill(frame: Frame, seed: int = 0) -> Frame:
+    rng = random.Random(seed)
+    w, h, buf = frame.width, frame.height, frame.buf
+    for y in range(h):
+        v = 40 + (y * 120) // max(1, h)
+        o = frame.offset + y * frame.stride
+        buf[o:o + w * 4] = bytes((v, v // 2 + 30, 80, 255)) * w
+    for _ in range(12):
+        x1, y1 = rng.randrange(w), rng.randrange(h)
+        x2, y2 = min(w, x1 + rng.randrange(1, w // 2 + 2)), min(h, y1 + rng.randrange(1, h // 2 + 2))
+        px = bytes((rng.randrange(256), rng.randrange(256), rng.randrange(256), 255))
+        for y in range(y1, y2):
+            o = frame.offset + y * frame.stride
+            buf[o + x1 * 4:o + x2 * 4] = px * (x2 - x1)
+    for _ in range(h // 4):
+        y, x1 = rng.randrange(h), rng.randrange(w)
+        n = min(w - x1, rng.randrange(1, 64))
+        o = frame.offset + y * frame.stride + x1 * 4
+        buf[o:o + n * 4] = rng.randbytes(n * 4)
+    return frame
+
+
+class SyntheticFrameSource(FrameSource):
+    name = "synthetic"
+
+    def __init__(self, w: int, h: int) -> None:
+        super().__init__()
+        self._w, self._h = max(1, w), max(1, h)
+        self._buf = FrameBuffer()
+        self._n = 0
+
+    def size(self) -> tuple[int, int]:
+        return self._w, self._h
+
+    def grab(self) -> Frame | None:
+        self._n += 1
+        return _synth_fill(self._buf.frame(self._w, self._h), self._n)
+
+
+def _rgb_to_bgra(px: bytes, bpp: int, out: Frame) -> Frame:
+    n = out.width * out.height
+    buf = out.buf
+    buf[0:n * 4:4] = px[2::bpp]
+    buf[1:n * 4:4] = px[1::bpp]
+    buf[2:n * 4:4] = px[0::bpp]
+    buf[3:n * 4:4] = px[3::4] if bpp == 4 else b"\xff" * n
+    return out
+
+
+def _decode_bgra(data: bytes) -> Frame:
+    px, w, h, bpp = _png_decode(data)
+    return _rgb_to_bgra(px, bpp, Frame(memoryview(bytearray(w * h * 4)), w, h, w * 4))
+
+
+def _run_frames(run_dir: Path, kind: str = "raw") -> list[Callable[[], bytes | None]]:
+    if (run_dir / ARCHIVE_NAME).exists():
+        arc = RunArchive(run_dir / ARCHIVE_NAME)
+        return [functools.partial(arc.get, t, f"{kind}_png") for t in arc.turns() if arc.has(t, f"{kind}_png")]
+    if refs := _blob_refs(run_dir):
+        root = _blob_root(run_dir)
+        return [BlobStore.path(root, d).read_bytes for (_, k), d in sorted(refs.items()) if k == kind]
+    flat = sorted(run_dir.glob(f"turn_*_{kind}.png"))
+    return [p.read_bytes for p in flat or sorted(run_dir.glob(f"turn_*/screenshot_{kind}.png"))]
+
+
+class ReplayFrameSource(FrameSource):
+    name = "replay"
+
+    def __init__(self, run_dir: Path) -> None:
+        super().__init__()
+        self._frames = _run_frames(run_dir)
+        if not self._frames or not (first := self._frames[0]()):
+            raise FileNotFoundError(f"no turn PNGs in {run_dir}")
+        self._buf = FrameBuffer()
+        self._n = 0
+        w, h = struct.unpack(">II", first[16:24])
+        self._size = (int(w), int(h))
+        log.info("replay source %s frames=%d size=%dx%d", run_dir, len(self._frames), w, h)
+
+    def size(self) -> tuple[int, int]:
+        return self._size
+
+    def grab(self) -> Frame | None:
+        n = self._n % len(self._frames)
+        self._n += 1
+        try:
+            px, w, h, bpp = _png_decode(self._frames[n]() or b"")
+        except (OSError, ValueError, zlib.error) as e:
+            log.warning("replay decode failed frame %d: %s", n, e)
+            return None
+        return _rgb_to_bgra(px, bpp, self._buf.frame(w, h))
+
+
+def make_frame_source() -> FrameSource:
+    match str(_cfg("FRAME_SOURCE", "gdi")).lower():
+        case "synthetic":
+            return SyntheticFrameSource(int(_cfg("SYNTHETIC_WIDTH", 1920)), int(_cfg("SYNTHETIC_HEIGHT", 1080)))
+        case "replay":
+            return ReplayFrameSource(HERE / str(_cfg("REPLAY_RUN_DIR", "")))
+        case _:
+            return GdiFrameSource()
+
+
+SOURCE: FrameSource = GdiFrameSource()
+
+
+def _tile_regions(changed: set[int], cols: int, tile: int, w: int, h: int) -> list[dict[str, int]]:
+    boxes: list[tuple[int, int, int, int, int]] = []
+    seen: set[int] = set()
+    for start in sorted(changed):
+        if start in seen:
+            continue
+        seen.add(start)
+        stack, n = [start], 0
+        c1 = c2 = start % cols
+        r1 = r2 = start // cols
+        while stack:
+            i = stack.pop()
+            n += 1
+            r, c = divmod(i, cols)
+            c1, c2, r1, r2 = min(c1, c), max(c2, c), min(r1, r), max(r2, r)
+            for j in (i - cols, i + cols, i - 1 if c > 0 else -1, i + 1 if c < cols - 1 else -1):
+                if j in changed and j not in seen:
+                    seen.add(j)
+                    stack.append(j)
+        boxes.append((n, c1, r1, c2, r2))
+    boxes.sort(reverse=True)
+    out: list[dict[str, int]] = []
+    for _, c1, r1, c2, r2 in boxes[:max(1, int(_cfg("DIFF_MAX_REGIONS", 16)))]:
+        out.append({
+            "x1": (c1 * tile * NORM_MAX + w // 2) // w,
+            "y1": (r1 * tile * NORM_MAX + h // 2) // h,
+            "x2": (min(w, (c2 + 1) * tile) * NORM_MAX + w // 2) // w,
+            "y2": (min(h, (r2 + 1) * tile) * NORM_MAX + h // 2) // h,
+        })
+    return out
+
+
+class TileDiff:
+    def __init__(self) -> None:
+        self._key: tuple[int, int, int] = (0, 0, 0)
+        self._hashes: list[int] = []
+        self.cached_png = b""
+
+    def update(self, frame: Frame) -> dict[str, Any]:
+        tile = max(8, int(_cfg("DIFF_TILE", 32)))
+        w, h = frame.width, frame.height
+        cols, rows = -(-w // tile), -(-h // tile)
+        hashes = [0] * (cols * rows)
+        span = tile * 4
+        for y in range(h):
+            row, base = frame.row(y), (y // tile) * cols
+            for c in range(cols):
+                hashes[base + c] = zlib.crc32(row[c * span:(c + 1) * span], hashes[base + c])
+        first = (w, h, tile) != self._key
+        changed = set(range(len(hashes))) if first else {i for i, (a, b) in enumerate(zip(hashes, self._hashes)) if a != b}
+        self._key, self._hashes = (w, h, tile), hashes
+        return {
+            "first": first,
+            "changed": bool(changed),
+            "tiles": len(hashes),
+            "changed_tiles": len(changed),
+            "regions": [] if first else _tile_regions(changed, cols, tile, w, h),
+        }
+
+
+def dhash(frame: Frame) -> int:
+    """64-bit difference hash: box-halve to about 16x9, nearest to 9x8 luma, one bit per left<right pair."""
+    img = frame
+    while img.width >= 18 and img.height >= 16:
+        img = _downscale_half(img)
+    px = _stretch_nearest(img, Frame(memoryview(bytearray(9 * 8 * 4)), 9, 8, 9 * 4)).buf
+    luma = [px[i + 2] * 299 + px[i + 1] * 587 + px[i] * 114 for i in range(0, 9 * 8 * 4, 4)]
+    bits = 0
+    for y in range(8):
+        for x in range(y * 9, y * 9 + 8):
+            bits = bits << 1 | (luma[x] < luma[x + 1])
+    return bits
+
+
+def _lane_popcounts(x: int, n: int) -> bytes:
+    """Popcount of each of the n 64-bit lanes of x (first lane most significant), one byte per lane."""
+    x -= (x >> 1) & int.from_bytes(b"\x55" * (8 * n), "big")
+    m = int.from_bytes(b"\x33" * (8 * n), "big")
+    x = (x & m) + ((x >> 2) & m)
+    x = (x + (x >> 4)) & int.from_bytes(b"\x0f" * (8 * n), "big")
+    x += x >> 8
+    x += x >> 16
+    x += x >> 32
+    return x.to_bytes(8 * n, "big")[7::8]
+
+
+class StateIndex:
+    """Per-session dHash history packed into one big int; Hamming distances to every earlier turn in one SWAR pass."""
+
+    def __init__(self) -> None:
+        self._turns: list[int] = []
+        self._packed = 0
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def nearest(self, h: int) -> dict[str, int] | None:
+        """Closest earlier turn (most recent on ties) if within STATE_HASH_MAX_DISTANCE, plus how many are."""
+        if not (n := len(self._turns)):
+            return None
+        limit = _clampi(int(_cfg("STATE_HASH_MAX_DISTANCE", 10)), -1, 64)
+        dist = _lane_popcounts(self._packed ^ int.from_bytes(h.to_bytes(8, "big") * n, "big"), n)
+        if (best := min(dist)) > limit:
+            return None
+        repeats = n - len(dist.translate(None, bytes(range(limit + 1))))
+        return {"turn": self._turns[dist.rindex(best)], "distance": best, "repeats": repeats}
+
+    def add(self, turn: int, h: int) -> dict[str, int] | None:
+        match = self.nearest(h)
+        self._turns.append(turn)
+        self._packed = self._packed << 64 | h
+        return match
+
+
+def roi_crops(full: Frame, rect: tuple[int, int, int, int], bboxes: list[dict[str, Any]]) -> list[tuple[bytes, dict[str, Any]]]:
+    """Cut the first ROI_MAX_CROPS model bboxes out of the full-resolution grab as PNG zoom images."""
+    limit = int(_cfg("ROI_MAX_CROPS", 2) or 0)
+    budget = int(_cfg("ROI_MAX_PIXELS", 262144) or 0)
+    pad = _clampi(int(_cfg("ROI_PADDING", 10) or 0), 0, NORM_MAX)
+    w, h = rect[2] - rect[0], rect[3] - rect[1]
+    out: list[tuple[bytes, dict[str, Any]]] = []
+    for bb in bboxes[:limit]:
+        nx1, nx2 = sorted((bb["x1"], bb["x2"]))
+        ny1, ny2 = sorted((bb["y1"], bb["y2"]))
+        nx1, ny1 = _clampi(nx1 - pad, 0, NORM_MAX), _clampi(ny1 - pad, 0, NORM_MAX)
+        nx2, ny2 = _clampi(nx2 + pad, 0, NORM_MAX), _clampi(ny2 + pad, 0, NORM_MAX)
+        px1, py1 = rect[0] + _nedge(nx1, w), rect[1] + _nedge(ny1, h)
+        px2, py2 = rect[0] + _nedge(nx2, w), rect[1] + _nedge(ny2, h)
+        if px2 - px1 < 2 or py2 - py1 < 2:
+            continue
+        img = full.crop(px1, py1, px2, py2)
+        while budget > 0 and img.width * img.height > budget and img.width >= 2 and img.height >= 2:
+            img = _downscale_half(img)
+        png = _bgra_to_png(img)
+        out.append((png, {"x1": nx1, "y1": ny1, "x2": nx2, "y2": ny2, "width": img.width, "height": img.height, "bytes": len(png)}))
+    return out
+
+
+def capture_screenshot(
+    rois: list[dict[str, Any]] | None = None,
+) -> tuple[bytes, Frame | None, dict[str, Any], list[tuple[bytes, dict[str, Any]]]]:
     if (delay := float(_cfg("CAPTURE_DELAY", 0.0))) > 0:
         time.sleep(delay)
-    if (cap := _capture_bgra_full()) is None:
-        return "", 0, 0
-    bgra, w, h = cap
+    if (frame := SOURCE.grab()) is None:
+        return b"", None, {}, []
+    rect = (0, 0, frame.width, frame.height)
     if (crop := _cfg("CAPTURE_CROP")) and isinstance(crop, dict) and all(k in crop for k in ("x1", "y1", "x2", "y2")):
-        x1, y1, x2, y2 = _crop_px(w, h)
-        bgra, w, h = _crop_bgra(bgra, w, h, {"x1": x1, "y1": y1, "x2": x2, "y2": y2})
+        if (r := _crop_px(frame.width, frame.height))[2] > r[0] and r[3] > r[1]:
+            rect = r
+    zooms = roi_crops(frame, rect, rois) if rois else []
+    tiles = _SESSION.get().diff
+    w, h = rect[2] - rect[0], rect[3] - rect[1]
     out_w, out_h = int(_cfg("CAPTURE_WIDTH", 0)), int(_cfg("CAPTURE_HEIGHT", 0))
     dw = dh = 0
     if out_w > 0 and out_h > 0:
@@ -373,189 +1198,1561 @@ def capture_screenshot() -> tuple[str, int, int]:
         if p > 0 and p != 100:
             dw = max(1, (w * p + 50) // 100)
             dh = max(1, (h * p + 50) // 100)
-    if dw > 0 and dh > 0 and (w, h) != (dw, dh):
-        if s := _stretch_bgra(bgra, w, h, dw, dh):
-            bgra, w, h = s, dw, dh
-    b64 = base64.b64encode(_bgra_to_png(bgra, w, h)).decode("ascii")
-    log.info("capture done %dx%d b64len=%d", w, h, len(b64))
-    return b64, w, h
+    scaled = SOURCE.stretch(frame, rect, dw, dh) if dw > 0 and dh > 0 and (w, h) != (dw, dh) else None
+    frame = scaled or frame.crop(*rect)
+    if len(SESSIONS) > 1:
+        frame = Frame(memoryview(bytearray(frame.tobytes())), frame.width, frame.height, frame.width * 4)
+    diff = tiles.update(frame) if bool(_cfg("DIFF_ENABLED", True)) else {}
+    if diff and not diff["changed"] and tiles.cached_png and bool(_cfg("DIFF_REUSE_UNCHANGED", False)):
+        png, diff["reused"] = tiles.cached_png, True
+    else:
+        png = tiles.cached_png = _bgra_to_png(frame)
+    log.info(
+        "capture done %dx%d png_bytes=%d changed_tiles=%s/%s reused=%s rois=%d", frame.width, frame.height, len(png),
+        diff.get("changed_tiles"), diff.get("tiles"), diff.get("reused", False), len(zooms),
+    )
+    return png, frame, diff, zooms
+
 
+_SpanData = tuple[tuple[int, ...], int]
 
-def parse_vlm_json(raw: str) -> tuple[str, list[dict[str, Any]], list[dict[str, Any]]]:
+_HEAT_STOPS: Final[tuple[tuple[float, str], ...]] = (
+    (0.0, "rgba(255,40,0,0.88)"), (0.25, "rgba(255,80,0,0.70)"), (0.55, "rgba(255,120,0,0.35)"), (1.0, "rgba(255,160,0,0)"),
+)
+_BBOX_STOPS: Final[tuple[tuple[float, str], ...]] = (
+    (0.0, "rgba(80,160,255,0.28)"), (0.5, "rgba(80,160,255,0.12)"), (1.0, "rgba(80,160,255,0)"),
+)
+_DRAG_LINE_COLOR: Final[str] = "rgba(255,100,20,0.35)"
+_LABEL_BG: Final[str] = "rgba(0,0,0,0.7)"
+_GLYPH_ADVANCE: Final[int] = 6
+_FONT_5X7: Final[dict[str, str]] = {
+    "0": "0e11131519110e", "1": "040c040404040e", "2": "0e11010204081f", "3": "1f02040201110e",
+    "4": "02060a121f0202", "5": "1f101e0101110e", "6": "0608101e11110e", "7": "1f010204080808",
+    "8": "0e11110e11110e", "9": "0e11110f01020c", "a": "00000e010f110f", "b": "1010161911111e",
+    "c": "00000e1010110e", "d": "01010d1311110f", "e": "00000e111f100e", "f": "0609081c080808",
+    "g": "000f11110f010e", "h": "10101619111111", "i": "04000c0404040e", "j": "0200060202120c",
+    "k": "10101214181412", "l": "0c04040404040e", "m": "00001a15151111", "n": "00001619111111",
+    "o": "00000e1111110e", "p": "00001e111e1010", "q": "00000d130f0101", "r": "00001619101010",
+    "s": "00000e100e011e", "t": "08081c08080906", "u": "0000111111130d", "v": "00001111110a04",
+    "w": "0000111115150a", "x": "0000110a040a11", "y": "000011110f010e", "z": "00001f0204081f",
+    ".": "00000000000c0c", ",": "000000000c0408", "(": "02040808080402", ")": "08040202020408",
+    "_": "0000000000001f", "-": "0000001f000000", " ": "00000000000000", "?": "0e110102040004",
+}
+
+
+def _css_rgba(color: str) -> tuple[int, int, int, float]:
+    c = str(color).strip().lower()
     try:
-        obj = json.loads(raw)
-    except json.JSONDecodeError:
-        start, end = raw.find("{"), raw.rfind("}")
-        if start >= 0 and end > start:
-            try:
-                obj = json.loads(raw[start:end + 1])
-            except json.JSONDecodeError:
-                log.warning("vlm json parse failed completely")
-                return raw, [], []
-        else:
-            return raw, [], []
-    observation = str(obj.get("observation", ""))
+        if c.startswith("#"):
+            h = c[1:]
+            if len(h) in (3, 4):
+                h = "".join(ch * 2 for ch in h)
+            v = [int(h[i:i + 2], 16) for i in range(0, len(h), 2)]
+            return v[0], v[1], v[2], v[3] / 255 if len(v) > 3 else 1.0
+        if c.startswith("rgb") and "(" in c:
+            p = [x.strip() for x in c[c.index("(") + 1:c.rindex(")")].split(",")]
+            return int(float(p[0])), int(float(p[1])), int(float(p[2])), float(p[3]) if len(p) > 3 else 1.0
+    except (ValueError, IndexError):
+        pass
+    log.warning("unsupported css color %r, using transparent", color)
+    return 0, 0, 0, 0.0
 
-    def ni(v: Any) -> int:
-        try:
-            return _clampi(int(v), 0, NORM_MAX)
-        except Exception:
-            return 0
 
-    bboxes: list[dict[str, Any]] = []
-    for b in obj.get("bboxes", []):
-        if isinstance(b, dict) and all(k in b for k in ("x1", "y1", "x2", "y2")):
-            bboxes.append({"x1": ni(b["x1"]), "y1": ni(b["y1"]), "x2": ni(b["x2"]), "y2": ni(b["y2"])})
-    actions: list[dict[str, Any]] = []
-    for a in obj.get("actions", []):
-        if isinstance(a, dict) and "name" in a and "x1" in a and "y1" in a:
-            entry: dict[str, Any] = {"name": str(a["name"]).lower(), "x1": ni(a["x1"]), "y1": ni(a["y1"])}
-            if "x2" in a and "y2" in a:
-                entry["x2"] = ni(a["x2"])
-                entry["y2"] = ni(a["y2"])
-            actions.append(entry)
-    log.info("parse_vlm_json obs_len=%d bboxes=%d actions=%d", len(observation), len(bboxes), len(actions))
-    return observation, bboxes, actions
+def _gradient_at(stops: list[tuple[float, tuple[int, int, int, float]]], t: float) -> tuple[float, float, float, float]:
+    if t <= stops[0][0]:
+        return stops[0][1]
+    for (p0, c0), (p1, c1) in zip(stops, stops[1:]):
+        if t <= p1:
+            f = (t - p0) / (p1 - p0) if p1 > p0 else 1.0
+            return c0[0] + (c1[0] - c0[0]) * f, c0[1] + (c1[1] - c0[1]) * f, c0[2] + (c1[2] - c0[2]) * f, c0[3] + (c1[3] - c0[3]) * f
+    return stops[-1][1]
 
 
-def _append_jsonl(path: Path, obj: dict[str, Any]) -> None:
-    try:
-        with path.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(obj, ensure_ascii=False, separators=(",", ":")))
-            f.write("\n")
-    except Exception as e:
-        log.warning("append jsonl failed: %s", e)
+def _span(pixels: list[tuple[float, float, float, int]]) -> _SpanData:
+    inv, pre = bytearray(), bytearray()
+    for b, g, r, a in pixels:
+        inv += bytes((255 - a, 255 - a, 255 - a, 255))
+        pre += bytes(((round(b) * a + 127) // 255, (round(g) * a + 127) // 255, (round(r) * a + 127) // 255, 0))
+    return tuple(_widen16(bytes(0xFF if v >> bit & 1 else 0 for v in inv)) for bit in range(8)), _widen16(bytes(pre))
 
 
-def save_turn_data(
-    run_dir: Path, turn: int, observation: str,
-    bboxes: list[dict[str, Any]], actions: list[dict[str, Any]], raw_b64: str,
-) -> None:
-    layout = str(_cfg("LOG_LAYOUT", "turn_dirs")).lower()
-    if layout == "flat":
-        raw_name = f"turn_{turn:04d}_raw.png"
-        if raw_b64:
-            try:
-                (run_dir / raw_name).write_bytes(base64.b64decode(raw_b64))
-            except Exception as e:
-                log.warning("save raw png failed: %s", e)
-        _append_jsonl(
-            run_dir / "turns.jsonl",
-            {"turn": turn, "stage": "raw", "observation": observation, "bboxes": bboxes, "actions": actions, "raw_png": raw_name},
-        )
+def _blend_span(frame: Frame, x: int, y: int, n: int, span: _SpanData, lo: int = 0, hi: int | None = None) -> None:
+    hi = frame.width if hi is None else min(hi, frame.width)
+    lo = max(0, lo)
+    left, right = max(0, lo - x), max(0, x + n - hi)
+    if not 0 <= y < frame.height or (m := n - left - right) <= 0:
         return
-    td = run_dir / f"turn_{turn:04d}"
-    td.mkdir(exist_ok=True)
-    (td / "vlm_output.json").write_text(
-        json.dumps({"turn": turn, "observation": observation, "bboxes": bboxes, "actions": actions},
-                   ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
-    if raw_b64:
-        try:
-            (td / "screenshot_raw.png").write_bytes(base64.b64decode(raw_b64))
-        except Exception as e:
-            log.warning("save raw png failed: %s", e)
+    masks, pre = span
+    if left or right:
+        keep, sh = (1 << (64 * m)) - 1, 64 * right
+        masks, pre = tuple((v >> sh) & keep for v in masks), (pre >> sh) & keep
+    o = frame.offset + y * frame.stride + (x + left) * 4
+    nb = m * 4
+    d = _widen16(frame.buf[o:o + nb])
+    acc = _lanes(nb, b"\x00\x80")
+    for bit, mask in enumerate(masks):
+        if mask:
+            acc += (d & mask) << bit
+    low = _lanes(nb, b"\x00\xff")
+    acc = ((acc + ((acc >> 8) & low)) >> 8) & low
+    frame.buf[o:o + nb] = (acc + pre).to_bytes(nb * 2, "big")[1::2]
 
 
-def save_annotated(run_dir: Path, turn: int, annotated_b64: str) -> None:
-    layout = str(_cfg("LOG_LAYOUT", "turn_dirs")).lower()
-    if layout == "flat":
-        ann_name = f"turn_{turn:04d}_annotated.png"
-        try:
-            (run_dir / ann_name).write_bytes(base64.b64decode(annotated_b64))
-        except Exception as e:
-            log.warning("save annotated png failed: %s", e)
-        _append_jsonl(run_dir / "turns.jsonl", {"turn": turn, "stage": "annotated", "annotated_png": ann_name})
+def _blend_px(frame: Frame, x: int, y: int, rgb: tuple[int, int, int], a: int) -> None:
+    if a <= 0 or not (0 <= x < frame.width and 0 <= y < frame.height):
         return
-    td = run_dir / f"turn_{turn:04d}"
-    td.mkdir(exist_ok=True)
-    try:
-        (td / "screenshot_annotated.png").write_bytes(base64.b64decode(annotated_b64))
-    except Exception as e:
-        log.warning("save annotated png failed: %s", e)
+    o, buf, inv = frame.offset + y * frame.stride + x * 4, frame.buf, 255 - a
+    buf[o] = (buf[o] * inv + rgb[2] * a + 127) // 255
+    buf[o + 1] = (buf[o + 1] * inv + rgb[1] * a + 127) // 255
+    buf[o + 2] = (buf[o + 2] * inv + rgb[0] * a + 127) // 255
 
 
-def format_user_payload(observation: str, annotated_b64: str) -> dict[str, Any]:
-    return {
-        "type": "text_and_image",
-        "text": observation,
-        "image_b64": annotated_b64,
-    }
+_StampRows = list[tuple[int, int, int, _SpanData]]
 
 
-def _move_to(x: int, y: int) -> None:
-    _user32.SetCursorPos(x, y)
+def _build_radial_stamp(radius: float, stops: tuple[tuple[float, str], ...], alpha: float) -> _StampRows:
+    parsed = sorted((float(p), _css_rgba(c)) for p, c in stops)
+    top: _StampRows = []
+    r = max(radius, 0.5)
+    for dy in range(-math.ceil(r), 0):
+        fy = dy + 0.5
+        if (half := r * r - fy * fy) <= 0:
+            continue
+        half = math.sqrt(half)
+        x0, x1 = math.ceil(-half - 0.5), math.floor(half - 0.5)
+        px = []
+        for dx in range(x0, x1 + 1):
+            cr, cg, cb, ca = _gradient_at(parsed, math.hypot(dx + 0.5, fy) / r)
+            px.append((cb, cg, cr, round(_clampf(ca * alpha, 0.0, 1.0) * 255)))
+        lit = [i for i, p in enumerate(px) if p[3]]
+        if lit:
+            px = px[lit[0]:lit[-1] + 1]
+            top.append((dy, x0 + lit[0], len(px), _span(px)))
+    return top + [(-1 - dy, x0, n, span) for dy, x0, n, span in reversed(top)]
 
 
-def _mouse(flags: int) -> None:
-    _user32.mouse_event(flags, 0, 0, 0, 0)
+class StampCache:
+    """Bounded LRU of radial-gradient stamps keyed by (radius, stops, alpha); shrink is folded into radius."""
+
+    def __init__(self) -> None:
+        self._stamps: collections.OrderedDict[tuple[float, tuple[tuple[float, str], ...], float], _StampRows] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, radius: float, stops: tuple[tuple[float, str], ...], alpha: float) -> _StampRows:
+        key = (round(radius, 1), stops, round(_clampf(alpha, 0.0, 1.0), 4))
+        with self._lock:
+            if (rows := self._stamps.get(key)) is not None:
+                self._stamps.move_to_end(key)
+                self.hits += 1
+                return rows
+            self.misses += 1
+        rows = _build_radial_stamp(*key)
+        with self._lock:
+            self._stamps[key] = rows
+            while len(self._stamps) > max(1, int(_cfg("STAMP_CACHE_SIZE", 64))):
+                self._stamps.popitem(last=False)
+                self.evictions += 1
+        return rows
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._stamps), "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+STAMPS: Final[StampCache] = StampCache()
+
+
+@functools.lru_cache(maxsize=256)
+def _solid_span(n: int, color: str, alpha: float = 1.0) -> _SpanData:
+    r, g, b, a = _css_rgba(color)
+    return _span([(b, g, r, round(_clampf(a * alpha, 0.0, 1.0) * 255))] * n)
+
+
+def _draw_stamp(
+    frame: Frame, cx: float, cy: float, rows: _StampRows,
+    clip: tuple[int, int, int, int] | None = None,
+) -> None:
+    x_lo, y_lo, x_hi, y_hi = clip or (0, 0, frame.width, frame.height)
+    ix, iy = round(cx), round(cy)
+    for dy, dx, n, span in rows:
+        if y_lo <= iy + dy < y_hi:
+            _blend_span(frame, ix + dx, iy + dy, n, span, x_lo, x_hi)
+
+
+def _fill_rect(frame: Frame, x: int, y: int, w: int, h: int, color: str, alpha: float = 1.0) -> None:
+    if w <= 0 or h <= 0:
+        return
+    span = _solid_span(w, color, alpha)
+    for yy in range(max(0, y), min(frame.height, y + h)):
+        _blend_span(frame, x, yy, w, span)
+
+
+def _stroke_rect(frame: Frame, x1: float, y1: float, x2: float, y2: float, width: float, color: str) -> None:
+    def cover(i: int, lo: float, hi: float) -> float:
+        return _clampf(min(i + 1, hi) - max(i, lo), 0.0, 1.0)
+
+    r, g, b, a = _css_rgba(color)
+    ix1, iy1, ix2, iy2 = x1 + width, y1 + width, x2 - width, y2 - width
+    lo, hi = math.ceil(ix1), math.floor(ix2)
+    edges = (range(math.floor(x1), lo), range(max(lo, hi), math.ceil(x2)))
+    rows: dict[tuple[float, float], list[tuple[int, int, _SpanData]]] = {}
+    for y in range(max(0, math.floor(y1)), min(frame.height, math.ceil(y2))):
+        key = oy, iy = cover(y, y1, y2), cover(y, iy1, iy2)
+        if (row := rows.get(key)) is None:
+            row = rows[key] = [
+                (e.start, len(e), _span([(b, g, r, round(a * 255 * (cover(x, x1, x2) * oy - cover(x, ix1, ix2) * iy))) for x in e]))
+                for e in edges if e
+            ]
+            if hi > lo and oy > iy:
+                row.append((lo, hi - lo, _solid_span(hi - lo, color, oy - iy)))
+        for x, n, span in row:
+            _blend_span(frame, x, y, n, span)
+
+
+def _draw_line(frame: Frame, x0: float, y0: float, x1: float, y1: float, color: str, width: float, alpha: float = 1.0) -> None:
+    r, g, b, a = _css_rgba(color)
+    a8 = _clampf(a * alpha, 0.0, 1.0) * 255
+    dx, dy = x1 - x0, y1 - y0
+    if (length := math.hypot(dx, dy)) < 1e-6 or a8 <= 0:
+        return
+    steep = abs(dy) > abs(dx)
+    if steep:
+        x0, y0, x1, y1, dx, dy = y0, x0, y1, x1, dy, dx
+    if x0 > x1:
+        x0, y0, x1, y1 = x1, y1, x0, y0
+    th = width / 2 * length / abs(dx)
+    for i in range(round(x0), round(x1)):
+        m = y0 + (i + 0.5 - x0) * dy / dx
+        for j in range(math.floor(m - th - 1), math.ceil(m + th + 1)):
+            if (cov := _clampf(th + 0.5 - abs(j + 0.5 - m), 0.0, 1.0)) > 0:
+                _blend_px(frame, j if steep else i, i if steep else j, (r, g, b), round(a8 * cov))
+
+
+def _draw_text(frame: Frame, x: int, y: int, text: str) -> None:
+    for k, ch in enumerate(text):
+        glyph = bytes.fromhex(_FONT_5X7.get(ch.lower(), _FONT_5X7["?"]))
+        gx = x + k * _GLYPH_ADVANCE
+        for gy, bits in enumerate(glyph):
+            py = y + gy
+            if not bits or not 0 <= py < frame.height:
+                continue
+            for bx in range(5):
+                if bits >> (4 - bx) & 1 and 0 <= (px := gx + bx) < frame.width:
+                    o = frame.offset + py * frame.stride + px * 4
+                    frame.buf[o:o + 3] = b"\xff\xff\xff"
+
+
+class AnnotationRenderer:
+    """Headless rasterizer for panel.html's overlays: bbox heat, executed-action heat (with trail) and labels."""
+
+    def __init__(self) -> None:
+        self._trail: list[tuple[int, list[dict[str, Any]]]] = []
+
+    def render(
+        self, frame: Frame, seq: int, bboxes: list[dict[str, Any]], actions: list[dict[str, Any]], labels: bool = True,
+    ) -> Frame:
+        ui = _cfg("UI_CONFIG", {}) or {}
+        out = Frame(memoryview(bytearray(frame.tobytes())), frame.width, frame.height, frame.width * 4)
+        self._bbox_heat(out, bboxes, ui.get("bbox_heat") or {})
+        self._executed_trail(out, seq, actions, ui.get("executed_heat") or {})
+        if labels:
+            self._labels(out, actions)
+        return out
+
+    def _executed(self, f: Frame, actions: list[dict[str, Any]], cfg: dict[str, Any], alpha: float, shrink: float) -> None:
+        stops = tuple((float(p), str(c)) for p, c in cfg.get("stops") or _HEAT_STOPS)
+        r = max(f.width, f.height) * float(cfg.get("radius_scale", 0.22)) * shrink
+        disc, end_disc = STAMPS.get(r, stops, alpha), STAMPS.get(r * 0.6, stops, alpha)
+        sx, sy = f.width / NORM_MAX, f.height / NORM_MAX
+        for a in actions:
+            x, y = a.get("x1", 0) * sx, a.get("y1", 0) * sy
+            _draw_stamp(f, x, y, disc)
+            if "x2" in a and "y2" in a:
+                x2, y2 = a["x2"] * sx, a["y2"] * sy
+                if shrink != 1:
+                    mx, my = (x + x2) / 2, (y + y2) / 2
+                    x, y, x2, y2 = mx + (x - mx) * shrink, my + (y - my) * shrink, mx + (x2 - mx) * shrink, my + (y2 - my) * shrink
+                _draw_stamp(f, x2, y2, end_disc)
+                _draw_line(f, x, y, x2, y2, _DRAG_LINE_COLOR, max(1.0, 2 * shrink), alpha)
+
+    def _executed_trail(self, f: Frame, seq: int, actions: list[dict[str, Any]], cfg: dict[str, Any]) -> None:
+        if cfg.get("enabled") is False:
+            return
+        n = max(1, int(cfg.get("trail_turns", 1) or 1))
+        if n <= 1:
+            self._trail.clear()
+            self._executed(f, actions, cfg, 1.0, 1.0)
+            return
+        if self._trail and seq <= self._trail[-1][0]:
+            self._trail.clear()
+        self._trail.append((seq, actions))
+        del self._trail[:-n]
+        s = float(cfg.get("trail_shrink", 1.0) or 1.0)
+        s = s if s > 0 else 1.0
+        for i, (_, acts) in enumerate(self._trail):
+            age = len(self._trail) - 1 - i
+            self._executed(f, acts, cfg, (i + 1) / len(self._trail), 1.0 if s == 1 else s ** age)
+
+    def _bbox_heat(self, f: Frame, bboxes: list[dict[str, Any]], cfg: dict[str, Any]) -> None:
+        if cfg.get("enabled") is False:
+            return
+        border = str(cfg.get("border", "rgba(80,160,255,0.75)"))
+        bw_px = int(cfg.get("border_width", 2))
+        stops = tuple((float(p), str(c)) for p, c in cfg.get("fill_stops") or _BBOX_STOPS)
+        sx, sy = f.width / NORM_MAX, f.height / NORM_MAX
+        for bb in bboxes:
+            x1, y1, x2, y2 = bb["x1"] * sx, bb["y1"] * sy, bb["x2"] * sx, bb["y2"] * sy
+            if x2 <= x1 or y2 <= y1:
+                continue
+            rx1, ry1, rx2, ry2 = round(x1), round(y1), round(x2), round(y2)
+            stamp = STAMPS.get(max(x2 - x1, y2 - y1) / 2, stops, 1.0)
+            _draw_stamp(f, (x1 + x2) / 2, (y1 + y2) / 2, stamp, (rx1, ry1, rx2, ry2))
+            _stroke_rect(f, x1, y1, x2, y2, bw_px, border)
+
+    def _labels(self, f: Frame, actions: list[dict[str, Any]]) -> None:
+        sx, sy = f.width / NORM_MAX, f.height / NORM_MAX
+        for i, a in enumerate(actions):
+            label = f"{i + 1}. {a.get('name', '')}({a.get('x1', 0)},{a.get('y1', 0)})"
+            x, y = round(a.get("x1", 0) * sx) + 6, round(a.get("y1", 0) * sy) - 3
+            _fill_rect(f, x - 2, y - 11, len(label) * _GLYPH_ADVANCE + 4, 13, _LABEL_BG)
+            _draw_text(f, x, y - 9, label)
+
+    @staticmethod
+    def label_rects(w: int, h: int, actions: list[dict[str, Any]]) -> list[tuple[int, int, int, int]]:
+        out = []
+        for i, a in enumerate(actions):
+            n = len(f"{i + 1}. {a.get('name', '')}({a.get('x1', 0)},{a.get('y1', 0)})")
+            x, y = round(a.get("x1", 0) * w / NORM_MAX) + 6, round(a.get("y1", 0) * h / NORM_MAX) - 3
+            out.append((x - 2, y - 11, x + n * _GLYPH_ADVANCE + 2, y + 2))
+        return out
+
+
+def render_annotated(
+    frame: Frame, seq: int, bboxes: list[dict[str, Any]], actions: list[dict[str, Any]],
+) -> tuple[bytes, Frame]:
+    out = _SESSION.get().renderer.render(frame, seq, bboxes, actions)
+    png = _bgra_to_png(out)
+    st = STAMPS.stats()
+    log.info("annotate seq=%d png_bytes=%d stamp_cache entries=%d hit_rate=%.3f", seq, len(png), st["entries"], st["hit_rate"])
+    return png, out
+
+
+@functools.lru_cache(maxsize=8)
+def _posterize_table(bits: int) -> bytes:
+    levels = (1 << bits) - 1
+    return bytes(((v >> (8 - bits)) * 255 + levels // 2) // levels for v in range(256))
+
+
+def vlm_image(png: bytes, frame: Frame | None = None) -> tuple[bytes, dict[str, Any]]:
+    """Apply the VLM_IMAGE_* policy to the outgoing image; the on-disk PNGs are never touched."""
+    w, h = struct.unpack(">II", png[16:24])
+    budget = int(_cfg("VLM_IMAGE_MAX_PIXELS", 0) or 0)
+    patch = int(_cfg("VLM_IMAGE_PATCH", 0) or 0)
+    fmt = str(_cfg("VLM_IMAGE_FORMAT", "png")).lower()
+    if fmt not in ("png", "png-lossy"):
+        log.warning("unknown VLM_IMAGE_FORMAT=%r, using png", fmt)
+        fmt = "png"
+    bits = _clampi(int(_cfg("VLM_IMAGE_LOSSY_BITS", 5)), 1, 8)
+    scale = min(1.0, math.sqrt(budget / (w * h))) if budget > 0 else 1.0
+    cw, ch = max(1, int(w * scale)), max(1, int(h * scale))
+    if patch > 0:
+        cw, ch = max(patch, cw // patch * patch), max(patch, ch // patch * patch)
+    policy = f"{fmt}{bits if fmt == 'png-lossy' else ''}@{cw}x{ch}"
+    if (cw, ch) == (w, h) and fmt == "png":
+        return png, {"policy": policy, "width": w, "height": h, "bytes": len(png), "box": None}
+    img = frame if frame is not None else _decode_bgra(png)
+    fit = min(cw / w, ch / h)
+    iw, ih = min(cw, max(1, round(w * fit))), min(ch, max(1, round(h * fit)))
+    while img.width >= 2 * iw and img.height >= 2 * ih:
+        img = _downscale_half(img)
+    if (img.width, img.height) != (iw, ih):
+        img = _stretch_nearest(img, Frame(memoryview(bytearray(iw * ih * 4)), iw, ih, iw * 4))
+    ox, oy = (cw - iw) // 2, (ch - ih) // 2
+    box = [ox, oy, iw, ih, cw, ch] if (iw, ih) != (cw, ch) else None
+    if box or img is frame:
+        canvas = Frame(memoryview(bytearray(cw * ch * 4)), cw, ch, cw * 4)
+        for y in range(ih):
+            o = (oy + y) * canvas.stride + ox * 4
+            canvas.buf[o:o + iw * 4] = img.row(y)
+        img = canvas
+    if fmt == "png-lossy":
+        img.buf[:] = img.buf.tobytes().translate(_posterize_table(bits))
+    out = _bgra_to_png(img)
+    return out, {"policy": policy, "width": cw, "height": ch, "bytes": len(out), "box": box}
+
+
+def vlm_image_b64(png: bytes, frame: Frame | None = None) -> tuple[bytes, dict[str, Any], str]:
+    out, info = vlm_image(png, frame)
+    return out, info, base64.b64encode(out).decode("ascii")
+
+
+def _unletterbox(items: list[dict[str, Any]], box: list[int]) -> list[dict[str, Any]]:
+    ox, oy, iw, ih, cw, ch = box
+    out = []
+    for it in items:
+        m = dict(it)
+        for k in ("x1", "x2"):
+            if k in m:
+                m[k] = _clampi(round((m[k] * cw / NORM_MAX - ox) * NORM_MAX / iw), 0, NORM_MAX)
+        for k in ("y1", "y2"):
+            if k in m:
+                m[k] = _clampi(round((m[k] * ch / NORM_MAX - oy) * NORM_MAX / ih), 0, NORM_MAX)
+        out.append(m)
+    return out
+
+
+def _ni(v: Any) -> int:
+    try:
+        return _clampi(int(v), 0, NORM_MAX)
+    except Exception:
+        return 0
+
+
+def _norm_action(a: Any) -> dict[str, Any] | None:
+    if not (isinstance(a, dict) and "name" in a and "x1" in a and "y1" in a):
+        return None
+    entry: dict[str, Any] = {"name": str(a["name"]).lower(), "x1": _ni(a["x1"]), "y1": _ni(a["y1"])}
+    if "x2" in a and "y2" in a:
+        entry["x2"] = _ni(a["x2"])
+        entry["y2"] = _ni(a["y2"])
+    return entry
+
+
+_JSON_TOKEN: Final[re.Pattern[str]] = re.compile(
+    r'\s*(?:(?P<punct>[{}\[\]:,])|(?P<str>"[^"\\]*(?:\\.[^"\\]*)*")|(?P<num>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)'
+    r"|(?P<open>\"(?:[^\"\\]|\\.)*\\?\Z)|(?P<sq>'(?:[^'\\]|\\.)*')|(?P<word>[A-Za-z_]\w*)|(?P<junk>.))|(?P<ws>\s+)",
+    re.S,
+)
+_JSON_DECODER: Final[json.JSONDecoder] = json.JSONDecoder()
+_JSON_LAX: Final[json.JSONDecoder] = json.JSONDecoder(strict=False)
+_JSON_WORDS: Final[dict[str, Any]] = {"true": True, "false": False, "null": None}
+_PY_WORDS: Final[dict[str, Any]] = {"True": True, "False": False, "None": None}
+
+
+def repair_json(raw: str) -> tuple[Any, list[str]]:
+    """Single-pass tolerant JSON reader for model output; returns (first top-level object or None, repairs)."""
+    repairs: list[str] = []
+    start = raw.find("{")
+    if start >= 0 and "[" not in raw[:start]:
+        # Fast path: valid objects wrapped in prose or a code fence. Anything else goes through the tokenizer below.
+        objs: list[dict[str, Any]] = []
+        pos, gaps = start, []
+        try:
+            while pos >= 0:
+                obj, end = _JSON_DECODER.raw_decode(raw, pos)
+                objs.append(obj)
+                pos = raw.find("{", end)
+                gaps.append(raw[end:pos] if pos >= 0 else raw[end:])
+        except json.JSONDecodeError:
+            objs = []
+        if objs:
+            if raw[:start].strip():
+                repairs.append("$:leading_text")
+            if any(g.strip().strip("}]").strip() for g in gaps):
+                repairs.append("$:trailing_text")
+            for extra in objs[1:]:
+                repairs.append("$:merged_object")
+                for k, v in extra.items():
+                    objs[0].setdefault(k, v)
+            return objs[0], repairs
+    stack: list[list[Any]] = []  # [container, pending key, colon seen]
+    result: Any = None
+    prev = ""
+
+    def note(kind: str) -> None:
+        field = str(stack[0][1]) if stack and stack[0][1] is not None else "$"
+        if len(stack) > 1 and isinstance(stack[1][0], list):
+            field += f"[{len(stack[1][0])}]"
+        if (tag := f"{field}:{kind}") not in repairs:
+            repairs.append(tag)
+
+    def attach(val: Any, is_str: bool = False) -> None:
+        nonlocal result
+        if not stack:
+            if result is None:
+                result = val
+            elif isinstance(result, dict) and isinstance(val, dict):
+                repairs.append("$:merged_object")
+                for k, v in val.items():
+                    result.setdefault(k, v)
+            return
+        top = stack[-1]
+        if isinstance(top[0], list):
+            top[0].append(val)
+        elif top[1] is None:
+            if is_str:
+                top[1] = val
+            else:
+                note("non_string_key")
+        else:
+            if not top[2]:
+                note("missing_colon")
+            top[0][top[1]] = val
+            top[1], top[2] = None, False
+
+    def expect_item() -> None:
+        if stack and (isinstance(stack[-1][0], list) or stack[-1][1] is None) and prev not in ("{", "[", ","):
+            note("missing_comma")
+
+    def close(eof: bool = False) -> None:
+        if stack[-1][1] is not None:
+            note("dropped_key")
+        container = stack.pop()[0]
+        if eof and isinstance(container, dict) and stack and isinstance(stack[-1][0], list):
+            note("dropped_incomplete_element")
+            return
+        attach(container)
+
+    for m in _JSON_TOKEN.finditer(raw):
+        kind = m.lastgroup or "junk"
+        tok = m.group(kind)
+        if kind == "ws":
+            continue
+        if not stack and not (tok == "{" or tok == "[" and result is None):
+            if not (result is not None and tok in "}]"):
+                repairs.append("$:leading_text" if result is None else "$:trailing_text")
+                repairs[:] = list(dict.fromkeys(repairs))
+            continue
+        if kind == "punct":
+            if tok in "{[":
+                expect_item()
+                stack.append([{} if tok == "{" else [], None, False])
+            elif tok in "}]":
+                if prev == ",":
+                    note("trailing_comma")
+                want = dict if tok == "}" else list
+                mismatched = False
+                while len(stack) > 1 and not isinstance(stack[-1][0], want):
+                    note("mismatched_bracket")
+                    close()
+                    mismatched = True
+                if not (mismatched and len(stack) == 1):  # a wrong closer never ends the top-level object
+                    close()
+            elif tok == ":":
+                if isinstance(stack[-1][0], dict) and stack[-1][1] is not None:
+                    stack[-1][2] = True
+                else:
+                    note("stray_colon")
+            elif isinstance(stack[-1][0], dict) and stack[-1][1] is not None:
+                note("dropped_key")
+                stack[-1][1], stack[-1][2] = None, False
+            prev = tok
+            continue
+        top = stack[-1]
+        is_key = isinstance(top[0], dict) and top[1] is None
+        if kind in ("str", "open"):
+            text = tok if kind == "str" else tok.rstrip("\\") + '"'
+            if "\\" not in text:
+                val = text[1:-1]
+            else:
+                try:
+                    val = _JSON_LAX.decode(text)
+                except json.JSONDecodeError:
+                    val = text[1:-1]
+                    note("bad_escape")
+            if kind == "open":
+                if is_key:
+                    break
+                note("unterminated_string")
+            expect_item()
+            attach(val, is_str=True)
+        elif kind == "sq":
+            note("single_quotes")
+            expect_item()
+            attach(tok[1:-1].replace("\\'", "'"), is_str=True)
+        elif kind == "num":
+            expect_item()
+            if m.end() == len(raw.rstrip()):
+                note("truncated_number")
+            else:
+                attach(float(tok) if any(c in tok for c in ".eE") else int(tok))
+        elif kind == "word" and is_key:
+            note("unquoted_key")
+            expect_item()
+            attach(tok, is_str=True)
+        elif kind == "word" and (tok in _JSON_WORDS or tok in _PY_WORDS):
+            if tok in _PY_WORDS:
+                note("python_literal")
+            expect_item()
+            attach(_JSON_WORDS.get(tok, _PY_WORDS.get(tok)))
+        else:
+            note("junk")
+        prev = kind
+    if stack:
+        note("truncated")
+        while stack:
+            close(eof=True)
+    if isinstance(result, list):
+        result = next((v for v in result if isinstance(v, dict)), None)
+        repairs.append("$:unwrapped_array")
+    return result, repairs
+
+
+def parse_vlm_json(raw: str) -> tuple[str, list[dict[str, Any]], list[dict[str, Any]], list[str]]:
+    """Returns (observation, bboxes, actions, repairs); repairs is empty for clean JSON."""
+    try:
+        obj, repairs = json.loads(raw), []
+    except json.JSONDecodeError:
+        obj, repairs = repair_json(raw)
+    if isinstance(obj, list):
+        obj = next((v for v in obj if isinstance(v, dict)), None)
+        repairs.append("$:unwrapped_array")
+    if not isinstance(obj, dict):
+        log.warning("vlm json parse failed completely")
+        return raw, [], [], repairs + ["$:no_object"]
+    observation = str(obj.get("observation", ""))
+    bboxes: list[dict[str, Any]] = []
+    items = obj.get("bboxes", [])
+    for b in items if isinstance(items, list) else []:
+        if isinstance(b, dict) and all(k in b for k in ("x1", "y1", "x2", "y2")):
+            bboxes.append({"x1": _ni(b["x1"]), "y1": _ni(b["y1"]), "x2": _ni(b["x2"]), "y2": _ni(b["y2"])})
+        else:
+            repairs.append("bboxes:invalid_element")
+    items = obj.get("actions", [])
+    actions: list[dict[str, Any]] = []
+    for a in items if isinstance(items, list) else []:
+        if (e := _norm_action(a)) is not None:
+            actions.append(e)
+        else:
+            repairs.append("actions:invalid_element")
+    if repairs:
+        log.warning("parse_vlm_json repaired: %s", ", ".join(dict.fromkeys(repairs)))
+    log.info("parse_vlm_json obs_len=%d bboxes=%d actions=%d", len(observation), len(bboxes), len(actions))
+    return observation, bboxes, actions, list(dict.fromkeys(repairs))
+
+
+class ActionStreamParser:
+    """Incremental scanner that yields each completed element of the top-level "actions" array."""
+
+    def __init__(self) -> None:
+        self.buf = ""
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._str_start = 0
+        self._key = ""
+        self._in_actions = False
+        self._elem_start = -1
+
+    def feed(self, chunk: str) -> list[dict[str, Any]]:
+        start = len(self.buf)
+        self.buf += chunk
+        buf, out = self.buf, []
+        for i in range(start, len(buf)):
+            c = buf[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+                    if self._depth == 1:
+                        self._key = buf[self._str_start + 1:i]
+            elif c == '"':
+                self._in_str, self._str_start = True, i
+            elif c in "{[":
+                if c == "[" and self._depth == 1 and self._key == "actions":
+                    self._in_actions = True
+                elif c == "{" and self._depth == 2 and self._in_actions:
+                    self._elem_start = i
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if c == "}" and self._depth == 2 and self._elem_start >= 0:
+                    try:
+                        if (entry := _norm_action(json.loads(buf[self._elem_start:i + 1]))) is not None:
+                            out.append(entry)
+                    except json.JSONDecodeError:
+                        pass
+                    self._elem_start = -1
+                elif self._depth == 1:
+                    self._in_actions = False
+        return out
+
+
+def _append_jsonl(path: Path, obj: dict[str, Any]) -> None:
+    try:
+        LOGW.write(path, json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+    except Exception as e:
+        log.warning("append jsonl failed: %s", e)
+
+
+def save_turn_data(
+    run_dir: Path, turn: int, observation: str,
+    bboxes: list[dict[str, Any]], actions: list[dict[str, Any]], raw_png: bytes, diff: dict[str, Any],
+    parse: dict[str, Any] | None = None,
+) -> None:
+    layout = str(_cfg("LOG_LAYOUT", "turn_dirs")).lower()
+    if layout == "archive":
+        arc = run_archive(run_dir)
+        if raw_png:
+            arc.append(turn, "raw_png", raw_png)
+        rec = {"turn": turn, "stage": "raw", "observation": observation, "bboxes": bboxes, "actions": actions,
+               "diff": diff, **(parse or {})}
+        arc.append(turn, "turn", json.dumps(rec, ensure_ascii=False, separators=(",", ":")).encode())
+        return
+    if layout == "flat":
+        raw_name = f"turn_{turn:04d}_raw.png"
+        ref: dict[str, Any] = {"raw_png": raw_name}
+        if raw_png and bool(_cfg("FRAME_DEDUP", False)):
+            ref = {"raw_blob": BLOBS.put(raw_png)}
+        elif raw_png:
+            try:
+                (run_dir / raw_name).write_bytes(raw_png)
+            except Exception as e:
+                log.warning("save raw png failed: %s", e)
+        _append_jsonl(
+            run_dir / "turns.jsonl",
+            {"turn": turn, "stage": "raw", "observation": observation, "bboxes": bboxes, "actions": actions,
+             **ref, "diff": diff, **(parse or {})},
+        )
+        return
+    td = run_dir / f"turn_{turn:04d}"
+    td.mkdir(exist_ok=True)
+    (td / "vlm_output.json").write_text(
+        json.dumps({"turn": turn, "observation": observation, "bboxes": bboxes, "actions": actions, "diff": diff,
+                    **(parse or {})}, ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    if raw_png:
+        try:
+            (td / "screenshot_raw.png").write_bytes(raw_png)
+        except Exception as e:
+            log.warning("save raw png failed: %s", e)
+
+
+def save_annotated(run_dir: Path, turn: int, annotated_png: bytes) -> None:
+    layout = str(_cfg("LOG_LAYOUT", "turn_dirs")).lower()
+    if layout == "archive":
+        run_archive(run_dir).append(turn, "annotated_png", annotated_png)
+        return
+    if layout == "flat" and bool(_cfg("FRAME_DEDUP", False)):
+        _append_jsonl(run_dir / "turns.jsonl", {"turn": turn, "stage": "annotated", "annotated_blob": BLOBS.put(annotated_png)})
+        return
+    if layout == "flat":
+        ann_name = f"turn_{turn:04d}_annotated.png"
+        try:
+            (run_dir / ann_name).write_bytes(annotated_png)
+        except Exception as e:
+            log.warning("save annotated png failed: %s", e)
+        _append_jsonl(run_dir / "turns.jsonl", {"turn": turn, "stage": "annotated", "annotated_png": ann_name})
+        return
+    td = run_dir / f"turn_{turn:04d}"
+    td.mkdir(exist_ok=True)
+    try:
+        (td / "screenshot_annotated.png").write_bytes(annotated_png)
+    except Exception as e:
+        log.warning("save annotated png failed: %s", e)
+
+
+def save_rois(run_dir: Path, turn: int, zooms: list[tuple[bytes, dict[str, Any]]]) -> None:
+    layout = str(_cfg("LOG_LAYOUT", "turn_dirs")).lower()
+    if layout == "archive":
+        for i, (png, _) in enumerate(zooms, 1):
+            run_archive(run_dir).append(turn, "roi_png", png, i)
+        return
+    flat = layout == "flat"
+    td = run_dir if flat else run_dir / f"turn_{turn:04d}"
+    td.mkdir(exist_ok=True)
+    for i, (png, _) in enumerate(zooms, 1):
+        try:
+            (td / (f"turn_{turn:04d}_roi_{i}.png" if flat else f"roi_{i}.png")).write_bytes(png)
+        except Exception as e:
+            log.warning("save roi png failed: %s", e)
+
+
+def save_turn_metrics(run_dir: Path, turn: int, metrics: dict[str, Any]) -> None:
+    layout = str(_cfg("LOG_LAYOUT", "turn_dirs")).lower()
+    if layout == "archive":
+        rec = {"turn": turn, "stage": "vlm", **metrics}
+        run_archive(run_dir).append(turn, "metrics", json.dumps(rec, ensure_ascii=False, separators=(",", ":")).encode())
+        return
+    if layout == "flat":
+        _append_jsonl(run_dir / "turns.jsonl", {"turn": turn, "stage": "vlm", **metrics})
+        return
+    td = run_dir / f"turn_{turn:04d}"
+    td.mkdir(exist_ok=True)
+    (td / "metrics.json").write_text(json.dumps({"turn": turn, **metrics}, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+ARCHIVE_NAME: Final[str] = "run.frz"
+_ARC_FILE_MAGIC: Final[bytes] = b"FRZARC1\n"
+_ARC_HDR: Final[struct.Struct] = struct.Struct("<4sIHHII")  # magic, turn, kind, seq, payload length, crc32
+_ARC_REC_MAGIC: Final[bytes] = b"FRZR"
+_ARC_KINDS: Final[tuple[str, ...]] = ("raw_png", "annotated_png", "turn", "metrics", "roi_png")
+_ARC_SLOT: Final[struct.Struct] = struct.Struct(f"<{len(_ARC_KINDS)}Q")
+
+
+class RunArchive:
+    """Single-file append-only run store (run.frz) with a fixed-slot sidecar index (run.frz.idx)."""
+
+    def __init__(self, path: Path, writable: bool = False) -> None:
+        self.path = path
+        self.idx_path = path.with_name(path.name + ".idx")
+        self._lock = threading.Lock()
+        self._extra: dict[tuple[int, int], int] = {}  # (turn, kind) -> offset of records missing from the index
+        self._writable = writable
+        if writable:
+            if not path.exists() or path.stat().st_size < len(_ARC_FILE_MAGIC):
+                path.write_bytes(_ARC_FILE_MAGIC)
+            self._f = path.open("r+b")
+            self._idx = self.idx_path.open("r+b" if self.idx_path.exists() else "w+b")
+            self._end = self._recover(truncate=True)
+        else:
+            self._f = path.open("rb")
+            self._idx = self.idx_path.open("rb") if self.idx_path.exists() else None
+            self._end = self._recover(truncate=False)
+
+    def _scan(self, start: int) -> Iterator[tuple[int, int, int, int, int]]:
+        """Yields (offset, turn, kind, seq, length) of intact records from start; stops at the first torn one."""
+        f, pos = self._f, start
+        while True:
+            f.seek(pos)
+            head = f.read(_ARC_HDR.size)
+            if len(head) < _ARC_HDR.size:
+                return
+            magic, turn, kind, seq, n, crc = _ARC_HDR.unpack(head)
+            payload = f.read(n)
+            if magic != _ARC_REC_MAGIC or kind >= len(_ARC_KINDS) or len(payload) < n or zlib.crc32(payload) != crc:
+                return
+            yield pos, turn, kind, seq, n
+            pos += _ARC_HDR.size + n
+
+    def _recover(self, truncate: bool) -> int:
+        start = len(_ARC_FILE_MAGIC)
+        if self._idx is not None:
+            self._idx.seek(0, os.SEEK_END)
+            if (slots := -(-self._idx.tell() // _ARC_SLOT.size)) > 0:
+                start = max(start, *self._slot(slots - 1))
+        size = self._f.seek(0, os.SEEK_END)
+        if start > size:
+            log.warning("archive %s: index points past the end, rescanning", self.path)
+            start = len(_ARC_FILE_MAGIC)
+        end = start
+        for off, turn, kind, seq, n in self._scan(start):
+            end = off + _ARC_HDR.size + n
+            if seq <= 1 and self._slot(turn)[kind] != off:
+                self._index(turn, kind, off)
+        if end < size:
+            log.warning("archive %s: %d bytes of torn tail %s", self.path, size - end, "dropped" if truncate else "ignored")
+            if truncate:
+                self._f.truncate(end)
+        for turn, slot in self._slots():
+            for kind, off in enumerate(slot):
+                if off >= end:
+                    self._index(turn, kind, 0)
+        return end
+
+    def _slots(self) -> Iterator[tuple[int, tuple[int, ...]]]:
+        """Yields (turn, offsets) for every index slot, before the in-memory overrides."""
+        if self._idx is None:
+            return
+        self._idx.seek(0)
+        raw = self._idx.read()
+        raw = raw.ljust(-(-len(raw) // _ARC_SLOT.size) * _ARC_SLOT.size, b"\0")
+        for turn in range(len(raw) // _ARC_SLOT.size):
+            yield turn, _ARC_SLOT.unpack_from(raw, turn * _ARC_SLOT.size)
+
+    def _slot(self, turn: int) -> tuple[int, ...]:
+        slot = (0,) * len(_ARC_KINDS)
+        if self._idx is not None:
+            self._idx.seek(turn * _ARC_SLOT.size)
+            if raw := self._idx.read(_ARC_SLOT.size):
+                slot = _ARC_SLOT.unpack(raw.ljust(_ARC_SLOT.size, b"\0"))
+        return tuple(self._extra.get((turn, k), off) for k, off in enumerate(slot))
+
+    def _index(self, turn: int, kind: int, offset: int) -> None:
+        if self._idx is None or not self._writable:
+            self._extra[(turn, kind)] = offset
+            return
+        self._idx.seek(turn * _ARC_SLOT.size + kind * 8)
+        self._idx.write(struct.pack("<Q", offset))
+        self._idx.flush()
+
+    def append(self, turn: int, kind: str, payload: bytes, seq: int = 0) -> None:
+        k = _ARC_KINDS.index(kind)
+        with self._lock:
+            off = self._end
+            self._f.seek(off)
+            self._f.write(_ARC_HDR.pack(_ARC_REC_MAGIC, turn, k, seq, len(payload), zlib.crc32(payload)))
+            self._f.write(payload)
+            self._f.flush()
+            self._end = off + _ARC_HDR.size + len(payload)
+            if seq <= 1:
+                self._index(turn, k, off)
+
+    def _read(self, offset: int, turn: int, kind: int) -> tuple[int, bytes] | None:
+        self._f.seek(offset)
+        head = self._f.read(_ARC_HDR.size)
+        if len(head) < _ARC_HDR.size:
+            return None
+        magic, t, k, seq, n, crc = _ARC_HDR.unpack(head)
+        payload = self._f.read(n)
+        if magic != _ARC_REC_MAGIC or (t, k) != (turn, kind) or len(payload) < n or zlib.crc32(payload) != crc:
+            return None
+        return seq, payload
+
+    def has(self, turn: int, kind: str) -> bool:
+        with self._lock:
+            return bool(self._slot(turn)[_ARC_KINDS.index(kind)])
+
+    def get(self, turn: int, kind: str) -> bytes | None:
+        k = _ARC_KINDS.index(kind)
+        with self._lock:
+            if not (off := self._slot(turn)[k]) or (rec := self._read(off, turn, k)) is None:
+                return None
+            return rec[1]
+
+    def get_json(self, turn: int, kind: str) -> dict[str, Any] | None:
+        raw = self.get(turn, kind)
+        return json.loads(raw) if raw else None
+
+    def iter_json(self) -> Iterator[dict[str, Any]]:
+        """Streams the turn and metrics records in file order without touching the index."""
+        json_kinds = (_ARC_KINDS.index("turn"), _ARC_KINDS.index("metrics"))
+        for off, turn, kind, _, n in self._scan(len(_ARC_FILE_MAGIC)):
+            if kind in json_kinds and (rec := self._read(off, turn, kind)) is not None:
+                yield json.loads(rec[1])
+
+    def rois(self, turn: int) -> list[bytes]:
+        k = _ARC_KINDS.index("roi_png")
+        out: list[bytes] = []
+        with self._lock:
+            off = self._slot(turn)[k]
+            while off and (rec := self._read(off, turn, k)) is not None and rec[0] == len(out) + 1:
+                out.append(rec[1])
+                off += _ARC_HDR.size + len(rec[1])
+        return out
+
+    def turns(self) -> list[int]:
+        with self._lock:
+            seen = {t for (t, _), off in self._extra.items() if off}
+            seen.update(t for t, slot in self._slots() if any(self._extra.get((t, k), off) for k, off in enumerate(slot)))
+        return sorted(seen)
+
+    def close(self) -> None:
+        with self._lock:
+            self._f.close()
+            if self._idx is not None:
+                self._idx.close()
+
+
+class BlobStore:
+    """Content-addressed PNG store shared by all runs: RUNS_DIR/blobs/<sha256[:2]>/<sha256>.png."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.refs: collections.Counter[str] = collections.Counter()
+        self.written = 0
+        self.written_bytes = 0
+        self.deduped_bytes = 0
+
+    @staticmethod
+    def root() -> Path:
+        return HERE / str(_cfg("RUNS_DIR", "runs")) / "blobs"
+
+    @staticmethod
+    def path(root: Path, digest: str) -> Path:
+        return root / digest[:2] / f"{digest}.png"
+
+    def put(self, png: bytes) -> str:
+        digest = hashlib.sha256(png).hexdigest()
+        path = self.path(self.root(), digest)
+        with self._lock:
+            self.refs[digest] += 1
+            known = self.refs[digest] > 1
+        if known or path.exists():
+            self.deduped_bytes += len(png)
+            return digest
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(png)
+            os.replace(tmp, path)
+            self.written += 1
+            self.written_bytes += len(png)
+        except Exception as e:
+            log.warning("save blob %s failed: %s", digest[:12], e)
+        return digest
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            refs, unique = sum(self.refs.values()), len(self.refs)
+        return {
+            "enabled": bool(_cfg("FRAME_DEDUP", False)), "refs": refs, "unique": unique, "written": self.written,
+            "written_bytes": self.written_bytes, "deduped_bytes": self.deduped_bytes,
+        }
+
+
+BLOBS: Final[BlobStore] = BlobStore()
+_BLOB_REF: Final[re.Pattern[str]] = re.compile(r'"turn":(\d+),"stage":"(raw|annotated)".*?"(?:raw|annotated)_blob":"([0-9a-f]{64})"')
+
+
+def _blob_root(run_dir: Path) -> Path:
+    for d in (run_dir.parent, run_dir.parent.parent):
+        if (d / "blobs").is_dir():
+            return d / "blobs"
+    return BlobStore.root()
+
+
+@functools.lru_cache(maxsize=4)
+def _blob_refs_cached(path: Path, size: int) -> dict[tuple[int, str], str]:
+    refs: dict[tuple[int, str], str] = {}
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if "_blob" in line and (m := _BLOB_REF.search(line)):
+                refs[(int(m.group(1)), m.group(2))] = m.group(3)
+    return refs
+
+
+def _blob_refs(run_dir: Path) -> dict[tuple[int, str], str]:
+    """(turn, "raw"|"annotated") -> blob digest for a flat run written with FRAME_DEDUP."""
+    path = run_dir / "turns.jsonl"
+    return _blob_refs_cached(path, path.stat().st_size) if path.exists() else {}
+
+
+_ARCHIVES: Final[dict[Path, RunArchive]] = {}
+_ARCHIVES_LOCK: Final[threading.Lock] = threading.Lock()
+
+
+def run_archive(run_dir: Path) -> RunArchive:
+    with _ARCHIVES_LOCK:
+        if (arc := _ARCHIVES.get(run_dir)) is None:
+            arc = _ARCHIVES[run_dir] = RunArchive(run_dir / ARCHIVE_NAME, writable=True)
+        return arc
+
+
+def close_archives() -> None:
+    with _ARCHIVES_LOCK:
+        for arc in _ARCHIVES.values():
+            arc.close()
+        _ARCHIVES.clear()
+
+
+class BackgroundWriter:
+    """Ordered single-thread writer that keeps run-dir persistence off the turn's critical path."""
+
+    def __init__(self) -> None:
+        self._q: queue.Queue[tuple[str, float, Callable[..., Any], tuple[Any, ...]] | None] = queue.Queue()
+        self._thread: threading.Thread | None = None
+
+    def submit(self, stage: str, fn: Callable[..., Any], *args: Any) -> None:
+        if not bool(_cfg("BACKGROUND_WRITES", True)):
+            t0 = time.perf_counter()
+            fn(*args)
+            HIST.observe(stage, (time.perf_counter() - t0) * 1000)
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="writer", daemon=True)
+            self._thread.start()
+        self._q.put((stage, time.perf_counter(), fn, args))
+
+    def _run(self) -> None:
+        while (item := self._q.get()) is not None:
+            stage, t0, fn, args = item
+            try:
+                fn(*args)
+            except Exception as e:
+                log.warning("background %s failed: %s", stage, e)
+            finally:
+                HIST.observe(stage, (time.perf_counter() - t0) * 1000)
+                self._q.task_done()
+        self._q.task_done()
+
+    def depth(self) -> int:
+        return self._q.qsize()
+
+    def flush(self) -> None:
+        self._q.join()
+
+
+WRITER: Final[BackgroundWriter] = BackgroundWriter()
+
+
+def format_user_payload(observation: str, annotated_b64: str) -> dict[str, Any]:
+    return {
+        "type": "text_and_image",
+        "text": observation,
+        "image_b64": annotated_b64,
+    }
+
+
+class InputSink(abc.ABC):
+    name = "base"
+
+    @abc.abstractmethod
+    def move_to(self, x: int, y: int) -> None: ...
+
+    @abc.abstractmethod
+    def button(self, flags: int) -> None: ...
+
+    def send(self, events: tuple[tuple[int, int, int], ...]) -> None:
+        for x, y, flags in events:
+            self.button(flags) if flags else self.move_to(x, y)
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class Win32InputSink(InputSink):
+    name = "win32"
+
+    def move_to(self, x: int, y: int) -> None:
+        _user32.SetCursorPos(x, y)
+
+    def button(self, flags: int) -> None:
+        _user32.mouse_event(flags, 0, 0, 0, 0)
+
+    def send(self, events: tuple[tuple[int, int, int], ...]) -> None:
+        if not events:
+            return
+        vx, vy = _user32.GetSystemMetrics(SM_XVIRTUALSCREEN), _user32.GetSystemMetrics(SM_XVIRTUALSCREEN + 1)
+        vw = max(1, _user32.GetSystemMetrics(SM_CXVIRTUALSCREEN))
+        vh = max(1, _user32.GetSystemMetrics(SM_CXVIRTUALSCREEN + 1))
+        arr = (_INPUT * len(events))()
+        for inp, (x, y, flags) in zip(arr, events):
+            inp.type = INPUT_MOUSE
+            if flags:
+                inp.mi.dwFlags = flags
+            else:
+                # Absolute coordinates are 0..65535 over the virtual desktop; round up so the pixel maps back exactly.
+                inp.mi.dx = ((x - vx) * 65536 + vw - 1) // vw
+                inp.mi.dy = ((y - vy) * 65536 + vh - 1) // vh
+                inp.mi.dwFlags = MOUSEEVENTF_MOVE | MOUSEEVENTF_ABSOLUTE | MOUSEEVENTF_VIRTUALDESK
+        if (sent := _user32.SendInput(len(events), arr, ctypes.sizeof(_INPUT))) != len(events):
+            log.warning("SendInput inserted %d of %d events (err=%d)", sent, len(events), ctypes.get_last_error())
+
+
+class NullInputSink(InputSink):
+    name = "null"
+
+    def __init__(self) -> None:
+        self.events = 0
+        self.batches = 0
+        self.slept = 0.0
+
+    def move_to(self, x: int, y: int) -> None:
+        self.events += 1
+
+    def button(self, flags: int) -> None:
+        self.events += 1
+
+    def send(self, events: tuple[tuple[int, int, int], ...]) -> None:
+        self.events += len(events)
+        self.batches += bool(events)
+
+    def sleep(self, seconds: float) -> None:
+        self.slept += seconds
+
+
+def make_input_sink() -> InputSink:
+    if (kind := str(_cfg("INPUT_SINK", "auto")).lower()) == "auto":
+        kind = "win32" if SOURCE.name == "gdi" else "null"
+    return NullInputSink() if kind == "null" else Win32InputSink()
+
+
+SINK: InputSink = Win32InputSink()
+
+
+_INPUT_LOCK: Final[threading.Lock] = threading.Lock()
+
+
+@dataclass(slots=True)
+class InputStep:
+    action: int
+    events: tuple[tuple[int, int, int], ...]  # (x, y, button flags); flags 0 is an absolute cursor move
+    wait: float  # seconds to pause after sending the batch
+
+
+_CLICK_FLAGS: Final[dict[str, tuple[int, ...]]] = {
+    "click": (MOUSEEVENTF_LEFTDOWN, MOUSEEVENTF_LEFTUP),
+    "right_click": (MOUSEEVENTF_RIGHTDOWN, MOUSEEVENTF_RIGHTUP),
+    "double_click": (MOUSEEVENTF_LEFTDOWN, MOUSEEVENTF_LEFTUP, MOUSEEVENTF_LEFTDOWN, MOUSEEVENTF_LEFTUP),
+}
+
+
+def input_profile(name: str | None = None) -> dict[str, Any]:
+    name = (name or str(_cfg("INPUT_PROFILE", "normal"))).lower()
+    profiles = _cfg("INPUT_PROFILES", {}) or {}
+    if name not in profiles:
+        log.warning("unknown INPUT_PROFILE=%r, using legacy timings", name)
+    return {
+        "settle": 0.03, "press": 0.03, "double_gap": 0.06,
+        "drag_steps": int(_cfg("DRAG_DURATION_STEPS", 20)), "drag_step": float(_cfg("DRAG_STEP_DELAY", 0.01)),
+        "action_gap": float(_cfg("ACTION_DELAY_SECONDS", 0.05)), "jitter": 0.0, "ease": False, "min_wait": 0.0,
+        **profiles.get(name, {}),
+    }
+
+
+def plan_actions(
+    actions: list[dict[str, Any]], profile: dict[str, Any] | None = None, rng: random.Random | None = None,
+) -> list[InputStep]:
+    """Turns actions into SendInput batches separated by pauses (see Execution planner in the README)."""
+    p = profile or input_profile()
+    rng = rng or random.Random()
+    jitter = float(p["jitter"])
+    min_wait = float(p["min_wait"])
+    steps: list[InputStep] = []
+    pending: list[tuple[int, int, int]] = []
+    cursor: tuple[int, int] | None = None
+    owed = 0.0
+
+    def t(key: str) -> float:
+        v = float(p[key])
+        return max(0.0, v * (1 + rng.uniform(-jitter, jitter))) if jitter else v
+
+    def pause(i: int, wait: float, flush: bool = False) -> None:
+        nonlocal owed
+        owed += wait
+        if owed < min_wait and not flush:
+            return
+        wait, owed = owed, 0.0
+        if pending or not steps or steps[-1].action != i:
+            steps.append(InputStep(i, tuple(pending), wait))
+            pending.clear()
+        else:
+            steps[-1].wait += wait
+
+    def move(i: int, x: int, y: int, wait: float, flush: bool = False) -> None:
+        nonlocal cursor
+        if cursor != (x, y):
+            cursor = (x, y)
+            pending.append((x, y, 0))
+            if wait:
+                pause(i, wait, flush)
+
+    def press(i: int, flags: int, wait: float) -> None:
+        pending.append((0, 0, flags))
+        if wait:
+            pause(i, wait, flush=True)
+
+    for i, a in enumerate(actions):
+        name = a.get("name", "")
+        if name == "move" and i + 1 < len(actions) and actions[i + 1].get("name") == "move":
+            continue
+        x1, y1 = _norm_to_screen_xy(int(a.get("x1", 0)), int(a.get("y1", 0)))
+        x2, y2 = _norm_to_screen_xy(int(a.get("x2", a.get("x1", 0))), int(a.get("y2", a.get("y1", 0))))
+        if name == "move":
+            move(i, x1, y1, 0.0)
+        elif flags := _CLICK_FLAGS.get(name):
+            move(i, x1, y1, t("settle"), flush=True)
+            for k, f in enumerate(flags):
+                press(i, f, 0.0 if k == len(flags) - 1 else t("double_gap") if k == 1 else t("press"))
+        elif name == "drag":
+            move(i, x1, y1, t("settle"), flush=True)
+            press(i, MOUSEEVENTF_LEFTDOWN, t("press"))
+            n = max(1, int(p["drag_steps"]))
+            for k in range(1, n + 1):
+                if p["ease"]:
+                    f = k / n
+                    f = f * f * (3 - 2 * f)
+                    tx, ty = x1 + round((x2 - x1) * f), y1 + round((y2 - y1) * f)
+                else:
+                    tx, ty = x1 + (x2 - x1) * k // n, y1 + (y2 - y1) * k // n
+                move(i, tx, ty, t("drag_step"))
+            pause(i, t("settle"), flush=True)
+            press(i, MOUSEEVENTF_LEFTUP, 0.0)
+        else:
+            log.warning("unknown action name=%r", name)
+            continue
+        pause(i, t("action_gap"), flush=True)
+    return steps
+
+
+def plan_summary(plan: list[InputStep]) -> dict[str, Any]:
+    return {
+        "events": sum(len(s.events) for s in plan),
+        "batches": sum(bool(s.events) for s in plan),
+        "sleeps": sum(s.wait > 0 for s in plan),
+        "sleep_ms": round(sum(s.wait for s in plan) * 1000, 1),
+    }
 
 
 def execute_actions(actions: list[dict[str, Any]]) -> None:
+    log.info("execute actions=%s", " ".join(
+        f"{a.get('name')}({a.get('x1')},{a.get('y1')}" + (f"->{a.get('x2')},{a.get('y2')})" if "x2" in a else ")")
+        for a in actions
+    ))
+    plan = plan_actions(actions)
     if not bool(_cfg("PHYSICAL_EXECUTION", True)):
-        log.info("PHYSICAL_EXECUTION=False, skipping %d actions", len(actions))
+        log.info("PHYSICAL_EXECUTION=False, dry run of %d actions: %s", len(actions), plan_summary(plan))
         return
-    action_delay = float(_cfg("ACTION_DELAY_SECONDS", 0.05))
-    drag_steps = int(_cfg("DRAG_DURATION_STEPS", 20))
-    drag_step_d = float(_cfg("DRAG_STEP_DELAY", 0.01))
-    for a in actions:
-        name = a.get("name", "")
-        nx1, ny1 = int(a.get("x1", 0)), int(a.get("y1", 0))
-        nx2, ny2 = int(a.get("x2", nx1)), int(a.get("y2", ny1))
-        x1, y1 = _norm_to_screen_xy(nx1, ny1)
-        x2, y2 = _norm_to_screen_xy(nx2, ny2)
-        log.info("execute action=%s nx1=%d ny1=%d nx2=%d ny2=%d px1=%d py1=%d px2=%d py2=%d", name, nx1, ny1, nx2, ny2, x1, y1, x2, y2)
-        match name:
-            case "move":
-                _move_to(x1, y1)
-            case "click":
-                _move_to(x1, y1)
-                time.sleep(0.03)
-                _mouse(MOUSEEVENTF_LEFTDOWN)
-                time.sleep(0.03)
-                _mouse(MOUSEEVENTF_LEFTUP)
-            case "right_click":
-                _move_to(x1, y1)
-                time.sleep(0.03)
-                _mouse(MOUSEEVENTF_RIGHTDOWN)
-                time.sleep(0.03)
-                _mouse(MOUSEEVENTF_RIGHTUP)
-            case "double_click":
-                _move_to(x1, y1)
-                time.sleep(0.03)
-                _mouse(MOUSEEVENTF_LEFTDOWN)
-                time.sleep(0.03)
-                _mouse(MOUSEEVENTF_LEFTUP)
-                time.sleep(0.06)
-                _mouse(MOUSEEVENTF_LEFTDOWN)
-                time.sleep(0.03)
-                _mouse(MOUSEEVENTF_LEFTUP)
-            case "drag":
-                _move_to(x1, y1)
-                time.sleep(0.03)
-                _mouse(MOUSEEVENTF_LEFTDOWN)
-                time.sleep(0.03)
-                for i in range(1, max(1, drag_steps) + 1):
-                    tx = x1 + (x2 - x1) * i // drag_steps
-                    ty = y1 + (y2 - y1) * i // drag_steps
-                    _move_to(tx, ty)
-                    time.sleep(drag_step_d)
-                time.sleep(0.03)
-                _mouse(MOUSEEVENTF_LEFTUP)
-            case _:
-                log.warning("unknown action name=%r", name)
-        time.sleep(action_delay)
+    log.info("input plan profile=%s %s", _cfg("INPUT_PROFILE", "normal"), plan_summary(plan))
+    for _, group in itertools.groupby(plan, key=operator.attrgetter("action")):
+        *body, last = group
+        with _INPUT_LOCK:
+            for step in body:
+                SINK.send(step.events)
+                SINK.sleep(step.wait)
+            SINK.send(last.events)
+        SINK.sleep(last.wait)
+
+
+VlmCall = Callable[[str, bytes], tuple[str, dict[str, Any], str | None, dict[str, Any]]]
+
+
+class VlmClient:
+    """Keep-alive HTTP client for API_URL; safe to call from executor threads."""
+
+    def __init__(self) -> None:
+        self._idle: list[tuple[tuple[str, str, int], http.client.HTTPConnection]] = []
+        self._lock = threading.Lock()
+        self.gzip_ok: bool | None = None
+
+    def _acquire(self, key: tuple[str, str, int], timeout: float | None) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            for i, (k, conn) in enumerate(self._idle):
+                if k == key:
+                    del self._idle[i]
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    return conn, True
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return cls(host, port, timeout=timeout), False
+
+    def _release(self, key: tuple[str, str, int], conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if bool(_cfg("VLM_KEEPALIVE", True)) and len(self._idle) < max(int(_cfg("VLM_POOL_SIZE", 2)), len(SESSIONS)):
+                self._idle.append((key, conn))
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for _, conn in self._idle:
+                conn.close()
+            self._idle.clear()
+
+    def post(
+        self, url: str, body: bytes, timeout: float | None, on_line: Callable[[bytes], None] | None = None,
+    ) -> tuple[int, bytes, dict[str, Any]]:
+        u = urllib.parse.urlparse(url)
+        scheme = u.scheme or "http"
+        key = (scheme, u.hostname or "127.0.0.1", u.port or (443 if scheme == "https" else 80))
+        path = u.path or "/v1/chat/completions"
+        keepalive = bool(_cfg("VLM_KEEPALIVE", True))
+        use_gzip = bool(_cfg("VLM_GZIP_REQUESTS", False)) and self.gzip_ok is not False
+        stale_retry = True
+        while True:
+            headers = {
+                "Content-Type": "application/json",
+                "Accept": "application/json",
+                "Accept-Encoding": "identity" if on_line else "gzip, deflate",
+                "Connection": "keep-alive" if keepalive else "close",
+            }
+            payload = body
+            if use_gzip:
+                payload = gzip.compress(body, compresslevel=int(_cfg("VLM_GZIP_LEVEL", 6)))
+                headers["Content-Encoding"] = "gzip"
+            conn, reused = self._acquire(key, timeout)
+            t0 = time.perf_counter()
+            answered = False
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                t1 = time.perf_counter()
+                conn.request("POST", path, body=payload, headers=headers)
+                t2 = time.perf_counter()
+                resp = conn.getresponse()
+                answered = True
+                t3 = time.perf_counter()
+                if on_line is None or not 200 <= resp.status < 300:
+                    data = resp.read()
+                else:
+                    lines = []
+                    while line := resp.readline():
+                        lines.append(line)
+                        on_line(line)
+                    data = b"".join(lines)
+            except (ConnectionError, http.client.HTTPException) as e:
+                conn.close()
+                # Only a request the server never answered is resent; streamed lines may already have run actions.
+                if reused and stale_retry and not answered:
+                    stale_retry = False
+                    log.info("vlm: stale keep-alive connection (%s), reconnecting", e)
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            t4 = time.perf_counter()
+            if resp.will_close or not keepalive:
+                conn.close()
+            else:
+                self._release(key, conn)
+            match (resp.getheader("Content-Encoding") or "").lower():
+                case "gzip":
+                    data = gzip.decompress(data)
+                case "deflate":
+                    data = zlib.decompress(data)
+            if use_gzip and self.gzip_ok is None:
+                if resp.status in (400, 411, 415):
+                    log.warning("vlm: server rejected gzip request body (HTTP %d), sending uncompressed", resp.status)
+                    self.gzip_ok, use_gzip = False, False
+                    continue
+                self.gzip_ok = 200 <= resp.status < 300 or None
+            return resp.status, data, {
+                "connect_ms": round((t1 - t0) * 1000, 2),
+                "send_ms": round((t2 - t1) * 1000, 2),
+                "ttfb_ms": round((t3 - t2) * 1000, 2),
+                "total_ms": round((t4 - t0) * 1000, 2),
+                "reused": reused,
+                "gzip": use_gzip,
+                "request_bytes": len(payload),
+                "response_bytes": len(data),
+            }
+
+
+VLM_CLIENT: Final[VlmClient] = VlmClient()
+
 
+class ResponseCache:
+    """Content-addressed VLM responses (sha256 of URL + request body): LRU bound, TTL, append-only JSONL on disk."""
 
-def call_vlm(observation: str, annotated_b64: str) -> tuple[str, dict[str, Any], str | None]:
+    def __init__(self) -> None:
+        self._entries: collections.OrderedDict[str, dict[str, Any]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._path: Path | None = None
+        self._appended = 0
+        self.hits = self.misses = self.expired = 0
+
+    @staticmethod
+    def enabled() -> bool:
+        return int(_cfg("VLM_CACHE_SIZE", 256) or 0) > 0 and float(_cfg("TEMPERATURE", 0.7)) == 0.0
+
+    @staticmethod
+    def key(url: str, body: bytes) -> str:
+        return hashlib.sha256(url.encode("utf-8") + b"\0" + body).hexdigest()
+
+    def _live(self, e: dict[str, Any], now: float) -> bool:
+        ttl = float(_cfg("VLM_CACHE_TTL_SECONDS", 600) or 0)
+        return ttl <= 0 or now - float(e.get("t", 0)) <= ttl
+
+    def _trim(self) -> None:
+        while len(self._entries) > max(1, int(_cfg("VLM_CACHE_SIZE", 256) or 1)):
+            self._entries.popitem(last=False)
+
+    def _rewrite(self) -> None:
+        if self._path is None:
+            return
+        tmp = self._path.with_suffix(".tmp")
+        tmp.write_text("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in self._entries.values()), encoding="utf-8")
+        os.replace(tmp, self._path)
+        self._appended = 0
+
+    def load(self, path: Path) -> None:
+        """Adopt path as the backing file, keeping its live entries (a torn last line from a crash is skipped)."""
+        with self._lock:
+            self._path = path
+            try:
+                lines = path.read_text(encoding="utf-8").splitlines() if path.exists() else []
+            except OSError as e:
+                log.warning("vlm cache read failed: %s", e)
+                lines = []
+            now = time.time()
+            for line in lines:
+                try:
+                    e = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(e, dict) and isinstance(e.get("key"), str) and self._live(e, now):
+                    self._entries.pop(e["key"], None)
+                    self._entries[e["key"]] = e
+            self._trim()
+            try:
+                self._rewrite()
+            except OSError as e:
+                log.warning("vlm cache rewrite failed: %s", e)
+            log.info("vlm cache path=%s entries=%d", path, len(self._entries))
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            if (e := self._entries.get(key)) is not None and not self._live(e, time.time()):
+                del self._entries[key]
+                self.expired += 1
+                e = None
+            if e is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return e
+
+    def put(self, key: str, text: str, usage: dict[str, Any]) -> None:
+        e = {"key": key, "t": round(time.time(), 3), "text": text, "usage": usage}
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = e
+            self._trim()
+            if self._path is None:
+                return
+            try:
+                if self._appended >= 4 * max(1, int(_cfg("VLM_CACHE_SIZE", 256) or 1)):
+                    self._rewrite()
+                else:
+                    with self._path.open("a", encoding="utf-8") as f:
+                        f.write(json.dumps(e, ensure_ascii=False) + "\n")
+                    self._appended += 1
+            except OSError as err:
+                log.warning("vlm cache write failed: %s", err)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled(), "entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "expired": self.expired, "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+VLM_CACHE: Final[ResponseCache] = ResponseCache()
+
+
+def _sse_json(line: bytes) -> dict[str, Any] | None:
+    if not line.startswith(b"data:"):
+        return None
+    data = line[5:].strip()
+    if not data or data == b"[DONE]":
+        return None
+    try:
+        obj = json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def call_vlm(
+    observation: str, annotated_png: bytes, on_action: Callable[[dict[str, Any]], None] | None = None,
+    zooms: list[tuple[bytes, dict[str, Any]]] | None = None, annotated_b64: str | None = None,
+) -> tuple[str, dict[str, Any], str | None, dict[str, Any]]:
     url = str(_cfg("API_URL", ""))
-    u = urllib.parse.urlparse(url)
-    host, port = u.hostname or "127.0.0.1", u.port or 80
-    path = u.path or "/v1/chat/completions"
     t = float(_cfg("VLM_HTTP_TIMEOUT_SECONDS", 0) or 0)
     timeout = None if t <= 0 else t
     system_prompt = str(_cfg("SYSTEM_PROMPT", ""))
+    annotated_b64 = annotated_b64 or base64.b64encode(annotated_png).decode("ascii")
+    content: list[dict[str, Any]] = [
+        {"type": "text", "text": observation},
+        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{annotated_b64}"}},
+    ]
+    img_len = len(annotated_b64)
+    for i, (png, info) in enumerate(zooms or (), 1):
+        b64 = base64.b64encode(png).decode("ascii")
+        img_len += len(b64)
+        content.append({"type": "text", "text": (
+            f"Zoom {i}: region ({info['x1']},{info['y1']})-({info['x2']},{info['y2']}) of the screenshot at "
+            f"{info['width']}x{info['height']}. Coordinates in your answer stay relative to the full screenshot."
+        )})
+        content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{b64}"}})
     payload = {
         "model": str(_cfg("MODEL", "")),
         "temperature": float(_cfg("TEMPERATURE", 0.7)),
@@ -563,116 +2760,425 @@ def call_vlm(observation: str, annotated_b64: str) -> tuple[str, dict[str, Any],
         "max_tokens": int(_cfg("MAX_TOKENS", 1000)),
         "messages": [
             {"role": "system", "content": system_prompt},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": observation},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{annotated_b64}"}},
-                ],
-            },
+            {"role": "user", "content": content},
         ],
     }
+    stream = bool(_cfg("VLM_STREAM", False))
+    if stream:
+        payload["stream"] = True
     body = json.dumps(payload).encode("utf-8")
-    log.info("vlm POST %s:%d%s story_len=%d img_len=%d", host, port, path, len(observation), len(annotated_b64))
+    key = ResponseCache.key(url, body) if ResponseCache.enabled() else ""
+    if key and (hit := VLM_CACHE.get(key)) is not None:
+        age = round(time.time() - float(hit["t"]), 1)
+        log.info("vlm cache hit key=%s age_s=%.1f (no request sent)", key[:16], age)
+        return str(hit["text"]), dict(hit.get("usage") or {}), None, {"cache": "hit", "cache_key": key[:16], "cache_age_s": age}
+    log.info(
+        "vlm POST %s story_len=%d img_len=%d zooms=%d stream=%s", url, len(observation), img_len, len(zooms or ()), stream,
+    )
+    parts: list[str] = []
+    usage: dict[str, Any] = {}
+    stream_stats: dict[str, Any] = {}
+    parser = ActionStreamParser()
+    t0 = time.perf_counter()
+
+    def on_line(line: bytes) -> None:
+        if (obj := _sse_json(line)) is None:
+            return
+        usage.update(obj.get("usage") or {})
+        for choice in obj.get("choices") or []:
+            if not (delta := (choice.get("delta") or {}).get("content") or ""):
+                continue
+            stream_stats.setdefault("first_token_ms", round((time.perf_counter() - t0) * 1000, 2))
+            parts.append(delta)
+            for a in parser.feed(delta):
+                stream_stats.setdefault("first_action_ms", round((time.perf_counter() - t0) * 1000, 2))
+                stream_stats["actions_streamed"] = stream_stats.get("actions_streamed", 0) + 1
+                if on_action is not None:
+                    on_action(a)
+
     try:
-        conn = http.client.HTTPConnection(host, port, timeout=timeout)
-        conn.request("POST", path, body=body, headers={
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "Connection": "close",
-        })
-        resp = conn.getresponse()
-        data = resp.read()
-        conn.close()
-        if resp.status < 200 or resp.status >= 300:
-            return "", {}, f"HTTP {resp.status}"
-        obj = json.loads(data.decode("utf-8", "replace"))
-        text = cast(str, obj["choices"][0]["message"]["content"])
-        usage = cast(dict[str, Any], obj.get("usage", {}) or {})
-        return text, usage, None
+        status, data, http_stats = VLM_CLIENT.post(url, body, timeout, on_line if stream else None)
+        http_stats.update(stream_stats)
+        if status < 200 or status >= 300:
+            http_stats["retryable"] = status >= 500 or status == 429
+            return "", {}, f"HTTP {status}", http_stats
+        if parts:
+            text = "".join(parts)
+        else:
+            obj = json.loads(data.decode("utf-8", "replace"))
+            text = cast(str, obj["choices"][0]["message"]["content"])
+            usage = cast(dict[str, Any], obj.get("usage", {}) or {})
+        if key:
+            VLM_CACHE.put(key, text, usage)
+            http_stats.update(cache="miss", cache_key=key[:16])
+        return text, usage, None, http_stats
     except Exception as e:
         log.error("vlm error: %s", e)
-        return "", {}, str(e)
+        return "", {}, str(e) or type(e).__name__, {"retryable": isinstance(e, (OSError, http.client.HTTPException))}
+
+
+class EarlyDispatch:
+    """Runs actions handed over by a streaming call_vlm while the rest of the response is still arriving."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue[dict[str, Any] | None] = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, action: dict[str, Any]) -> None:
+        self.count += 1
+        log.info("early dispatch action #%d name=%s", self.count, action.get("name"))
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, action)
+
+    async def _run(self) -> None:
+        while (a := await self._queue.get()) is not None:
+            await _in_executor(None, execute_actions, [a])
+
+    async def drain(self) -> int:
+        self._queue.put_nowait(None)
+        await self._task
+        return self.count
+
+
+_ENCODE_POOL: Final[concurrent.futures.ThreadPoolExecutor] = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="encode",
+)
+
+
+def _in_executor(executor: concurrent.futures.Executor | None, fn: Callable[..., Any], *args: Any) -> asyncio.Future[Any]:
+    """run_in_executor that carries the caller's context (current session) into the worker thread."""
+    return asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, fn, *args)
+
+
+async def _timed(
+    timings: dict[str, float], key: str, fn: Callable[..., Any], *args: Any,
+    executor: concurrent.futures.Executor | None = None,
+) -> Any:
+    t0 = time.perf_counter()
+    try:
+        return await _in_executor(executor, fn, *args)
+    finally:
+        timings[key] = round((time.perf_counter() - t0) * 1000, 2)
+
+
+class VlmDispatcher:
+    """Asyncio front door for VLM calls: bounded in-flight requests, a priority queue and batched release."""
+
+    def __init__(self, sessions: int) -> None:
+        self.limit = max(1, int(_cfg("VLM_MAX_IN_FLIGHT", 4) or 1))
+        self.target = max(1, min(sessions, self.limit, int(_cfg("VLM_BATCH_MAX", 8) or 8)))
+        self.window = max(0.0, float(_cfg("VLM_BATCH_WINDOW_MS", 50) or 0) / 1000) if sessions > 1 else 0.0
+        self.in_flight = 0
+        self.calls = 0
+        self.batches = 0
+        self.largest = 0
+        self.retries = 0
+        self.failures = 0
+        self._heap: list[tuple[int, int, float, asyncio.Future[int]]] = []
+        self._order = itertools.count()
+        self._wake = asyncio.Event()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.limit, thread_name_prefix="vlm")
+        self._task = asyncio.create_task(self._run())
+
+    def depth(self) -> int:
+        return sum(not g.done() for *_, g in self._heap)
+
+    async def call(self, fn: Callable[..., Any], *args: Any, priority: int = 0) -> tuple[Any, float, int]:
+        """Queue fn(*args); returns (result, ms spent queued, size of the batch it was released with)."""
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        gate: asyncio.Future[int] = loop.create_future()
+        heapq.heappush(self._heap, (priority, next(self._order), t0, gate))
+        self._wake.set()
+        try:
+            size = await gate
+        except asyncio.CancelledError:
+            if gate.done() and not gate.cancelled():
+                self._finished()
+            raise
+        wait_ms = round((loop.time() - t0) * 1000, 2)
+        try:
+            return await _in_executor(self._pool, fn, *args), wait_ms, size
+        finally:
+            self._finished()
+
+    def _finished(self) -> None:
+        self.in_flight -= 1
+        self._wake.set()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            if not self._heap or self.in_flight >= self.limit:
+                continue
+            if self.window:
+                deadline = min(t for _, _, t, _ in self._heap) + self.window
+                while self.depth() < self.target and (left := deadline - loop.time()) > 0:
+                    self._wake.clear()
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), timeout=left)
+                    except asyncio.TimeoutError:
+                        break
+            batch: list[asyncio.Future[int]] = []
+            while self._heap and self.in_flight < self.limit:
+                gate = heapq.heappop(self._heap)[3]
+                if not gate.done():
+                    self.in_flight += 1
+                    batch.append(gate)
+            if self._heap and self.in_flight < self.limit:
+                self._wake.set()
+            if not batch:
+                continue
+            self.batches += 1
+            self.calls += len(batch)
+            self.largest = max(self.largest, len(batch))
+            log.info("vlm dispatch #%d size=%d in_flight=%d queued=%d", self.batches, len(batch), self.in_flight, self.depth())
+            for gate in batch:
+                gate.set_result(len(batch))
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "queued": self.depth(), "in_flight": self.in_flight, "limit": self.limit,
+            "calls": self.calls, "batches": self.batches, "largest": self.largest,
+            "mean_batch": round(self.calls / self.batches, 2) if self.batches else 0.0,
+            "batch_target": self.target, "window_ms": round(self.window * 1000, 1),
+            "retries": self.retries, "failures": self.failures,
+        }
+
+    async def close(self) -> None:
+        self._task.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
 
+DISPATCHER: VlmDispatcher | None = None
 
-async def engine_loop(run_dir: Path) -> None:
-    S.run_dir = run_dir
+
+async def _call_vlm_retrying(
+    sess: Session, call: VlmCall, observation: str, png: bytes, timings: dict[str, float],
+    retry_ok: Callable[[], bool],
+) -> tuple[str, dict[str, Any], str | None, dict[str, Any]]:
+    """One VLM turn through the dispatcher, retrying 5xx/429/transport errors with jittered exponential backoff."""
+    retries = max(0, int(_cfg("VLM_RETRY_MAX", 4)))
+    base = float(_cfg("VLM_RETRY_BASE_SECONDS", 0.5))
+    cap = float(_cfg("VLM_RETRY_MAX_SECONDS", 8.0))
+    priority = int(_cfg("VLM_PRIORITY", 0))
+    t0 = time.perf_counter()
+    waited = 0.0
+    attempt = 0
+    while True:
+        if DISPATCHER is not None:
+            (text, usage, err, http_stats), wait_ms, batch = await DISPATCHER.call(call, observation, png, priority=priority)
+            waited += wait_ms
+            http_stats["batch_size"] = batch
+        else:
+            text, usage, err, http_stats = await _in_executor(None, call, observation, png)
+        attempt += 1
+        sess.state.vlm_attempts = attempt
+        if not err or not http_stats.get("retryable") or attempt > retries or STOP.is_set() or not retry_ok():
+            break
+        delay = min(cap, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+        log.warning("vlm attempt %d/%d failed: %s; retrying in %.2fs", attempt, retries + 1, err, delay)
+        if DISPATCHER is not None:
+            DISPATCHER.retries += 1
+        sess.set_phase("vlm_retry", err)
+        await asyncio.sleep(delay)
+        sess.set_phase("calling_vlm")
+    if err and DISPATCHER is not None:
+        DISPATCHER.failures += 1
+    http_stats["attempts"] = attempt
+    timings["vlm"] = round((time.perf_counter() - t0) * 1000, 2)
+    if DISPATCHER is not None:
+        timings["vlm_wait"] = round(waited, 2)
+    return text, usage, err, http_stats
+
+
+async def engine_loop(sess: Session, vlm: VlmCall = call_vlm, max_turns: int = 0) -> None:
+    _SESSION.set(sess)
+    st, run_dir = sess.state, sess.run_dir
     boot_enabled = bool(_cfg("BOOT_ENABLED", True))
     boot_text = str(_cfg("BOOT_VLM_OUTPUT", ""))
-    set_phase("boot" if boot_enabled else "running")
+    sess.set_phase("boot" if boot_enabled else "running")
     if boot_enabled and boot_text.strip():
         log.info("engine: injecting boot VLM text len=%d", len(boot_text))
-        S.next_vlm_json = boot_text
-        S.next_event.set()
+        st.next_vlm_json = boot_text
+        st.next_event.set()
     else:
         log.info("engine: waiting for first /inject")
-        set_phase("waiting_inject")
+        sess.set_phase("waiting_inject")
     while not STOP.is_set():
         try:
-            await asyncio.wait_for(S.next_event.wait(), timeout=0.5)
+            await asyncio.wait_for(st.next_event.wait(), timeout=0.5)
         except asyncio.TimeoutError:
             continue
-        async with S.lock:
-            vlm_raw = S.next_vlm_json or ""
-            S.next_vlm_json = None
-            S.next_event.clear()
+        async with st.lock:
+            vlm_raw = st.next_vlm_json or ""
+            st.next_vlm_json = None
+            st.next_event.clear()
         if not vlm_raw.strip():
             continue
-        S.turn += 1
-        turn = S.turn
+        st.turn += 1
+        turn = st.turn
+        timings: dict[str, float] = {}
+        t_turn = time.perf_counter()
         log.info("engine: === TURN %d ===", turn)
-        set_phase("running")
-        observation, bboxes, actions = parse_vlm_json(vlm_raw)
-        async with S.lock:
-            S.vlm_json = vlm_raw
-            S.observation = observation
-            S.actions_text = json.dumps(actions)
-            S.bboxes = bboxes
-            S.actions = actions
-            S.msg_id += 1
-        set_phase("executing")
-        await asyncio.get_event_loop().run_in_executor(None, execute_actions, actions)
-        set_phase("capturing")
-        raw_b64, w, h = await asyncio.get_event_loop().run_in_executor(None, capture_screenshot)
-        if not raw_b64:
-            set_phase("error", "capture failed")
+        sess.set_phase("running")
+        observation, bboxes, actions, repairs = parse_vlm_json(vlm_raw)
+        async with st.lock:
+            skip, st.next_dispatched = st.next_dispatched, 0
+            box, st.next_box = st.next_box, None
+        if box:
+            bboxes, actions = _unletterbox(bboxes, box), _unletterbox(actions, box)
+        async with st.lock:
+            st.vlm_json = vlm_raw
+            st.observation = observation
+            st.actions_text = json.dumps(actions)
+            st.bboxes = bboxes
+            st.actions = actions
+            st.repairs = repairs
+            st.msg_id += 1
+        sess.hub.publish("vlm")
+        sess.set_phase("executing")
+        if skip:
+            log.info("engine: %d of %d actions already dispatched early", min(skip, len(actions)), len(actions))
+        await _timed(timings, "execute", execute_actions, actions[skip:])
+        sess.set_phase("capturing")
+        rois = bboxes if bool(_cfg("ROI_ZOOM_ENABLED", False)) else None
+        raw_png, frame, diff, zooms = await _timed(timings, "capture", capture_screenshot, rois, executor=_ENCODE_POOL)
+        if not raw_png or frame is None:
+            sess.set_phase("error", "capture failed")
             continue
-        S.raw_b64 = raw_b64
-        await asyncio.get_event_loop().run_in_executor(
-            None, save_turn_data, run_dir, turn, observation, bboxes, actions, raw_b64,
-        )
-        async with S.lock:
-            S.pending_seq = turn
-            S.annotated_seq = -1
-            S.annotated_b64 = ""
-            S.annotated_event.clear()
-        set_phase("waiting_annotated")
-        log.info("engine: waiting for browser annotated seq=%d", turn)
-        while not STOP.is_set():
-            try:
-                await asyncio.wait_for(S.annotated_event.wait(), timeout=0.5)
+        state: dict[str, Any] = {}
+        if bool(_cfg("STATE_HASH_ENABLED", True)):
+            if diff and not diff["changed"] and st.state_hash:
+                h = int(st.state_hash, 16)
+            else:
+                h = await _timed(timings, "dhash", dhash, frame, executor=_ENCODE_POOL)
+            state = {"dhash": f"{h:016x}", "similar": sess.states.add(turn, h)}
+            if sim := state["similar"]:
+                log.info("state dhash=%s similar to turn %d at distance %d (repeats=%d)",
+                         state["dhash"], sim["turn"], sim["distance"], sim["repeats"])
+            WRITER.submit("save_state", _append_jsonl, run_dir / "state_index.jsonl", {"turn": turn, **state})
+        async with st.lock:
+            st.raw_png = raw_png
+            st.frame_seq = turn
+            st.frame_etag = f'"{turn}-{zlib.crc32(raw_png):08x}"'
+            st.diff = diff
+            st.state_hash, st.similar = state.get("dhash", ""), state.get("similar")
+        sess.hub.publish("frame")
+        WRITER.submit("save_raw", save_turn_data, run_dir, turn, observation, bboxes, actions, raw_png, diff,
+                      {"repairs": repairs, "vlm_raw": vlm_raw} if repairs else {})
+        if zooms:
+            WRITER.submit("save_rois", save_rois, run_dir, turn, zooms)
+        async with st.lock:
+            st.pending_seq = turn
+            st.annotated_seq = -1
+            st.annotated_png = b""
+            st.annotated_event.clear()
+        t0 = time.perf_counter()
+        mode = str(_cfg("ANNOTATION_MODE", "browser")).lower()
+        annotated_frame: Frame | None = None
+        if mode == "passthrough":
+            annotated_png, annotated_frame = raw_png, frame
+        elif mode == "python":
+            sess.set_phase("annotating")
+            annotated_png, annotated_frame = await _in_executor(
+                _ENCODE_POOL, render_annotated, frame, turn, bboxes, actions,
+            )
+        else:
+            sess.set_phase("waiting_annotated")
+            log.info("engine: waiting for browser annotated seq=%d", turn)
+            while not STOP.is_set():
+                try:
+                    await asyncio.wait_for(st.annotated_event.wait(), timeout=0.5)
+                    break
+                except asyncio.TimeoutError:
+                    continue
+            if STOP.is_set():
                 break
-            except asyncio.TimeoutError:
-                continue
-        if STOP.is_set():
-            break
-        async with S.lock:
-            annotated_b64 = S.annotated_b64
-        await asyncio.get_event_loop().run_in_executor(None, save_annotated, run_dir, turn, annotated_b64)
-        set_phase("calling_vlm")
-        new_vlm_text, usage, err = await asyncio.get_event_loop().run_in_executor(
-            None, call_vlm, observation, annotated_b64,
+            async with st.lock:
+                annotated_png = st.annotated_png
+        timings["annotate"] = round((time.perf_counter() - t0) * 1000, 2)
+        WRITER.submit("save_annotated", save_annotated, run_dir, turn, annotated_png)
+        vlm_png, image, vlm_b64 = await _timed(
+            timings, "vlm_image", vlm_image_b64, annotated_png, annotated_frame, executor=_ENCODE_POOL,
         )
+        sess.set_phase("calling_vlm")
+        early = EarlyDispatch() if bool(_cfg("VLM_STREAM", False)) and bool(_cfg("VLM_EARLY_ACTIONS", False)) else None
+        call: VlmCall = functools.partial(vlm, zooms=zooms, annotated_b64=vlm_b64)
+        if early:
+            submit = (lambda a: early.submit(_unletterbox([a], image["box"])[0])) if image["box"] else early.submit
+            call = functools.partial(call, on_action=submit)
+        new_vlm_text, usage, err, http_stats = await _call_vlm_retrying(
+            sess, call, observation, vlm_png, timings, lambda: early is None or early.count == 0,
+        )
+        if early:
+            t0 = time.perf_counter()
+            http_stats["early_actions"] = await early.drain()
+            timings["early_wait"] = round((time.perf_counter() - t0) * 1000, 2)
+        timings["turn"] = round((time.perf_counter() - t_turn) * 1000, 2)
+        for k, v in timings.items():
+            HIST.observe(k, v)
+        HIST.observe("vlm@cache" if http_stats.get("cache") == "hit" else f"vlm@{image['policy']}", timings["vlm"])
+        WRITER.submit(
+            "save_metrics", save_turn_metrics, run_dir, turn,
+            {"error": err, "usage": usage, "http": http_stats, "image": image, "rois": [z[1] for z in zooms],
+             "state": state, "timings_ms": timings},
+        )
+        if str(_cfg("LOG_DURABILITY", "periodic")).lower() == "turn":
+            WRITER.submit("log_sync", LOGW.sync)
+        if max_turns and turn >= max_turns:
+            STOP.set()
         if err:
-            log.error("vlm error turn=%d: %s", turn, err)
-            S.error = err
-            set_phase("vlm_error")
+            cooldown = max(0.0, float(_cfg("VLM_ERROR_COOLDOWN_SECONDS", 10.0)))
+            st.vlm_failures += 1
+            st.vlm_resume_at = time.time() + cooldown
+            log.error("vlm error turn=%d: %s; re-arming in %.1fs (consecutive failures=%d)",
+                      turn, err, cooldown, st.vlm_failures)
+            sess.set_phase("vlm_error", err)
+            deadline = time.perf_counter() + cooldown
+            while not STOP.is_set() and not st.next_event.is_set() and (left := deadline - time.perf_counter()) > 0:
+                try:
+                    await asyncio.wait_for(st.next_event.wait(), timeout=min(0.5, left))
+                except asyncio.TimeoutError:
+                    pass
+            async with st.lock:
+                st.vlm_resume_at = 0.0
+                if not st.next_event.is_set():
+                    # No /inject during the cooldown: run a no-action turn so the request is re-sent with a fresh frame.
+                    st.next_vlm_json = json.dumps({"observation": observation, "bboxes": [], "actions": []})
+                    st.next_dispatched = 0
+                    st.next_box = None
+                    st.next_event.set()
             continue
-        log.info("vlm ok turn=%d response_len=%d usage=%s", turn, len(new_vlm_text), usage)
-        async with S.lock:
-            S.next_vlm_json = new_vlm_text
-            S.next_event.set()
-        set_phase("running")
+        st.vlm_failures = 0
+        log.info("vlm ok turn=%d response_len=%d usage=%s timings_ms=%s", turn, len(new_vlm_text), usage, timings)
+        async with st.lock:
+            st.next_vlm_json = new_vlm_text
+            st.next_dispatched = http_stats.get("early_actions", 0)
+            st.next_box = image["box"]
+            st.next_event.set()
+        sess.set_phase("running")
+
+
+def metrics_lines() -> list[str]:
+    """Prometheus text exposition of the stage histograms, VLM dispatcher and sessions."""
+    out = HIST.prometheus("franz_stage_ms")
+    gauges = {"franz_write_queue_depth": WRITER.depth()}
+    if DISPATCHER is not None:
+        st = DISPATCHER.stats()
+        gauges |= {"franz_vlm_queue_depth": st["queued"], "franz_vlm_in_flight": st["in_flight"],
+                   "franz_vlm_in_flight_limit": st["limit"]}
+    for k, v in gauges.items():
+        out += [f"# TYPE {k} gauge", f"{k} {v}"]
+    if DISPATCHER is not None:
+        for k in ("calls", "batches", "retries", "failures"):
+            out += [f"# TYPE franz_vlm_{k}_total counter", f"franz_vlm_{k}_total {getattr(DISPATCHER, k)}"]
+    out.append("# TYPE franz_session_turn gauge")
+    out += [f'franz_session_turn{{session="{s.name}",phase="{s.state.phase}"}} {s.state.turn}' for s in SESSIONS.values()]
+    return out
 
 
 class AsyncHTTPServer:
@@ -716,7 +3222,7 @@ class AsyncHTTPServer:
         if len(parts) < 2:
             return
         method, full_path = parts[0], parts[1]
-        path = full_path.split("?", 1)[0]
+        path, _, qs = full_path.partition("?")
         headers: dict[str, str] = {}
         while True:
             hl = await asyncio.wait_for(reader.readline(), timeout=10)
@@ -729,67 +3235,106 @@ class AsyncHTTPServer:
         body = b""
         if cl := int(headers.get("content-length", "0")):
             body = await asyncio.wait_for(reader.readexactly(cl), timeout=60)
+        sess = next(iter(SESSIONS.values()))
+        if path.startswith("/s/"):
+            name, slash, rest = path[3:].partition("/")
+            if name not in SESSIONS:
+                await self._send_error(writer, 404)
+                return
+            if not slash:
+                await self._send_raw(writer, 301, "text/plain", b"", {"Location": f"/s/{name}/"})
+                return
+            sess, path = SESSIONS[name], "/" + rest
+        _SESSION.set(sess)
         match method:
             case "GET":
-                await self._do_get(path, writer)
+                await self._do_get(sess, path, headers, writer)
             case "POST":
-                await self._do_post(path, body, writer)
+                await self._do_post(sess, path, dict(urllib.parse.parse_qsl(qs)), headers, body, writer)
             case "OPTIONS":
                 await self._send_json(writer, {}, 200)
             case _:
                 await self._send_error(writer, 405)
 
-    async def _do_get(self, path: str, writer: asyncio.StreamWriter) -> None:
+    async def _do_get(self, sess: Session, path: str, headers: dict[str, str], writer: asyncio.StreamWriter) -> None:
+        st = sess.state
         match path:
             case "/" | "/index.html":
                 data = PANEL_HTML.read_bytes()
                 await self._send_raw(writer, 200, "text/html; charset=utf-8", data)
             case "/config":
                 await self._send_json(writer, {
+                    "session": sess.name,
                     "ui": _cfg("UI_CONFIG", {}),
+                    "annotation_mode": str(_cfg("ANNOTATION_MODE", "browser")).lower(),
+                    "stamp_cache_size": int(_cfg("STAMP_CACHE_SIZE", 64)),
                     "capture_width": int(_cfg("CAPTURE_WIDTH", 512)),
                     "capture_height": int(_cfg("CAPTURE_HEIGHT", 288)),
                 })
             case "/state":
-                async with S.lock:
-                    await self._send_json(writer, {
-                        "phase": S.phase,
-                        "error": S.error,
-                        "turn": S.turn,
-                        "msg_id": S.msg_id,
-                        "pending_seq": S.pending_seq,
-                        "annotated_seq": S.annotated_seq,
-                        "raw_b64": S.raw_b64,
-                        "bboxes": S.bboxes,
-                        "actions": S.actions,
-                        "observation": S.observation,
-                        "vlm_json": S.vlm_json,
-                    })
+                async with st.lock:
+                    state = sess.snapshot()
+                await self._send_json(writer, state)
+            case "/sessions":
+                await self._send_json(writer, [
+                    {"name": s.name, "url": f"/s/{s.name}/", "run_dir": str(s.run_dir), "phase": s.state.phase,
+                     "turn": s.state.turn, "overrides": sorted(s.overrides)}
+                    for s in SESSIONS.values()
+                ])
+            case "/events":
+                await self._stream_events(sess, writer)
+            case "/stats":
+                await self._send_json(writer, {
+                    "stages": HIST.snapshot(), "write_queue": WRITER.depth(), "stamp_cache": STAMPS.stats(),
+                    "vlm_dispatch": DISPATCHER.stats() if DISPATCHER else None, "vlm_cache": VLM_CACHE.stats(),
+                    "frame_store": BLOBS.stats(),
+                    "log_writer": LOGW.stats(),
+                })
+            case "/metrics":
+                await self._send_raw(writer, 200, "text/plain; version=0.0.4", "\n".join(metrics_lines()).encode() + b"\n")
+            case p if p.startswith("/frame/"):
+                async with st.lock:
+                    seq, etag, png = st.frame_seq, st.frame_etag, st.raw_png
+                if not png or p.removeprefix("/frame/") != str(seq):
+                    await self._send_error(writer, 404)
+                elif headers.get("if-none-match") == etag:
+                    await self._send_raw(writer, 304, "image/png", b"", {"ETag": etag})
+                else:
+                    await self._send_raw(writer, 200, "image/png", png, {"ETag": etag})
             case _:
                 await self._send_error(writer, 404)
 
-    async def _do_post(self, path: str, body: bytes, writer: asyncio.StreamWriter) -> None:
+    async def _do_post(
+        self, sess: Session, path: str, query: dict[str, str], headers: dict[str, str], body: bytes,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        st = sess.state
         match path:
             case "/annotated":
-                try:
-                    obj = json.loads(body.decode("utf-8"))
-                except Exception:
-                    await self._send_json(writer, {"ok": False, "err": "invalid json"}, 400)
-                    return
-                seq = obj.get("seq")
-                img = obj.get("image_b64", "")
-                async with S.lock:
-                    expected = S.pending_seq
+                if headers.get("content-type", "").split(";", 1)[0].strip() == "image/png":
+                    seq_s = headers.get("x-seq") or query.get("seq", "")
+                    seq = int(seq_s) if seq_s.lstrip("-").isdigit() else None
+                    img = body
+                else:
+                    try:
+                        obj = json.loads(body.decode("utf-8"))
+                        seq = obj.get("seq")
+                        img = base64.b64decode(obj.get("image_b64", ""), validate=True)
+                    except Exception:
+                        await self._send_json(writer, {"ok": False, "err": "invalid json"}, 400)
+                        return
+                async with st.lock:
+                    expected = st.pending_seq
                 if seq != expected:
                     await self._send_json(writer, {"ok": False, "err": f"seq mismatch: got {seq} expected {expected}"}, 409)
                     return
-                if not isinstance(img, str) or len(img) < 100:
-                    await self._send_json(writer, {"ok": False, "err": "image_b64 too short"}, 400)
+                if not img.startswith(PNG_SIG):
+                    await self._send_json(writer, {"ok": False, "err": "body is not a png"}, 400)
                     return
-                async with S.lock:
-                    S.annotated_b64 = img
-                    S.annotated_seq = seq
-                    S.annotated_event.set()
+                async with st.lock:
+                    st.annotated_png = img
+                    st.annotated_seq = seq
+                    st.annotated_event.set()
                 await self._send_json(writer, {"ok": True, "seq": seq})
             case "/inject":
                 try:
@@ -801,18 +3346,54 @@ class AsyncHTTPServer:
                 if not isinstance(text, str) or not text.strip():
                     await self._send_json(writer, {"ok": False, "err": "vlm_text empty"}, 400)
                     return
-                async with S.lock:
-                    S.next_vlm_json = text
-                    S.next_event.set()
+                async with st.lock:
+                    st.next_vlm_json = text
+                    st.next_dispatched = 0
+                    st.next_box = None
+                    st.next_event.set()
                 await self._send_json(writer, {"ok": True})
             case _:
                 await self._send_error(writer, 404)
 
-    async def _send_raw(self, writer: asyncio.StreamWriter, code: int, content_type: str, data: bytes) -> None:
-        status = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict"}.get(code, "OK")
+    async def _stream_events(self, sess: Session, writer: asyncio.StreamWriter) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Access-Control-Allow-Origin: *\r\n"
+            b"Connection: keep-alive\r\n"
+            b"\r\n"
+            b"retry: 2000\n\n"
+        )
+        q = sess.hub.subscribe()
+        try:
+            kind, data = "state", sess.snapshot()
+            while kind != "close" and not STOP.is_set():
+                if kind:
+                    writer.write(f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+                else:
+                    writer.write(b": ping\n\n")
+                await writer.drain()
+                try:
+                    kind, data = await asyncio.wait_for(q.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    kind, data = "", {}
+        finally:
+            sess.hub.unsubscribe(q)
+
+    async def _send_raw(
+        self, writer: asyncio.StreamWriter, code: int, content_type: str, data: bytes,
+        extra: dict[str, str] | None = None,
+    ) -> None:
+        status = {
+            200: "OK", 301: "Moved Permanently", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 409: "Conflict",
+        }.get(code, "OK")
+        extra_hdr = "".join(f"{k}: {v}\r\n" for k, v in (extra or {}).items())
         hdr = (
             f"HTTP/1.1 {code} {status}\r\n"
             f"Content-Type: {content_type}\r\n"
+            f"{extra_hdr}"
             f"Content-Length: {len(data)}\r\n"
             f"Cache-Control: no-cache\r\n"
             f"Access-Control-Allow-Origin: *\r\n"
@@ -833,12 +3414,19 @@ class AsyncHTTPServer:
 
 
 async def async_main() -> None:
-    global S, STOP
-    S = EngineState()
+    global STOP, SOURCE, SINK, DISPATCHER
     STOP = asyncio.Event()
     run_dir = make_run_dir()
+    SESSIONS.update(make_sessions(run_dir))
     setup_logging(run_dir)
-    log.info("Franz starting run_dir=%s", run_dir)
+    if any(float(s.overrides.get("TEMPERATURE", _cfg("TEMPERATURE", 0.7))) == 0.0 for s in SESSIONS.values()):
+        VLM_CACHE.load(run_dir.parent / "vlm_cache.jsonl")
+    SOURCE = make_frame_source()
+    SINK = make_input_sink()
+    DISPATCHER = VlmDispatcher(len(SESSIONS))
+    log.info("Franz starting run_dir=%s source=%s sink=%s", run_dir, SOURCE.name, SINK.name)
+    for sess in SESSIONS.values():
+        log.info("session %s url=http://%s:%d/s/%s/ overrides=%s", sess.name, HOST, PORT, sess.name, sorted(sess.overrides))
     log.info("panel=%s config=%s", PANEL_HTML, CONFIG_PATH)
     server = AsyncHTTPServer(HOST, PORT)
     await server.start()
@@ -848,21 +3436,909 @@ async def async_main() -> None:
         webbrowser.open(f"http://{HOST}:{PORT}")
     except Exception as e:
         log.warning("webbrowser.open failed: %s", e)
-    engine_task = asyncio.create_task(engine_loop(run_dir))
+    engine_tasks = [asyncio.create_task(engine_loop(sess)) for sess in SESSIONS.values()]
     try:
         await STOP.wait()
     except KeyboardInterrupt:
         STOP.set()
-    engine_task.cancel()
+    for task in engine_tasks:
+        task.cancel()
+    for sess in SESSIONS.values():
+        sess.hub.close()
+    if DISPATCHER is not None:
+        await DISPATCHER.close()
     await server.stop()
+    VLM_CLIENT.close()
+    WRITER.flush()
+    close_archives()
+    SOURCE.close()
+    for line in HIST.format():
+        log.info("stage %s", line)
     log.info("Franz stopped")
 
 
+def _bgra_to_png_reference(bgra: bytes, w: int, h: int) -> bytes:
+    stride = w * 4
+    raw = bytearray()
+    for y in range(h):
+        raw.append(0)
+        row = bgra[y * stride:(y + 1) * stride]
+        for i in range(0, len(row), 4):
+            raw.extend((row[i + 2], row[i + 1], row[i], 255))
+    return (
+        PNG_SIG
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(bytes(raw), 6))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+def _parse_vlm_json_reference(raw: str) -> tuple[str, list[dict[str, Any]], list[dict[str, Any]]]:
+    try:
+        obj = json.loads(raw)
+    except json.JSONDecodeError:
+        start, end = raw.find("{"), raw.rfind("}")
+        if start < 0 or end <= start:
+            return raw, [], []
+        try:
+            obj = json.loads(raw[start:end + 1])
+        except json.JSONDecodeError:
+            return raw, [], []
+    if not isinstance(obj, dict):
+        return raw, [], []
+    bboxes = [b for b in obj.get("bboxes", []) if isinstance(b, dict) and all(k in b for k in ("x1", "y1", "x2", "y2"))]
+    actions = [e for a in obj.get("actions", []) if (e := _norm_action(a)) is not None]
+    return str(obj.get("observation", "")), bboxes, actions
+
+
+def bench_png(args: list[str]) -> int:
+    sizes = [tuple(int(v) for v in a.lower().split("x", 1)) for a in args] or [(512, 288), (1920, 1080), (3840, 2160)]
+    _, level, strategy = _png_settings()
+    failures = 0
+    for w, h in sizes:
+        frame = _synth_fill(FrameBuffer().frame(w, h))
+        bgra = frame.tobytes()
+        t0 = time.perf_counter()
+        ref = _bgra_to_png_reference(bgra, w, h)
+        ref_ms = (time.perf_counter() - t0) * 1000
+        rgba, *_ = _png_decode(ref)
+        expect = bytearray(w * h * 3)
+        for c in range(3):
+            expect[c::3] = rgba[c::4]
+        print(f"{w}x{h} reference rgba encode_ms={ref_ms:.1f} bytes={len(ref)}")
+        for name, ftype in PNG_FILTERS.items():
+            t0 = time.perf_counter()
+            png = _bgra_to_png(frame, ftype, level, strategy)
+            ms = (time.perf_counter() - t0) * 1000
+            rgb, dw, dh, bpp = _png_decode(png)
+            same = (dw, dh, bpp) == (w, h, 3) and rgb == expect
+            failures += not same
+            print(f"{w}x{h} {name:<5} encode_ms={ms:.1f} bytes={len(png)} speedup={ref_ms / max(ms, 1e-6):.1f}x identical={same}")
+    return 1 if failures else 0
+
+
+def bench_frame(args: list[str]) -> int:
+    w, h = (int(v) for v in (args[0] if args else "3840x2160").lower().split("x", 1))
+    x1, y1, x2, y2 = w // 4, h // 4, w * 3 // 4, h * 3 // 4
+    fb = FrameBuffer()
+    results: dict[str, bytes] = {}
+    for mode in ("copy", "view"):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        for turn in range(3):
+            full = _synth_fill(fb.frame(w, h), turn)
+            if mode == "view":
+                png = _bgra_to_png(full.crop(x1, y1, x2, y2))
+            else:
+                raw = full.tobytes()
+                out = bytearray()
+                for y in range(y1, y2):
+                    out += raw[y * w * 4 + x1 * 4:y * w * 4 + x2 * 4]
+                png = _bgra_to_png(Frame(memoryview(bytes(out)), x2 - x1, y2 - y1, (x2 - x1) * 4))
+        ms = (time.perf_counter() - t0) * 1000 / 3
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[mode] = _png_decode(png)[0]
+        print(f"{w}x{h} crop={x2 - x1}x{y2 - y1} mode={mode} ms_per_turn={ms:.1f} peak_alloc_mb={peak / 1e6:.1f}")
+    same = results["copy"] == results["view"]
+    print(f"identical={same}")
+    return 0 if same else 1
+
+
+def _run_turn_records(run_dir: Path) -> list[dict[str, Any]]:
+    if (run_dir / ARCHIVE_NAME).exists():
+        arc = RunArchive(run_dir / ARCHIVE_NAME)
+        try:
+            return [rec for t in arc.turns() if (rec := arc.get_json(t, "turn"))]
+        finally:
+            arc.close()
+    out: list[dict[str, Any]] = []
+    path = run_dir / "turns.jsonl"
+    if path.exists():
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                rec = json.loads(line)
+                if rec.get("stage") == "raw":
+                    out.append(rec)
+    for p in sorted(run_dir.glob("turn_*/vlm_output.json")):
+        out.append(json.loads(p.read_text(encoding="utf-8")))
+    return out
+
+
+def _turn_png(run_dir: Path, turn: int, kind: str) -> bytes | None:
+    if (run_dir / ARCHIVE_NAME).exists():
+        arc = RunArchive(run_dir / ARCHIVE_NAME)
+        try:
+            return arc.get(turn, f"{kind}_png")
+        finally:
+            arc.close()
+    blob = _blob_refs(run_dir).get((turn, kind))
+    for p in (run_dir / f"turn_{turn:04d}_{kind}.png", run_dir / f"turn_{turn:04d}" / f"screenshot_{kind}.png",
+              *([BlobStore.path(_blob_root(run_dir), blob)] if blob else [])):
+        if p.exists():
+            return p.read_bytes()
+    return None
+
+
+def _run_turn_metrics(run_dir: Path) -> dict[int, dict[str, Any]]:
+    if (run_dir / ARCHIVE_NAME).exists():
+        arc = RunArchive(run_dir / ARCHIVE_NAME)
+        try:
+            return {t: rec for t in arc.turns() if (rec := arc.get_json(t, "metrics"))}
+        finally:
+            arc.close()
+    out: dict[int, dict[str, Any]] = {}
+    if (path := run_dir / "turns.jsonl").exists():
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                if (rec := json.loads(line)).get("stage") == "vlm":
+                    out[int(rec["turn"])] = rec
+    for p in run_dir.glob("turn_*/metrics.json"):
+        rec = json.loads(p.read_text(encoding="utf-8"))
+        out[int(rec["turn"])] = rec
+    return out
+
+
+def _turn_rois(run_dir: Path, turn: int) -> list[bytes]:
+    if (run_dir / ARCHIVE_NAME).exists():
+        arc = RunArchive(run_dir / ARCHIVE_NAME)
+        try:
+            return arc.rois(turn)
+        finally:
+            arc.close()
+    files = list(run_dir.glob(f"turn_{turn:04d}_roi_*.png")) or list((run_dir / f"turn_{turn:04d}").glob("roi_*.png"))
+    return [p.read_bytes() for p in sorted(files, key=lambda p: int(p.stem.rsplit("_", 1)[1]))]
+
+
+def convert_run(src: Path, dst: Path, layout: str) -> int:
+    """Rewrites every turn of src (any layout) into dst with the given LOG_LAYOUT; returns the number of turns."""
+    CFG.LOG_LAYOUT, CFG.BACKGROUND_WRITES, CFG.FRAME_DEDUP = layout, False, False
+    dst.mkdir(parents=True, exist_ok=True)
+    metrics = _run_turn_metrics(src)
+    n = 0
+    for rec in _run_turn_records(src):
+        turn = int(rec["turn"])
+        parse = {k: rec[k] for k in ("repairs", "vlm_raw") if k in rec}
+        save_turn_data(dst, turn, str(rec.get("observation", "")), rec.get("bboxes") or [], rec.get("actions") or [],
+                       _turn_png(src, turn, "raw") or b"", rec.get("diff") or {}, parse)
+        if ann := _turn_png(src, turn, "annotated"):
+            save_annotated(dst, turn, ann)
+        if rois := _turn_rois(src, turn):
+            save_rois(dst, turn, [(png, {}) for png in rois])
+        if m := metrics.get(turn):
+            save_turn_metrics(dst, turn, {k: v for k, v in m.items() if k not in ("turn", "stage")})
+        n += 1
+    LOGW.flush()
+    if src.resolve() != dst.resolve():
+        for name in ("main.log", "state_index.jsonl"):
+            if (src / name).exists():
+                (dst / name).write_bytes((src / name).read_bytes())
+    close_archives()
+    return n
+
+
+def archive_cmd(args: list[str]) -> int:
+    logging.basicConfig(level=logging.WARNING)
+    match args:
+        case ["pack", src, *rest]:
+            dst = Path(rest[0]) if rest else Path(src)
+            stage = dst / ".pack.tmp"
+            for p in (dst / ARCHIVE_NAME, dst / f"{ARCHIVE_NAME}.idx", stage):
+                if p.exists():
+                    print(f"{p} already exists (remove it if it is a partial archive)")
+                    return 1
+            t0 = time.perf_counter()
+            # Packing in place: readers prefer run.frz as soon as it exists, so build it aside and move it in last.
+            in_place = dst.resolve() == Path(src).resolve()
+            n = convert_run(Path(src), stage if in_place else dst, "archive")
+            if in_place:
+                if n:
+                    os.replace(stage / f"{ARCHIVE_NAME}.idx", dst / f"{ARCHIVE_NAME}.idx")
+                    os.replace(stage / ARCHIVE_NAME, dst / ARCHIVE_NAME)
+                for p in stage.iterdir():
+                    p.unlink()
+                stage.rmdir()
+            size = (dst / ARCHIVE_NAME).stat().st_size if n else 0
+            print(f"packed turns={n} into {dst / ARCHIVE_NAME} bytes={size} in {time.perf_counter() - t0:.2f}s")
+            return 0 if n else 1
+        case ["unpack", src, dst, *rest]:
+            layout = rest[0] if rest else "flat"
+            if layout not in ("flat", "turn_dirs"):
+                print("layout must be flat or turn_dirs")
+                return 2
+            n = convert_run(Path(src), Path(dst), layout)
+            print(f"unpacked turns={n} into {dst} layout={layout}")
+            return 0 if n else 1
+        case ["verify", src]:
+            arc = RunArchive(Path(src) / ARCHIVE_NAME)
+            records = list(arc._scan(len(_ARC_FILE_MAGIC)))
+            stale = sum(1 for off, t, k, seq, _ in records if seq <= 1 and arc._slot(t)[k] != off)
+            size = arc.path.stat().st_size
+            end = records[-1][0] + _ARC_HDR.size + records[-1][4] if records else len(_ARC_FILE_MAGIC)
+            print(f"turns={len(arc.turns())} records={len(records)} bytes={size} torn_tail_bytes={size - end} "
+                  f"unindexed={len(arc._extra)} stale_index={stale}")
+            arc.close()
+            return 1 if stale else 0
+    print("usage: main.py archive pack <run_dir> [out_dir] | unpack <run_dir> <out_dir> [flat|turn_dirs] | verify <run_dir>")
+    return 2
+
+
+def blobs_cmd(args: list[str]) -> int:
+    dry = "--dry-run" in args
+    args = [a for a in args if a != "--dry-run"]
+    min_age = 600.0
+    if "--min-age" in args:
+        i = args.index("--min-age")
+        min_age = float(args[i + 1])
+        del args[i:i + 2]
+    if not args or args[0] not in ("stats", "prune"):
+        print("usage: main.py blobs stats|prune [runs_dir] [--dry-run] [--min-age SECONDS]")
+        return 2
+    runs = Path(args[1]) if len(args) > 1 else HERE / str(_cfg("RUNS_DIR", "runs"))
+    root = runs / "blobs"
+    refs: collections.Counter[str] = collections.Counter()
+    for path in runs.rglob("turns.jsonl"):
+        with path.open(encoding="utf-8") as f:
+            refs.update(m.group(3) for line in f if "_blob" in line and (m := _BLOB_REF.search(line)))
+    blobs = {p.stem: p for p in root.glob("??/*.png")} if root.is_dir() else {}
+    sizes = {d: p.stat().st_size for d, p in blobs.items()}
+    logical = sum(sizes.get(d, 0) * n for d, n in refs.items())
+    missing = sum(1 for d in refs if d not in blobs)
+    print(f"blobs={len(blobs)} bytes={sum(sizes.values())} refs={sum(refs.values())} referenced={len(refs)} "
+          f"logical_bytes={logical} saved_bytes={logical - sum(sizes[d] for d in refs if d in sizes)} missing={missing}")
+    if args[0] == "stats":
+        for d, n in refs.most_common(5):
+            print(f"  {d[:16]} refs={n} bytes={sizes.get(d, 0)}")
+        return 1 if missing else 0
+    now, freed, removed = time.time(), 0, 0
+    for d, p in blobs.items():
+        if refs[d] or now - p.stat().st_mtime < min_age:
+            continue
+        freed += sizes[d]
+        removed += 1
+        if not dry:
+            p.unlink(missing_ok=True)
+            try:
+                p.parent.rmdir()
+            except OSError:
+                pass
+    for tmp in root.glob("??/*.tmp") if root.is_dir() else []:
+        if now - tmp.stat().st_mtime >= min_age and not dry:
+            tmp.unlink(missing_ok=True)
+    print(f"{'would remove' if dry else 'removed'} blobs={removed} bytes={freed} (unreferenced, older than {min_age:g}s)")
+    return 0
+
+
+def iter_run_records(run_dir: Path) -> Iterator[dict[str, Any]]:
+    """Streams the stage="raw" and stage="vlm" records of a run (flat, turn_dirs or archive) one at a time."""
+    if (run_dir / ARCHIVE_NAME).exists():
+        arc = RunArchive(run_dir / ARCHIVE_NAME)
+        try:
+            yield from arc.iter_json()
+        finally:
+            arc.close()
+        return
+    if (path := run_dir / "turns.jsonl").exists():
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                if '"stage":"annotated"' not in line:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+    for td in sorted(run_dir.glob("turn_*/")):
+        for name, stage in (("vlm_output.json", "raw"), ("metrics.json", "vlm")):
+            if (p := td / name).exists():
+                yield {"stage": stage, **json.loads(p.read_text(encoding="utf-8"))}
+
+
+def _is_run_dir(d: Path) -> bool:
+    return (d / "turns.jsonl").exists() or (d / ARCHIVE_NAME).exists() or any(d.glob("turn_*/"))
+
+
+def analyze_run(run_dir: str) -> dict[str, Any]:
+    """One streaming pass over a run; memory grows with distinct observations, not with turns."""
+    t0 = time.perf_counter()
+    bounds = StageHistograms.BOUNDS_MS
+    stages: dict[str, list[Any]] = {}  # stage -> [bucket counts, total ms, max ms]
+    obs_counts: collections.Counter[str] = collections.Counter()
+    names: collections.Counter[str] = collections.Counter()
+    grid = [0] * 100
+    usage: collections.Counter[str] = collections.Counter()
+    c: collections.Counter[str] = collections.Counter()
+    turns = n_actions = empty = diff_frames = unchanged = repaired = 0
+    obs_streak = act_streak = best_obs = best_act = 0
+    prev_obs: str | None = None
+    prev_actions: list[Any] | None = None
+    for rec in iter_run_records(Path(run_dir)):
+        if rec.get("stage") == "vlm":
+            c["vlm_records"] += 1
+            for k, v in (rec.get("timings_ms") or {}).items():
+                if (agg := stages.get(k)) is None:
+                    agg = stages[k] = [[0] * (len(bounds) + 1), 0.0, 0.0]
+                agg[0][bisect.bisect_left(bounds, v)] += 1
+                agg[1] += v
+                if v > agg[2]:
+                    agg[2] = v
+            if u := rec.get("usage"):
+                usage.update({k: v for k, v in u.items() if isinstance(v, (int, float))})
+            http = rec.get("http") or {}
+            c["errors"] += bool(rec.get("error"))
+            c["cache_hits"] += http.get("cache") == "hit"
+            c["retried"] += (http.get("attempts") or 1) > 1
+            c["similar_frames"] += bool((rec.get("state") or {}).get("similar"))
+            continue
+        turns += 1
+        obs = str(rec.get("observation", ""))
+        obs_counts[obs] += 1
+        obs_streak = obs_streak + 1 if obs == prev_obs else 1
+        best_obs = max(best_obs, obs_streak)
+        actions = rec.get("actions") or []
+        act_streak = act_streak + 1 if actions == prev_actions else 1
+        best_act = max(best_act, act_streak)
+        prev_obs, prev_actions = obs, actions
+        n_actions += len(actions)
+        empty += not actions
+        for a in actions:
+            names[a.get("name", "")] += 1
+            x, y = a.get("x1") or 0, a.get("y1") or 0
+            grid[min(9, max(0, int(y)) // 100) * 10 + min(9, max(0, int(x)) // 100)] += 1
+        if diff := rec.get("diff"):
+            diff_frames += 1
+            unchanged += not diff.get("changed", True)
+        repaired += bool(rec.get("repairs"))
+    hist = StageHistograms()
+    latency: dict[str, dict[str, Any]] = {}
+    for k, (counts, total, peak) in stages.items():
+        n = sum(counts)
+        latency[k] = {"count": n, "mean_ms": round(total / n, 2), "p50_le_ms": hist._quantile(counts, 0.5),
+                      "p95_le_ms": hist._quantile(counts, 0.95), "max_ms": round(peak, 2)}
+    repeated = turns - len(obs_counts)
+    return {
+        "run_dir": run_dir,
+        "turns": turns,
+        "latency_ms": latency,
+        "observations": {
+            "unique": len(obs_counts), "repeated_turns": repeated, "repeat_rate": round(repeated / max(1, turns), 4),
+            "longest_streak": best_obs,
+            "top": [{"count": n, "text": o[:80]} for o, n in obs_counts.most_common(5) if n > 1],
+        },
+        "actions": {
+            "total": n_actions, "per_turn": round(n_actions / max(1, turns), 2), "empty_turns": empty,
+            "longest_identical_streak": best_act, "by_name": dict(names.most_common()),
+            "grid_10x10_rows_y": [grid[r * 10:r * 10 + 10] for r in range(10)],
+        },
+        "frames": {
+            "with_diff": diff_frames, "unchanged": unchanged, "unchanged_rate": round(unchanged / max(1, diff_frames), 4),
+            "similar_to_earlier": c["similar_frames"],
+        },
+        "vlm": {
+            "records": c["vlm_records"], "errors": c["errors"], "retried": c["retried"], "cache_hits": c["cache_hits"],
+            "repaired_turns": repaired, "usage": dict(usage),
+        },
+        "elapsed_s": round(time.perf_counter() - t0, 3),
+    }
+
+
+def analyze_cmd(args: list[str]) -> int:
+    jobs = os.cpu_count() or 1
+    if "--jobs" in args:
+        i = args.index("--jobs")
+        jobs = max(1, int(args[i + 1]))
+        del args[i:i + 2]
+    if not args:
+        print("usage: main.py analyze <run_dir | runs_dir> ... [--jobs N]")
+        return 2
+    runs: list[Path] = []
+    for a in map(Path, args):
+        if _is_run_dir(a):
+            runs.append(a)
+        else:
+            for d in sorted(p for p in a.glob("*/") if p.name != "blobs"):
+                runs += [d] if _is_run_dir(d) else [s for s in sorted(d.glob("*/")) if _is_run_dir(s)]
+    if not runs:
+        print(f"no runs found in {' '.join(args)}")
+        return 1
+    t0 = time.perf_counter()
+    if len(runs) == 1 or jobs == 1:
+        results = [analyze_run(str(r)) for r in runs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(runs))) as pool:
+            results = list(pool.map(analyze_run, map(str, runs), chunksize=1))
+    for res in results:
+        try:
+            (Path(res["run_dir"]) / "analysis.json").write_text(json.dumps(res, ensure_ascii=False, indent=1), encoding="utf-8")
+        except OSError as e:
+            print(f"write analysis.json failed for {res['run_dir']}: {e}")
+        lat = res["latency_ms"].get("turn", {})
+        print(
+            f"{res['run_dir']} turns={res['turns']} turn_mean_ms={lat.get('mean_ms', 0)} "
+            f"obs_repeat={res['observations']['repeat_rate']:.1%} obs_streak={res['observations']['longest_streak']} "
+            f"actions/turn={res['actions']['per_turn']} unchanged={res['frames']['unchanged_rate']:.1%} "
+            f"errors={res['vlm']['errors']} tokens={res['vlm']['usage'].get('total_tokens', 0)} "
+            f"analyzed_in={res['elapsed_s']}s"
+        )
+    if len(results) == 1:
+        res = results[0]
+        for k, v in sorted(res["latency_ms"].items(), key=lambda kv: -kv[1]["mean_ms"]):
+            print(f"  {k:<15} n={v['count']:<7} mean_ms={v['mean_ms']:9.2f} p95<={v['p95_le_ms']:<7g} max_ms={v['max_ms']:9.2f}")
+        print(f"  actions {res['actions']['by_name']}")
+        for t in res["observations"]["top"]:
+            print(f"  repeated x{t['count']}: {t['text']!r}")
+    print(f"runs={len(results)} elapsed_s={time.perf_counter() - t0:.2f}")
+    return 0
+
+
+def _recorded_responses(run_dir: Path) -> list[tuple[int, str, str, dict[str, Any]]]:
+    """(turn, observation sent with turn's frame, text the model answered, the answer's turn record)."""
+    recs = sorted(_run_turn_records(run_dir), key=lambda r: int(r.get("turn", 0)))
+    out: list[tuple[int, str, str, dict[str, Any]]] = []
+    for rec, nxt in zip(recs, recs[1:]):
+        if int(nxt.get("turn", 0)) == int(rec.get("turn", 0)) + 1:
+            text = nxt.get("vlm_raw") or json.dumps({k: nxt.get(k) for k in ("observation", "bboxes", "actions")})
+            out.append((int(rec["turn"]), str(rec.get("observation", "")), str(text), nxt))
+    return out
+
+
+def make_stub_vlm(
+    host: str, port: int, responses: list[tuple[str, str]], latency_ms: float = 0.0, jitter_ms: float = 0.0,
+) -> Any:
+    """OpenAI-style chat completions stub that answers with recorded responses."""
+    import http.server
+
+    by_obs: dict[str, list[str]] = {}
+    for obs, text in responses:
+        by_obs.setdefault(obs, []).append(text)
+    texts = [t for _, t in responses] or [str(_cfg("BOOT_VLM_OUTPUT", ""))]
+    counter = itertools.count()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            try:
+                req = json.loads(body)
+                obs = next(p.get("text", "") for m in req["messages"] if m.get("role") == "user" for p in m["content"])
+            except (ValueError, KeyError, TypeError, StopIteration):
+                req, obs = {}, ""
+            n = next(counter)
+            options = by_obs.get(obs) or texts
+            text = options[n % len(options)]
+            time.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+            usage = {"prompt_tokens": len(body) // 4, "completion_tokens": len(text) // 4,
+                     "total_tokens": len(body) // 4 + len(text) // 4}
+            if req.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                events = [{"choices": [{"delta": {"content": text[i:i + 16]}}]} for i in range(0, len(text), 16)]
+                events.append({"choices": [], "usage": usage})
+                for chunk in [*(f"data: {json.dumps(ev)}\n\n".encode() for ev in events), b"data: [DONE]\n\n"]:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.write(b"0\r\n\r\n")
+                return
+            out = json.dumps({"choices": [{"message": {"role": "assistant", "content": text}}], "usage": usage}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def _stub_args(args: list[str]) -> tuple[list[str], dict[str, float]]:
+    opts = {"--port": 1235.0, "--latency-ms": 0.0, "--jitter-ms": 0.0, "--concurrency": 0.0, "--limit": 0.0}
+    rest: list[str] = []
+    it = iter(args)
+    for a in it:
+        if a in opts:
+            opts[a] = float(next(it))
+        else:
+            rest.append(a)
+    return rest, opts
+
+
+def stub_vlm_cmd(args: list[str]) -> int:
+    rest, opts = _stub_args(args)
+    responses = [(obs, text) for _, obs, text, _ in _recorded_responses(Path(rest[0]))] if rest else []
+    server = make_stub_vlm(HOST, int(opts["--port"]), responses, opts["--latency-ms"], opts["--jitter-ms"])
+    print(f"stub VLM on http://{HOST}:{server.server_address[1]}/v1/chat/completions "
+          f"responses={len(responses) or 'BOOT_VLM_OUTPUT'} latency_ms={opts['--latency-ms']:g}+/-{opts['--jitter-ms']:g}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _pct(values: list[float], q: float) -> float:
+    return round(sorted(values)[min(len(values) - 1, int(q * len(values)))], 1) if values else 0.0
+
+
+def replay_vlm(args: list[str]) -> int:
+    """Re-sends each recorded (observation, annotated frame) to API_URL and compares with the recorded answers."""
+    rest, opts = _stub_args(args)
+    stub = "--stub" in rest
+    rest = [a for a in rest if a != "--stub"]
+    if not rest:
+        print("usage: main.py replay-vlm <run_dir> [--concurrency N] [--limit N] [--stub [--latency-ms X] [--jitter-ms Y]]")
+        return 2
+    run_dir = Path(rest[0])
+    logging.basicConfig(level=logging.WARNING)
+    CFG.VLM_CACHE_SIZE = 0
+    cases = _recorded_responses(run_dir)
+    if opts["--limit"]:
+        cases = cases[:int(opts["--limit"])]
+    if not cases:
+        print(f"no consecutive recorded turns in {run_dir}")
+        return 1
+    metrics = _run_turn_metrics(run_dir)
+    server = None
+    if stub:
+        server = make_stub_vlm("127.0.0.1", 0, [(obs, text) for _, obs, text, _ in cases], opts["--latency-ms"], opts["--jitter-ms"])
+        threading.Thread(target=server.serve_forever, name="stub-vlm", daemon=True).start()
+        CFG.API_URL = f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+    concurrency = int(opts["--concurrency"]) or int(_cfg("VLM_MAX_IN_FLIGHT", 4) or 1)
+
+    def one(case: tuple[int, str, str, dict[str, Any]]) -> dict[str, Any]:
+        turn, obs, _, orig = case
+        m = metrics.get(turn) or {}
+        row: dict[str, Any] = {
+            "turn": turn, "orig_ms": (m.get("timings_ms") or {}).get("vlm"), "orig_error": m.get("error"),
+            "orig_ok": "$:no_object" not in (orig.get("repairs") or []), "orig_repairs": orig.get("repairs") or [],
+            "orig_actions": [a.get("name") for a in orig.get("actions") or []], "orig_bboxes": len(orig.get("bboxes") or []),
+        }
+        if not (png := _turn_png(run_dir, turn, "annotated")):
+            return {**row, "error": "no annotated frame"}
+        t0 = time.perf_counter()
+        text, usage, err, _ = call_vlm(obs, png)
+        row.update(ms=round((time.perf_counter() - t0) * 1000, 1), error=err, usage=usage, text=text)
+        if not err:
+            _, bboxes, actions, repairs = parse_vlm_json(text)
+            row.update(ok="$:no_object" not in repairs, repairs=repairs, actions=[a["name"] for a in actions], bboxes=len(bboxes))
+        return row
+
+    print(f"replaying turns={len(cases)} to {_cfg('API_URL')} concurrency={concurrency}{' (stub)' if stub else ''}")
+    t0 = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        rows = list(pool.map(one, cases))
+    wall = time.perf_counter() - t0
+    if server is not None:
+        server.shutdown()
+    VLM_CLIENT.close()
+    out = run_dir / f"replay_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+    with out.open("w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    done = [r for r in rows if "ok" in r]
+    n = max(1, len(done))
+    orig_ms = [float(r["orig_ms"]) for r in done if r["orig_ms"] is not None]
+    new_ms = [float(r["ms"]) for r in done]
+    print(f"replayed={len(rows)} answered={len(done)} errors={sum(1 for r in rows if r.get('error'))} "
+          f"wall_s={wall:.2f} turns_per_s={len(rows) / wall:.2f}")
+    print(f"{'':<16} {'recorded':>10} {'replay':>10}")
+    for label, a, b in (
+        ("parse_ok", sum(r["orig_ok"] for r in done), sum(r["ok"] for r in done)),
+        ("clean_json", sum(not r["orig_repairs"] for r in done), sum(not r["repairs"] for r in done)),
+        ("actions_mean", sum(len(r["orig_actions"]) for r in done) / n, sum(len(r["actions"]) for r in done) / n),
+        ("bboxes_mean", sum(r["orig_bboxes"] for r in done) / n, sum(r["bboxes"] for r in done) / n),
+        ("latency_mean_ms", sum(orig_ms) / max(1, len(orig_ms)), sum(new_ms) / n),
+        ("latency_p50_ms", _pct(orig_ms, 0.5), _pct(new_ms, 0.5)),
+        ("latency_p95_ms", _pct(orig_ms, 0.95), _pct(new_ms, 0.95)),
+    ):
+        print(f"{label:<16} {a:>10.4g} {b:>10.4g}")
+    same_count = sum(len(r["orig_actions"]) == len(r["actions"]) for r in done)
+    same_names = sum(r["orig_actions"] == r["actions"] for r in done)
+    print(f"same_action_count={same_count / n:.1%} same_action_names={same_names / n:.1%} rows={out}")
+    return 0
+
+
+def _recorded_vlm_outputs(run_dir: Path) -> list[str]:
+    return [json.dumps({k: rec.get(k) for k in ("observation", "bboxes", "actions")}) for rec in _run_turn_records(run_dir)]
+
+
+def _parse_corpus(clean: str) -> list[tuple[str, str, bool]]:
+    """Malformed variants of one clean output: (kind, text, complete). Complete variants must parse identically."""
+    obj = json.loads(clean)
+    pretty = json.dumps(obj, indent=2)
+    out = [
+        ("fence", f"```json\n{pretty}\n```", True),
+        ("prose", f"Here is my answer:\n{clean}\nLet me know if you need more.", True),
+        ("trailing_comma", re.sub(r"([}\]\d\"])(\s*[}\]])", r"\1,\2", pretty), True),
+        ("missing_comma", pretty.replace("},\n", "}\n"), True),
+        ("single_quotes", clean.replace("'", "").replace('"', "'"), True),
+        ("python_literal", clean.replace("true", "True").replace("false", "False").replace("null", "None"), True),
+        ("two_objects", f'{clean}\n{{"observation": "second", "actions": []}}', True),
+    ]
+    out += [(f"truncated_{p}%", clean[:len(clean) * p // 100], False) for p in range(10, 100, 10)]
+    return out
+
+
+PARSE_CORPUS: Final[Path] = HERE / "fixtures" / "parse" / "malformed.jsonl"
+
+
+def _collect_malformed(paths: list[str]) -> int:
+    known = {json.loads(line)["vlm_raw"] for line in PARSE_CORPUS.open(encoding="utf-8")} if PARSE_CORPUS.exists() else set()
+    added = 0
+    with PARSE_CORPUS.open("a", encoding="utf-8", newline="\n") as f:
+        for a in paths:
+            root = Path(a)
+            for run_dir in [root] if _is_run_dir(root) else sorted(d for d in root.iterdir() if d.is_dir() and _is_run_dir(d)):
+                for rec in _run_turn_records(run_dir):
+                    if (raw := rec.get("vlm_raw")) and raw not in known:
+                        known.add(raw)
+                        entry = {"source": f"{run_dir.name}/turn_{int(rec['turn']):04d}", "vlm_raw": raw,
+                                 "expect_actions": len(parse_vlm_json(raw)[2])}
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                        added += 1
+    print(f"added={added} corpus={len(known)} file={PARSE_CORPUS}")
+    return 0
+
+
+def bench_parse(args: list[str]) -> int:
+    logging.disable(logging.WARNING)
+    if args[:1] == ["--collect"]:
+        return _collect_malformed(args[1:])
+    corpus: list[tuple[str, str, bool, str]] = []
+    expect: dict[str, int] = {}
+    clean = [str(_cfg("BOOT_VLM_OUTPUT", ""))]
+    for a in args or [str(PARSE_CORPUS)]:
+        path = Path(a)
+        recs = _run_turn_records(path) if path.is_dir() else [json.loads(line) for line in path.open(encoding="utf-8")]
+        for r in recs:
+            if raw := r.get("vlm_raw"):
+                corpus.append(("corpus", str(raw), False, ""))
+                if "expect_actions" in r:
+                    expect[str(raw)] = int(r["expect_actions"])
+            else:
+                clean.append(json.dumps({k: r.get(k) for k in ("observation", "bboxes", "actions")}))
+    n_corpus = len(corpus)
+    for c in clean:
+        try:
+            corpus += [(*variant, c) for variant in _parse_corpus(c)]
+        except (json.JSONDecodeError, TypeError):
+            continue
+    baseline = {c: parse_vlm_json(c)[:3] for c in clean}
+    stats: dict[str, list[float]] = {}  # kind -> [samples, old actions, new actions, old lost, new lost, old us, new us]
+    mismatches = regressions = 0
+    repeat = 20
+    for kind, text, complete, src in corpus:
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            old = _parse_vlm_json_reference(text)
+        t1 = time.perf_counter()
+        for _ in range(repeat):
+            new = parse_vlm_json(text)
+        t2 = time.perf_counter()
+        row = stats.setdefault(kind.split("_")[0] if kind.startswith("truncated") else kind, [0] * 7)
+        for k, v in enumerate((1, len(old[2]), len(new[2]), not (old[1] or old[2]), not (new[1] or new[2]),
+                               (t1 - t0) * 1e6 / repeat, (t2 - t1) * 1e6 / repeat)):
+            row[k] += v
+        if complete and new[:3] != baseline[src]:
+            mismatches += 1
+            print(f"MISMATCH {kind}: {text[:80]!r}")
+        if len(new[2]) < expect.get(text, 0):
+            regressions += 1
+            print(f"REGRESSION actions={len(new[2])} expected={expect[text]}: {text[:80]!r}")
+    print(f"{'kind':<15} {'samples':>7} {'old_actions':>11} {'new_actions':>11} {'old_lost':>8} {'new_lost':>8} "
+          f"{'old_us':>7} {'new_us':>7}")
+    for kind, (n, oa, na, ol, nl, ou, nu) in stats.items():
+        print(f"{kind:<15} {n:>7} {oa:>11} {na:>11} {ol:>8} {nl:>8} {ou / n:>7.1f} {nu / n:>7.1f}")
+    n = max(1, len(corpus))
+    print(f"samples={len(corpus)} corpus={n_corpus} old_us_per_parse={sum(r[5] for r in stats.values()) / n:.1f} "
+          f"new_us_per_parse={sum(r[6] for r in stats.values()) / n:.1f} mismatches={mismatches} regressions={regressions}")
+    return 1 if mismatches or regressions else 0
+
+
+async def _bench_loop(turns: int, run_dir: Path) -> None:
+    global STOP, SOURCE, SINK
+    SESSIONS.clear()
+    SESSIONS["main"] = sess = Session("main", run_dir)
+    STOP = asyncio.Event()
+    SOURCE, SINK = make_frame_source(), NullInputSink()
+    replay = str(_cfg("FRAME_SOURCE", "gdi")).lower() == "replay"
+    outputs = (replay and _recorded_vlm_outputs(HERE / str(_cfg("REPLAY_RUN_DIR", "")))) or [str(_cfg("BOOT_VLM_OUTPUT", ""))]
+
+    def echo_vlm(observation: str, annotated_png: bytes, **_: Any) -> tuple[str, dict[str, Any], str | None, dict[str, Any]]:
+        return outputs[sess.state.turn % len(outputs)], {}, None, {}
+
+    try:
+        await engine_loop(sess, echo_vlm, turns)
+    finally:
+        WRITER.flush()
+        LOGW.flush()
+        close_archives()
+        SOURCE.close()
+
+
+def bench_loop(args: list[str]) -> int:
+    import tempfile
+    turns = int(args[0]) if args else 20
+    if str(_cfg("FRAME_SOURCE", "gdi")).lower() == "gdi" and os.name != "nt":
+        CFG.FRAME_SOURCE = "synthetic"
+    CFG.ANNOTATION_MODE, CFG.BOOT_ENABLED, CFG.LOG_LAYOUT = "passthrough", True, "flat"
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        run_dir = Path(tmp)
+        t0 = time.perf_counter()
+        asyncio.run(_bench_loop(turns, run_dir))
+        elapsed = time.perf_counter() - t0
+    turns = SESSIONS["main"].state.turn
+    print(f"source={_cfg('FRAME_SOURCE')} turns={turns} elapsed_s={elapsed:.2f} turns_per_s={turns / elapsed:.2f}")
+    for line in HIST.format():
+        print(line)
+    return 0
+
+
+def _legacy_sleep_s(actions: list[dict[str, Any]]) -> float:
+    steps, step_d = int(_cfg("DRAG_DURATION_STEPS", 20)), float(_cfg("DRAG_STEP_DELAY", 0.01))
+    per = {"click": 0.06, "right_click": 0.06, "double_click": 0.18, "drag": 0.09 + max(1, steps) * step_d}
+    return sum(per.get(a.get("name", ""), 0.0) + float(_cfg("ACTION_DELAY_SECONDS", 0.05)) for a in actions)
+
+
+def plan_actions_cmd(args: list[str]) -> int:
+    global SOURCE
+    if str(_cfg("FRAME_SOURCE", "gdi")).lower() == "gdi" and os.name != "nt":
+        CFG.FRAME_SOURCE = "synthetic"
+    SOURCE = make_frame_source()
+    logging.basicConfig(level=logging.ERROR)
+    verbose = "-v" in args
+    args = [a for a in args if a != "-v"]
+    path = Path(args[0]) if args and Path(args[0]).exists() else None
+    names = [a.lower() for a in args[1 if path else 0:]] or list(_cfg("INPUT_PROFILES", {}) or {"normal": {}})
+    if path is None:
+        _, _, actions, _ = parse_vlm_json(str(_cfg("BOOT_VLM_OUTPUT", "")))
+        turns = [actions]
+    elif path.is_dir():
+        turns = [rec.get("actions") or [] for rec in _run_turn_records(path)]
+    else:
+        turns = [parse_vlm_json(path.read_text(encoding="utf-8"))[2]]
+    n_actions = sum(map(len, turns))
+    print(f"turns={len(turns)} actions={n_actions} legacy_sleep_ms={sum(map(_legacy_sleep_s, turns)) * 1000:.1f}")
+    failed = 0
+    for name in names:
+        prof = input_profile(name)
+        plans = [plan_actions(t, prof, random.Random(0)) for t in turns]
+        total = {k: sum(plan_summary(p)[k] for p in plans) for k in ("events", "batches", "sleeps", "sleep_ms")}
+        # With a settle pause, a button event must never share a batch with the move before it.
+        unsettled = sum(
+            1 for p in plans for step in p for a, b in zip(step.events, step.events[1:]) if not a[2] and b[2]
+        ) if float(prof["settle"]) > 0 else 0
+        failed += bool(unsettled)
+        print(f"profile={name:<7} events={total['events']} batches={total['batches']} sleeps={total['sleeps']} "
+              f"sleep_ms={total['sleep_ms']:.1f} unsettled_presses={unsettled}")
+        if verbose and len(turns) == 1:
+            for step in plans[0]:
+                print(f"  action={step.action} events={list(step.events)} wait_ms={step.wait * 1000:.1f}")
+    SOURCE.close()
+    return 1 if failed else 0
+
+
+ANNOTATE_FIXTURE: Final[Path] = HERE / "fixtures" / "annotate"
+
+
+def _px_diff(a: bytes, b: bytes) -> list[int]:
+    d = list(map(abs, map(operator.sub, a, b)))
+    return list(map(max, d[0::4], d[1::4], d[2::4]))
+
+
+def annotate_check(args: list[str]) -> int:
+    run_dir = Path(args[0]) if args else ANNOTATE_FIXTURE
+    if not run_dir.is_dir():
+        print("usage: main.py annotate-check [run_dir] [tolerance=12] [max_mismatch_pct=0.25]")
+        return 2
+    tol = int(args[1]) if len(args) > 1 else 12
+    max_pct = float(args[2]) if len(args) > 2 else 0.25
+    box_alpha = _css_rgba(_LABEL_BG)[3]
+    renderer, bare, checked, failed = AnnotationRenderer(), AnnotationRenderer(), 0, 0
+    for rec in _run_turn_records(run_dir):
+        turn = int(rec.get("turn", 0))
+        raw_png, ref_png = _turn_png(run_dir, turn, "raw"), _turn_png(run_dir, turn, "annotated")
+        if not (raw_png and ref_png):
+            continue
+        raw, ref = _decode_bgra(raw_png), _decode_bgra(ref_png)
+        actions = rec.get("actions") or []
+        ours = renderer.render(raw, turn, rec.get("bboxes") or [], actions)
+        base = bare.render(raw, turn, rec.get("bboxes") or [], actions, labels=False)
+        checked += 1
+        if (ours.width, ours.height) != (ref.width, ref.height):
+            print(f"turn {turn:04d} FAIL size {ours.width}x{ours.height} != {ref.width}x{ref.height}")
+            failed += 1
+            continue
+        a, b, c = ours.tobytes(), ref.tobytes(), base.tobytes()
+        px, drawn, covered = _px_diff(a, b), _px_diff(a, c), _px_diff(b, c)
+        w, h = ours.width, ours.height
+        # 0 heat, 1 around a label, 2 the box's 1 px edge (fractional canvas coordinates), 3 box interior
+        zone = bytearray(len(px))
+        for x1, y1, x2, y2 in AnnotationRenderer.label_rects(w, h, actions):
+            for y in range(max(0, y1 - 3), min(h, y2 + 3)):
+                for x in range(max(0, x1 - 3), min(w, x2 + 3)):
+                    k = 3 if x1 < x < x2 - 1 and y1 < y < y2 - 1 else 2 if x1 - 1 <= x <= x2 and y1 - 1 <= y <= y2 else 1
+                    zone[y * w + x] = max(zone[y * w + x], k)
+        heat = [v for v, z in zip(px, zone) if not z]
+        pct = 100 * sum(v > tol for v in heat) / max(1, len(heat))
+        # The box only shows where it darkens the pixels under it beyond the tolerance.
+        box = [i for i, z in enumerate(zone) if z in (1, 3) and max(c[i * 4:i * 4 + 3]) * box_alpha > tol]
+        box_pct = 100 * sum((drawn[i] > tol) != (covered[i] > tol) for i in box) / max(1, len(box))
+        # Browser glyphs differ from the 5x7 font; the median over box pixels is the fill colour error.
+        fill = sorted(px[i] for i in box if zone[i] == 3 and drawn[i] > tol and a[i * 4:i * 4 + 3] != b"\xff\xff\xff")
+        fill_err = fill[len(fill) // 2] if fill else 0
+        ok = pct <= max_pct and box_pct <= max_pct and fill_err <= tol
+        failed += not ok
+        print(
+            f"turn {turn:04d} {'ok  ' if ok else 'FAIL'} heat_mae={sum(heat) / max(1, len(heat)):6.2f} "
+            f"heat_mismatch={pct:6.3f}% max={max(heat, default=0):3d} "
+            f"label_box_mismatch={box_pct:6.3f}% label_fill_err={fill_err:3d}"
+        )
+    if not checked:
+        print(f"no turns with both raw and annotated PNGs in {run_dir}")
+        return 2
+    print(f"run={run_dir} checked={checked} failed={failed} tolerance={tol} max_mismatch_pct={max_pct} "
+          f"stamp_cache={STAMPS.stats()}")
+    return 1 if failed else 0
+
+
 def main() -> None:
+    match sys.argv[1:]:
+        case ["bench-png", *rest]:
+            raise SystemExit(bench_png(rest))
+        case ["bench-frame", *rest]:
+            raise SystemExit(bench_frame(rest))
+        case ["bench-loop", *rest]:
+            raise SystemExit(bench_loop(rest))
+        case ["bench-parse", *rest]:
+            raise SystemExit(bench_parse(rest))
+        case ["plan-actions", *rest]:
+            raise SystemExit(plan_actions_cmd(rest))
+        case ["replay-vlm", *rest]:
+            raise SystemExit(replay_vlm(rest))
+        case ["stub-vlm", *rest]:
+            raise SystemExit(stub_vlm_cmd(rest))
+        case ["analyze", *rest]:
+            raise SystemExit(analyze_cmd(rest))
+        case ["blobs", *rest]:
+            raise SystemExit(blobs_cmd(rest))
+        case ["archive", *rest]:
+            raise SystemExit(archive_cmd(rest))
+        case ["annotate-check", *rest]:
+            raise SystemExit(annotate_check(rest))
     try:
         asyncio.run(async_main())
     except KeyboardInterrupt:
         pass
+    finally:
+        LOGW.close()
 
 
 if __name__ == "__main__":